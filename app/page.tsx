@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useRouter } from 'next/navigation';
 
 interface Task {
@@ -11,26 +11,44 @@ interface Task {
   result?: string;
 }
 
+// Only the fields shown in the task list, so that the large results are not transferred on every poll
+const TASK_LIST_FIELDS = "task_id,task_description,status,date";
+
 export default function Home() {
   const [tasks, setTasks] = useState<Task[]>([]);
   const [newTask, setNewTask] = useState("");
   const [mounted, setMounted] = useState(false);
   const router = useRouter();
+  // Tasks received so far by ID, and the server time to ask for the changes since on the next poll
+  const tasksById = useRef<Map<string, Task>>(new Map());
+  const lastSyncTime = useRef<string | null>(null);
 
   const fetchTasks = async () => {
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/tasks`);
+      const params = new URLSearchParams({ fields: TASK_LIST_FIELDS });
+      if (lastSyncTime.current) {
+        params.set("updated_since", lastSyncTime.current);
+      }
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/tasks?${params}`);
       const data = await response.json();
       
-      const updatedTasks = Object.values(data.tasks).map((task: any) => ({
-        task_id: task.task_id,
-        task_description: task.task_description,
-        status: task.status.charAt(0).toUpperCase() + task.status.slice(1),
-        date: task.date,
-        result: task.result
-      }));
+      if (!lastSyncTime.current) {
+        tasksById.current.clear();
+      }
+      Object.values(data.tasks).forEach((task: any) => {
+        tasksById.current.set(task.task_id, {
+          task_id: task.task_id,
+          task_description: task.task_description,
+          status: task.status.charAt(0).toUpperCase() + task.status.slice(1),
+          date: task.date,
+        });
+      });
+      (data.deleted ?? []).forEach((taskId: string) => tasksById.current.delete(taskId));
+      lastSyncTime.current = data.server_time ?? null;
       
-      setTasks(updatedTasks);
+      setTasks(
+        Array.from(tasksById.current.values()).sort((a, b) => a.date.localeCompare(b.date))
+      );
     } catch (error) {
       console.error("Error fetching tasks:", error);
     }
@@ -39,8 +57,21 @@ export default function Home() {
   useEffect(() => {
     setMounted(true);
     fetchTasks();
-    const interval = setInterval(fetchTasks, 2000);
-    return () => clearInterval(interval);
+    // The server pushes an event whenever a task changes, and only the changes are fetched then.
+    // The slow poll is only a fallback in case the event stream is down.
+    const events = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/tasks/events`);
+    const onEvent = () => fetchTasks();
+    const onReset = () => {
+      lastSyncTime.current = null;
+      fetchTasks();
+    };
+    ["status", "thought", "deleted"].forEach((type) => events.addEventListener(type, onEvent));
+    events.addEventListener("reset", onReset);
+    const interval = setInterval(fetchTasks, 30000);
+    return () => {
+      events.close();
+      clearInterval(interval);
+    };
   }, []);
 
   if (!mounted) {
@@ -60,6 +91,11 @@ export default function Home() {
       if (!response.ok) throw new Error("Failed to add task");
 
       const newTaskData = await response.json();
+      if (newTaskData.deduplicated && tasks.some(task => task.task_id === newTaskData.task_id)) {
+        // The query is already running (or just completed) as one of the listed tasks
+        setNewTask("");
+        return;
+      }
       setTasks([...tasks, { 
         task_id: newTaskData.task_id, 
         task_description: newTask, 
@@ -79,6 +115,7 @@ export default function Home() {
       });
 
       if (!response.ok) throw new Error('Failed to delete task');
+      tasksById.current.delete(taskId);
       setTasks(tasks.filter(task => task.task_id !== taskId));
     } catch (error) {
       console.error('Error deleting task:', error);
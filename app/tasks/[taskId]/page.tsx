@@ -143,6 +143,13 @@ export default function TaskPage() {
       }
     };
     fetchTaskDetails();
+
+    // Refresh the details whenever the task's status changes or it has a new thought
+    const events = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/tasks/${taskId}/events`);
+    events.addEventListener("status", fetchTaskDetails);
+    events.addEventListener("thought", fetchTaskDetails);
+    events.addEventListener("reset", fetchTaskDetails);
+    return () => events.close();
   }, [taskId]);
 
   if (loading) {
@@ -0,0 +1,97 @@
+"""
+Throughput benchmark of the task queue workers.
+
+The agent run is replaced by an asyncio.sleep of a fixed latency, so the benchmark measures the queueing,
+the store updates and the worker pool rather than the LLM. Run from the repository root:
+
+    python -m backend.bench_workers --tasks 200 --latency 0.1 --workers 1,2,4,8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import types
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _install_stub_services(latency):
+    """
+    Register a stand-in for backend.services, whose import loads the agent config and the models, with a
+    query_tiny_agent that only sleeps for the given latency.
+    """
+    services = types.ModuleType("backend.services")
+    services.TASK_TIMEOUT = 30.0
+
+    async def query_tiny_agent(query):
+        await asyncio.sleep(latency)
+        return f"Response to {query}", {}
+
+    services.query_tiny_agent = query_tiny_agent
+    sys.modules["backend.services"] = services
+
+
+def _wait_for_tasks(task_queue, task_ids):
+    """Block until all the given tasks are finished, following the status events of the task queue."""
+    remaining = set(task_ids)
+    last_event_id = 0
+    while remaining:
+        events, last_event_id = task_queue.event_bus.wait_for_events(last_event_id, timeout=1.0)
+        if events is None:
+            # Some events were dropped from the buffer, fall back to the store
+            remaining = {
+                task_id for task_id in remaining
+                if task_queue.task_store.get(task_id)["status"] not in FINISHED_STATUSES
+            }
+            continue
+        for event in events:
+            if event["type"] == "status" and event["data"]["status"] in FINISHED_STATUSES:
+                remaining.discard(event["task_id"])
+
+
+def run_benchmark(num_tasks, latency, worker_counts):
+    """Run num_tasks tasks with each number of workers and return a list of (workers, seconds, tasks/sec)."""
+    # Keep the benchmark tasks out of the real database and never reject a submission
+    os.environ["TINYAGENT_TASK_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_tasks.db")
+    os.environ["TINYAGENT_MAX_QUEUE_SIZE"] = "0"
+    os.environ.setdefault("TINYAGENT_MAX_TASKS", str(num_tasks * len(worker_counts) + 1))
+    _install_stub_services(latency)
+    from backend import task_queue
+
+    results = []
+    for num_workers in sorted(worker_counts):
+        # The workers never stop, so the pool is grown to the next size instead of restarted
+        task_queue.start_workers(num_workers - len(task_queue.workers))
+
+        start_time = time.perf_counter()
+        task_ids = [
+            task_queue.add_task(f"benchmark query {num_workers}-{i}", dedup=False)[0]
+            for i in range(num_tasks)
+        ]
+        _wait_for_tasks(task_queue, task_ids)
+        duration = time.perf_counter() - start_time
+        results.append((num_workers, duration, num_tasks / duration))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=200, help="Number of tasks per worker count")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds that each stub agent run takes")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma-separated numbers of workers")
+    args = parser.parse_args()
+
+    worker_counts = [int(value) for value in args.workers.split(",")]
+    results = run_benchmark(args.tasks, args.latency, worker_counts)
+
+    base_throughput = results[0][2]
+    print(f"{args.tasks} tasks of {args.latency:g}s each")
+    print(f"{'workers':>8} {'seconds':>9} {'tasks/s':>9} {'speedup':>8}")
+    for num_workers, duration, throughput in results:
+        print(f"{num_workers:>8} {duration:>9.2f} {throughput:>9.1f} {throughput / base_throughput:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
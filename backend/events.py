@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Number of recent events kept for the clients that reconnect with a Last-Event-ID
+MAX_BUFFERED_EVENTS = int(os.environ.get("TINYAGENT_MAX_BUFFERED_EVENTS", "1000"))
+# Interval of the keep-alive comments sent on idle streams
+HEARTBEAT_INTERVAL = 15.0
+
+
+class EventBus:
+    """
+    In-process bus of the task events (status changes and thoughts).
+    Events get increasing IDs and the most recent ones are kept in a ring buffer, so that a client that
+    reconnects with the ID of the last event it saw gets everything it missed. The subscribers block
+    on a condition that is notified on every publish, so idle streams don't poll.
+    """
+
+    def __init__(self, max_events=MAX_BUFFERED_EVENTS):
+        self._events = deque(maxlen=max_events)
+        self._next_id = 1
+        self._condition = threading.Condition()
+
+    def publish(self, event_type, task_id, data):
+        """Publish an event of the given task and return its ID."""
+        with self._condition:
+            event = {
+                "id": self._next_id,
+                "type": event_type,
+                "task_id": task_id,
+                "timestamp": datetime.now().isoformat(),
+                "data": data,
+            }
+            self._next_id += 1
+            self._events.append(event)
+            self._condition.notify_all()
+        return event["id"]
+
+    @property
+    def last_event_id(self):
+        with self._condition:
+            return self._next_id - 1
+
+    def get_events(self, last_event_id, task_id=None):
+        """
+        Return the events after last_event_id, optionally only the ones of the given task, and the ID to
+        resume from next time. The events are None if some of them were already dropped from the buffer
+        (or the ID is from a previous run of the server), in which case the client has to reload the tasks.
+        """
+        with self._condition:
+            return self._get_events(last_event_id, task_id)
+
+    def wait_for_events(self, last_event_id, task_id=None, timeout=HEARTBEAT_INTERVAL):
+        """
+        Same as get_events, but blocks until there is at least one new event (of the given task, if any)
+        or the timeout passes. The events of the other tasks don't end the wait.
+        """
+        end_time = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events, latest_event_id = self._get_events(last_event_id, task_id)
+                remaining = end_time - time.monotonic()
+                if events is None or len(events) > 0 or remaining <= 0:
+                    return events, latest_event_id
+                # Skip the events of the other tasks, so that they can drop out of the buffer meanwhile
+                last_event_id = latest_event_id
+                self._condition.wait_for(lambda: self._next_id - 1 != last_event_id, remaining)
+
+    def _get_events(self, last_event_id, task_id):
+        latest_event_id = self._next_id - 1
+        if last_event_id > latest_event_id:
+            # The ID is from a previous run of the server
+            return None, latest_event_id
+        if len(self._events) > 0 and last_event_id < self._events[0]["id"] - 1:
+            return None, latest_event_id
+        events = [
+            event for event in self._events
+            if event["id"] > last_event_id and (task_id is None or event["task_id"] == task_id)
+        ]
+        return events, latest_event_id
+
+
+def format_sse(event):
+    """Format an event as a server-sent event."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_events(event_bus, last_event_id, task_id=None):
+    """
+    Generator of the server-sent events after last_event_id, which runs until the client disconnects.
+    Sends a heartbeat comment whenever there was no event for HEARTBEAT_INTERVAL seconds.
+    """
+    # Tell the client how long to wait before reconnecting
+    yield "retry: 1000\n\n"
+    while True:
+        events, last_event_id = event_bus.wait_for_events(last_event_id, task_id)
+        if events is None:
+            # The client missed some events, so it has to reload the tasks before following the stream
+            yield format_sse({"id": last_event_id, "type": "reset", "task_id": task_id, "data": {}})
+        elif len(events) == 0:
+            yield ": heartbeat\n\n"
+        else:
+            for event in events:
+                yield format_sse(event)
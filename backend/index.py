@@ -1,10 +1,12 @@
+import os
+
 from flask import Flask
 from .routes import tinyagent_bp
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import enum
 from flask_cors import CORS
-from . import task_queue  # Add this import
+from . import task_queue
 
 # db = SQLAlchemy()
 migrate = Migrate()
@@ -16,7 +18,14 @@ app.register_blueprint(tinyagent_bp)
 # db.init_app(app)
 # migrate.init_app(app, db)
 
-# The task queue worker thread will start automatically when imported
+
+def is_reloader_process():
+    """
+    Whether this is the process that serves the requests when the Flask reloader is used. The reloader
+    runs the server in a child process with WERKZEUG_RUN_MAIN set, while the parent only watches the files.
+    """
+    return os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
 
 @app.route("/")
 def home():
@@ -27,4 +36,10 @@ def hello_world():
     return "<p>Hello, World!</p>"
 
 if __name__ == '__main__':
+    # debug=True uses the reloader, so the workers are only started in its child process
+    if is_reloader_process():
+        task_queue.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
+elif not app.debug or is_reloader_process():
+    # Loaded by `flask run` or a WSGI server
+    task_queue.start()
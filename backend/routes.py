@@ -1,11 +1,49 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
+from queue import Full
 from .services import query_tiny_agent
-from .task_queue import add_task, get_task_status, get_all_tasks, task_status
+from .events import stream_events
+from .task_queue import IdempotencyKeyMismatch, add_task, get_task_status, query_tasks, get_deleted_task_ids, delete_task as delete_task_by_id, cancel_task as cancel_task_by_id, event_bus, get_queue_stats
+from .scheduler import DEFAULT_PRIORITY, PRIORITIES
+from .task_store import decode_cursor, now
 
 tinyagent_bp = Blueprint('tinyagent', __name__)
 
+# Fields of the /tasks response and the task data keys they come from
+TASK_FIELDS = {
+    "task_id": "task_id",
+    "task_description": "task_description",
+    "result": "response",
+    "status": "status",
+    "date": "date",
+    "started_at": "started_at",
+    "completed_at": "completed_at",
+    "error_message": "error_message",
+    "updated_at": "updated_at",
+    "thoughts": "thoughts",
+    "agent_log": "parsed_agent_log",
+    "metadata": "metadata",
+}
+DEFAULT_TASK_FIELDS = [
+    "task_id", "task_description", "result", "status", "date",
+    "started_at", "completed_at", "error_message", "updated_at",
+]
+# Fields that are stored in their own columns rather than in the task data
+COLUMN_TASK_FIELDS = {"task_id", "status", "updated_at"}
+MAX_TASKS_PAGE_SIZE = 500
+# The next updated_since overlaps the previous request by this much, so that updates that were
+# committed while the previous request was running are not missed. Clients merge tasks by ID.
+DELTA_SYNC_OVERLAP = timedelta(seconds=1)
+
+def _parse_timestamp(value):
+    """Parse an ISO timestamp into the format of the stored ones. Raises ValueError if it is malformed."""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        # The stored timestamps are in local time
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp.isoformat(timespec="microseconds")
+
 @tinyagent_bp.route('/test', methods=['GET'])
 def test():
     """Test route to trigger TinyAgent asynchronously."""
@@ -15,29 +53,102 @@ def test():
 
 @tinyagent_bp.route('/tasks', methods=['GET'])
 def get_tasks():
-    """Get all tasks and their statuses."""
-    tasks_data = get_all_tasks()
+    """
+    Get the tasks and their statuses, oldest first.
+    Optional query parameters:
+    - status: comma-separated statuses to filter by
+    - fields: comma-separated fields to return, which defaults to the summary fields
+    - limit, cursor: page size, and the next_cursor of the previous page
+    - updated_since: only return the tasks that changed after this time (server_time of the previous
+      response), along with the IDs of the tasks deleted since then
+    """
+    fields = request.args.get("fields")
+    fields = fields.split(",") if fields else DEFAULT_TASK_FIELDS
+    unknown_fields = [field for field in fields if field not in TASK_FIELDS]
+    if unknown_fields:
+        return jsonify({"error": f"Unknown fields: {unknown_fields}"}), 400
+
+    statuses = request.args.get("status")
+    statuses = statuses.split(",") if statuses else None
+
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) == 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(int(limit), MAX_TASKS_PAGE_SIZE)
+
+    updated_since = request.args.get("updated_since")
+    if updated_since is not None:
+        try:
+            updated_since = _parse_timestamp(updated_since)
+        except ValueError:
+            return jsonify({"error": "updated_since must be an ISO 8601 timestamp"}), 400
+
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    server_time = (datetime.fromisoformat(now()) - DELTA_SYNC_OVERLAP).isoformat(timespec="microseconds")
+
+    keys = [TASK_FIELDS[field] for field in fields if field not in COLUMN_TASK_FIELDS]
+    try:
+        tasks, next_cursor = query_tasks(
+            keys=keys,
+            statuses=statuses,
+            updated_since=updated_since,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     tasks_list = {
-        task_id: {
-            "task_id": task_id,
-            "task_description": task_info.get("task_description", ""),
-            "result": task_info.get("response", ""),
-            "status": task_info["status"],
-            "date": task_info.get("date", ""),
-            "started_at": task_info.get("started_at"),
-            "completed_at": task_info.get("completed_at"),
-            "error_message": task_info.get("error_message")
-        }
-        for task_id, task_info in tasks_data.items()
+        task["task_id"]: {field: task.get(TASK_FIELDS[field]) for field in fields}
+        for task in tasks
     }
-    return jsonify({"tasks": tasks_list})
+    response = {"tasks": tasks_list, "next_cursor": next_cursor, "server_time": server_time}
+    if updated_since is not None:
+        response["deleted"] = get_deleted_task_ids(updated_since)
+    return jsonify(response)
+
+def _event_stream_response(task_id=None):
+    """Server-sent events of the tasks, resuming after the Last-Event-ID if the client reconnects."""
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    if last_event_id is None:
+        # New clients only get the events from now on, they load the current state separately
+        last_event_id = event_bus.last_event_id
+    elif not last_event_id.isdigit():
+        return jsonify({"error": "Last-Event-ID must be a non-negative integer"}), 400
+
+    return Response(
+        stream_with_context(stream_events(event_bus, int(last_event_id), task_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@tinyagent_bp.route('/tasks/stats', methods=['GET'])
+def get_tasks_stats():
+    """Get the queue-wait time statistics per priority class."""
+    return jsonify(get_queue_stats())
+
+@tinyagent_bp.route('/tasks/events', methods=['GET'])
+def get_tasks_events():
+    """Stream the status changes and thoughts of all tasks."""
+    return _event_stream_response()
+
+@tinyagent_bp.route('/tasks/<task_id>/events', methods=['GET'])
+def get_task_events(task_id):
+    """Stream the status changes and thoughts of a specific task."""
+    return _event_stream_response(task_id)
 
 @tinyagent_bp.route('/tasks/<task_id>', methods=['GET'])
 def get_task(task_id):
     """Retrieve a specific task by its ID with detailed information."""
     task = get_task_status(task_id)
     if task == "not found":
-        return jsonify({"error": f"Task not found, task id: {task_id}. Task Status: {task_status}; Args: {request.view_args}; URL: {request.url}"}), 404
+        return jsonify({"error": f"Task not found, task id: {task_id}. Args: {request.view_args}; URL: {request.url}"}), 404
     
     # Convert task object to dictionary if it's not already
     if not isinstance(task, dict):
@@ -57,7 +168,7 @@ def get_task(task_id):
         "error_message": task.get("error_message"),
         "metadata": {
             "agent_version": task.get("agent_version", "1.0"),
-            "priority": task.get("priority", "normal"),
+            "priority": task.get("metadata", {}).get("priority", DEFAULT_PRIORITY),
             "retries": task.get("retries", 0)
         }
     }
@@ -73,35 +184,79 @@ def submit_task():
     
     if not query_text:
         return jsonify({"error": "Query is required"}), 400
+
+    priority = data.get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"Priority must be one of {list(PRIORITIES)}"}), 400
+    # Tasks are shared fairly between the clients, identified by the header or their address
+    client_id = request.headers.get("X-Client-Id") or request.remote_addr
     
-    # Create task with enhanced initial data
-    task_id = add_task(query_text)
-    
-    # Update task with additional metadata
-    if task_id in task_status:
-        task_status[task_id].update({
-            "started_at": datetime.now().isoformat(),
-            "parsed_agent_log": {},
-            "thoughts": [],  # Initialize empty thoughts array
-            "metadata": {
-                "agent_version": "1.0",
-                "priority": "normal",
-                "retries": 0
-            }
-        })
+    # Retries of the same submission send the same key and get the task of the first one
+    idempotency_key = request.headers.get("Idempotency-Key")
+    # Clients can opt into the content-based deduplication, or out of it when the deployment turns it on
+    dedup = data.get("dedup")
+    if dedup is not None and not isinstance(dedup, bool):
+        return jsonify({"error": "dedup must be a boolean"}), 400
     
+    # Create task with enhanced initial data
+    try:
+        task_id, deduplicated = add_task(
+            query_text,
+            priority=priority,
+            client_id=client_id,
+            idempotency_key=idempotency_key,
+            dedup=dedup,
+        )
+    except IdempotencyKeyMismatch as e:
+        return jsonify({"error": str(e)}), 422
+    except Full:
+        return jsonify({"error": "Task queue is full, please try again later"}), 503
+
+    if deduplicated:
+        task = get_task_status(task_id)
+        if task != "not found":
+            return jsonify({
+                "task_id": task_id,
+                "status": task["status"],
+                "date": task["date"],
+                "deduplicated": True
+            })
+        # The task that served the submission was deleted in the meantime, so run the query after all
+        try:
+            task_id, _ = add_task(
+                query_text,
+                priority=priority,
+                client_id=client_id,
+                idempotency_key=idempotency_key,
+                dedup=False,
+            )
+        except IdempotencyKeyMismatch as e:
+            return jsonify({"error": str(e)}), 422
+        except Full:
+            return jsonify({"error": "Task queue is full, please try again later"}), 503
+
+    # The task is already queued with all its fields, a worker may even be running it by now
     return jsonify({
         "task_id": task_id,
         "status": "pending",
-        "date": datetime.now().isoformat()
+        "date": datetime.now().isoformat(),
+        "deduplicated": False
     })
 
+@tinyagent_bp.route('/tasks/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """Cancel a queued or running task."""
+    if cancel_task_by_id(task_id):
+        return jsonify({'message': 'Task cancelled successfully'}), 200
+    if get_task_status(task_id) == "not found":
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify({'error': 'Task is not queued or running'}), 409
+
 @tinyagent_bp.route('/tasks/<task_id>', methods=['DELETE'])
 def delete_task(task_id):
     """Delete a specific task."""
     try:
-        if task_id in task_status:
-            del task_status[task_id]
+        if delete_task_by_id(task_id):
             return jsonify({'message': 'Task deleted successfully'}), 200
         return jsonify({'error': 'Task not found'}), 404
     except Exception as e:
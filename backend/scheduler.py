@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import deque
+from queue import Full
+
+# Priority classes, from the most to the least urgent
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+# A waiting task is promoted by one priority class every AGING_SECONDS, so low priority tasks never starve
+AGING_SECONDS = float(os.environ.get("TINYAGENT_QUEUE_AGING_SECONDS", "30"))
+# Number of recent queue-wait samples kept per priority class for the percentiles
+WAIT_SAMPLES = 1000
+
+
+class FairPriorityQueue:
+    """
+    Task queue that serves the higher priority classes first, with aging, and shares each class fairly
+    between the clients: every client has its own FIFO and the clients of a class take turns.
+    It has the same blocking put/get/task_done interface as queue.Queue for the items it holds.
+    """
+
+    def __init__(self, maxsize=0, aging_seconds=AGING_SECONDS):
+        self.maxsize = maxsize
+        self.aging_seconds = aging_seconds
+        self._condition = threading.Condition()
+        # Per priority class: the FIFO of (enqueued_at, item) of each client, and the clients in turn order
+        self._client_queues = {priority: {} for priority in PRIORITIES}
+        self._client_turns = {priority: deque() for priority in PRIORITIES}
+        self._size = 0
+        self._unfinished_tasks = 0
+        self._wait_times = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+        self._num_dequeued = {priority: 0 for priority in PRIORITIES}
+
+    def qsize(self):
+        with self._condition:
+            return self._size
+
+    def put_nowait(self, item, priority=DEFAULT_PRIORITY, client_id=None):
+        """Add an item to the queue. Raises queue.Full if the queue is full."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        with self._condition:
+            if self.maxsize > 0 and self._size >= self.maxsize:
+                raise Full
+
+            client_queues = self._client_queues[priority]
+            if client_id not in client_queues:
+                client_queues[client_id] = deque()
+                self._client_turns[priority].append(client_id)
+            client_queues[client_id].append((time.monotonic(), item))
+            self._size += 1
+            self._unfinished_tasks += 1
+            self._condition.notify()
+
+    def get(self):
+        """Remove and return the next item, blocking until one is available."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._size > 0)
+            now = time.monotonic()
+            priority = min(
+                (priority for priority in PRIORITIES if self._client_turns[priority]),
+                key=lambda priority: self._get_effective_rank(priority, now),
+            )
+
+            client_turns = self._client_turns[priority]
+            client_id = client_turns.popleft()
+            client_queue = self._client_queues[priority][client_id]
+            enqueued_at, item = client_queue.popleft()
+            if client_queue:
+                # The client goes to the back of the line for its next task
+                client_turns.append(client_id)
+            else:
+                del self._client_queues[priority][client_id]
+
+            self._size -= 1
+            self._wait_times[priority].append(now - enqueued_at)
+            self._num_dequeued[priority] += 1
+            return item
+
+    def _get_effective_rank(self, priority, now):
+        # The rank of a class is the one of the task that would be served next in it, promoted by its age
+        client_id = self._client_turns[priority][0]
+        enqueued_at, _ = self._client_queues[priority][client_id][0]
+        return (PRIORITIES.index(priority) - (now - enqueued_at) / self.aging_seconds, PRIORITIES.index(priority))
+
+    def task_done(self):
+        with self._condition:
+            self._unfinished_tasks -= 1
+
+    def remove(self, predicate):
+        """Remove the queued items for which predicate returns True. Returns the number of removed items."""
+        num_removed = 0
+        with self._condition:
+            for priority in PRIORITIES:
+                client_queues = self._client_queues[priority]
+                for client_id in list(client_queues):
+                    client_queue = client_queues[client_id]
+                    kept = deque(entry for entry in client_queue if not predicate(entry[1]))
+                    if len(kept) == len(client_queue):
+                        continue
+                    num_removed += len(client_queue) - len(kept)
+                    if kept:
+                        client_queues[client_id] = kept
+                    else:
+                        del client_queues[client_id]
+                        self._client_turns[priority].remove(client_id)
+            self._size -= num_removed
+            self._unfinished_tasks -= num_removed
+        return num_removed
+
+    def get_stats(self):
+        """Queue-wait time statistics per priority class, in seconds."""
+        with self._condition:
+            stats = {"queued": self._size, "priorities": {}}
+            for priority in PRIORITIES:
+                wait_times = sorted(self._wait_times[priority])
+                stats["priorities"][priority] = {
+                    "queued": sum(len(queue) for queue in self._client_queues[priority].values()),
+                    "dequeued": self._num_dequeued[priority],
+                    "mean_wait": sum(wait_times) / len(wait_times) if wait_times else None,
+                    "p50_wait": _percentile(wait_times, 0.5),
+                    "p95_wait": _percentile(wait_times, 0.95),
+                    "max_wait": wait_times[-1] if wait_times else None,
+                }
+            return stats
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
@@ -1,76 +1,89 @@
 import asyncio
-from asyncio import TimeoutError
 import os
+from asyncio import TimeoutError
 
-from tinyagent.src.tiny_agent.tiny_agent import TinyAgent
+from tinyagent.src.llm_compiler.deadline import Deadline, StageBudgets
+from tinyagent.src.llm_compiler.trace import RunTrace
+from tinyagent.src.tiny_agent.agent_pool import TinyAgentPool
 from tinyagent.src.tiny_agent.config import get_tiny_agent_config
-
-# Get the user's home directory and construct the path
-HOME_DIR = os.path.expanduser("~")
-AGENT_LOG_FILE_PATH = os.path.join(HOME_DIR, "Library", "Application Support", "TinyAgent", "log.txt")
+from tinyagent.src.tiny_agent.models import TinyAgentToolName
 
 CONFIG_PATH = "config.json"
+# Time budget of a task in seconds, from the start of the agent run to its answer
+TASK_TIMEOUT = float(os.environ.get("TINYAGENT_TASK_TIMEOUT", "30"))
+
+
+def _get_budget(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+# Optional budgets of the planner, of each tool call and of the joinner, within TASK_TIMEOUT
+STAGE_BUDGETS = StageBudgets(
+    planner=_get_budget("TINYAGENT_PLANNER_TIMEOUT"),
+    task=_get_budget("TINYAGENT_TOOL_TIMEOUT"),
+    joinner=_get_budget("TINYAGENT_JOINNER_TIMEOUT"),
+)
+# Extra time given to a run after its deadline to wrap up with a partial answer before it is cancelled
+DEADLINE_GRACE_SECONDS = 5.0
+
 tiny_agent_config = get_tiny_agent_config(config_path=CONFIG_PATH)
+# Warm TinyAgent instances shared by the task queue workers
+tiny_agent_pool = TinyAgentPool()
 
 
-def parse_agent_log():
+def build_agent_log(trace: RunTrace):
     """
-    Parse the first three sections of the agent scratchpad.
-    Returns a tuple of (task_log, planner_response, agent_scratchpad)
+    Builds the agent log shown in the task view from the trace of the run.
+    Returns a dict of (task_log, planner_response, agent_scratchpad)
     """
-    
-    with open(AGENT_LOG_FILE_PATH, "r") as f:
-        content = f.read()
-    
-    task_log_end = content.find("=" * 80)
-    task_log = content[:task_log_end].strip()
-
-    planner_start = content.find("LLMCompiler planner response:", task_log_end)
-    next_delimiter = content.find("=" * 80, planner_start)
-    planner_response = content[planner_start:next_delimiter].strip()
-    planner_response = planner_response.replace("LLMCompiler planner response:", "").strip()
-
-    scratchpad_start = content.find("Agent scratchpad:", next_delimiter)
-    next_delimiter = content.find("=" * 80, scratchpad_start)
-    agent_scratchpad = content[scratchpad_start:next_delimiter].strip()
-    agent_scratchpad = agent_scratchpad.replace("Agent scratchpad:", "").strip()
+    task_log = []
+    for task in trace.tasks:
+        if task.is_join:
+            continue
+        duration = f" ({task.duration:.2f}s)" if task.duration is not None else ""
+        task_log.append(f"{task.idx}. {task.name}{duration}")
 
     return {
-        "task_log": task_log,
-        "planner_response": planner_response,
-        "agent_scratchpad": agent_scratchpad
+        "task_log": "\n".join(task_log),
+        "planner_response": trace.planner_response,
+        "agent_scratchpad": trace.agent_scratchpad
     }
     
     
-async def query_tiny_agent(query: str):
+async def query_tiny_agent(query: str, timeout: float = TASK_TIMEOUT):
     """
     Runs TinyAgent with the given query and returns the response.
-    Exits if the query takes longer than 30 seconds.
+    The run gets a deadline of timeout seconds, which is split into the per-stage budgets, so that it
+    returns a partial answer instead of failing when it runs out of time. Raises TimeoutError if the
+    run still doesn't finish within the grace period after the deadline.
     """
     
-    # Clear log file before initializing agent
-    open(AGENT_LOG_FILE_PATH, 'w').close()
-    tiny_agent = TinyAgent(tiny_agent_config)
+    tiny_agent = tiny_agent_pool.acquire(tiny_agent_config)
+    discard = True
 
     try:
-        task = asyncio.create_task(tiny_agent.arun(query=query))
+        deadline = Deadline.after(timeout, STAGE_BUDGETS)
+        task = asyncio.create_task(tiny_agent.arun_with_trace(query=query, deadline=deadline))
                 
-        response = await asyncio.wait_for(task, timeout=30.0)        
-        parsed_log = parse_agent_log()
+        try:
+            # Safety net for the code that the deadline doesn't cover, such as the tool retrieval
+            response, trace = await asyncio.wait_for(task, timeout=timeout + DEADLINE_GRACE_SECONDS)
+        except TimeoutError:
+            print(f"Query timed out after {timeout} seconds:", query)
+            raise
+        parsed_log = build_agent_log(trace)
         
-        if 'SONAR' in parsed_log["agent_scratchpad"]:
-            response = parsed_log["agent_scratchpad"].split("Completion: ")[-1]
+        sonar_observations = trace.get_observations(TinyAgentToolName.ASK_SONAR.value)
+        if len(sonar_observations) > 0:
+            response = sonar_observations[-1].split("Completion: ")[-1]
+        elif trace.is_partial:
+            # The answer lists what the agent managed to do before running out of time
+            response = trace.answer
         else:
             response = "Sucessfully executed function calls!"
         
+        discard = False
         return response, parsed_log
-        
-    except TimeoutError:
-        task.cancel()
-        
-        try:
-            await task 
-        except asyncio.CancelledError:
-            pass
-        print("Query timed out after 30 seconds:", query)
-        return None
\ No newline at end of file
+    finally:
+        tiny_agent_pool.release(tiny_agent_config, tiny_agent, discard=discard)
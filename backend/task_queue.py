@@ -1,99 +1,255 @@
 import asyncio
+import hashlib
+import json
+import os
 import uuid
-from queue import Queue
-from threading import Thread
-from datetime import datetime
-from .services import query_tiny_agent
+from queue import Full
+from threading import Lock, Thread
+from datetime import datetime, timedelta
+from .events import EventBus
+from .scheduler import DEFAULT_PRIORITY, FairPriorityQueue
+from .services import TASK_TIMEOUT, query_tiny_agent
+from .task_store import TaskStore
 import traceback
 
-# Queue to store tasks
-task_queue = Queue()
-task_status = {}  # Dictionary to store task status
+# Number of worker threads that process tasks concurrently. Each worker owns its own event loop.
+NUM_WORKERS = int(os.environ.get("TINYAGENT_NUM_WORKERS", "4"))
+# Maximum number of tasks waiting in the queue. 0 means unbounded.
+MAX_QUEUE_SIZE = int(os.environ.get("TINYAGENT_MAX_QUEUE_SIZE", "100"))
+
+# Content-based deduplication of the submitted tasks, which deployments opt into since users may submit
+# the same query on purpose:
+# - "off": every submission runs, unless the submission asks for deduplication itself
+# - "in_flight": a query that is already pending or processing for the same client is coalesced onto that task
+# - "completed": same as in_flight, and a query that completed less than DEDUP_RESULT_TTL_SECONDS ago is
+#   served from that task
+DEDUP_MODES = ("off", "in_flight", "completed")
+DEDUP_MODE = os.environ.get("TINYAGENT_DEDUP_MODE", "off")
+DEDUP_RESULT_TTL_SECONDS = float(os.environ.get("TINYAGENT_DEDUP_RESULT_TTL_SECONDS", "300"))
+if DEDUP_MODE not in DEDUP_MODES:
+    raise ValueError(f"TINYAGENT_DEDUP_MODE must be one of {DEDUP_MODES}, got {DEDUP_MODE}")
+
+# Queue to store tasks, served by priority and shared fairly between the clients
+task_queue = FairPriorityQueue(maxsize=MAX_QUEUE_SIZE)
+task_store = TaskStore()  # Persistent store of the tasks and their statuses
+event_bus = EventBus()  # Stream of the task status changes and thoughts
+workers = []  # Worker threads started by start_workers()
+
+# The running tasks by ID, with the event loop they run on, so that they can be cancelled from other threads
+running_tasks = {}
+# IDs of the tasks that were cancelled after a worker took them from the queue but before they started
+cancel_requests = set()
+running_tasks_lock = Lock()
+
+# Serializes the submissions, so that concurrent duplicates can't both create a task
+submit_lock = Lock()
+# Number of submissions that were served by an existing task, by reason
+dedup_stats = {"idempotency_key": 0, "in_flight": 0, "completed": 0}
+
+
+class IdempotencyKeyMismatch(Exception):
+    """Raised when an idempotency key is reused with a different query."""
+
+# Fields of a task that are sent along with its status events
+STATUS_EVENT_FIELDS = ("status", "started_at", "completed_at", "error_message")
+
+def _update_task(task_id, fields=None, thought=None):
+    """Update a task in the store and publish the status change and thought. Returns the updated task or None."""
+    task = task_store.update(task_id, fields, thought=thought)
+    if task is None:
+        return None
+
+    if fields and "status" in fields:
+        event_bus.publish("status", task_id, {field: task.get(field) for field in STATUS_EVENT_FIELDS})
+    if thought is not None:
+        event_bus.publish("thought", task_id, task["thoughts"][-1])
+    return task
 
 def add_thought(task_id, thought_text):
     """Helper function to add a thought to a task."""
-    if task_id in task_status:
-        if "thoughts" not in task_status[task_id]:
-            task_status[task_id]["thoughts"] = []
+    _update_task(task_id, thought=thought_text)
+
+def run_task(loop, task_id, query):
+    """Run a single task on the given event loop and record its outcome."""
+    # Update status to processing and set started_at timestamp
+    is_found = _update_task(
+        task_id,
+        {"status": "processing", "started_at": datetime.now().isoformat()},
+        thought="Starting task processing",
+    )
+    if not is_found:
+        # The task was deleted while it was waiting in the queue
+        return
+    
+    try:
+        add_thought(task_id, "Initializing agent query")
+        add_thought(task_id, f"Executing agent query with {TASK_TIMEOUT:g}-second timeout")
+        with running_tasks_lock:
+            if task_id in cancel_requests:
+                cancel_requests.discard(task_id)
+                raise asyncio.CancelledError()
+            # query_tiny_agent enforces the timeout itself through the deadline of the run
+            future = loop.create_task(query_tiny_agent(query))
+            running_tasks[task_id] = (loop, future)
+        response, parsed_log = loop.run_until_complete(future)
         
-        new_thought = {
-            "step": len(task_status[task_id]["thoughts"]) + 1,
-            "thought": thought_text,
-            "timestamp": datetime.now().isoformat()
-        }
-        task_status[task_id]["thoughts"].append(new_thought)
+        _update_task(task_id, {
+            "status": "completed",
+            "response": response,
+            "parsed_agent_log": parsed_log,
+            "completed_at": datetime.now().isoformat()
+        }, thought="Query completed successfully")
+        
+    except asyncio.CancelledError:
+        _update_task(task_id, {
+            "status": "cancelled",
+            "completed_at": datetime.now().isoformat()
+        }, thought="Task cancelled")
+
+    except asyncio.TimeoutError:
+        _update_task(task_id, {
+            "status": "failed",
+            "error_message": f"Task exceeded {TASK_TIMEOUT:g} second timeout limit",
+            "completed_at": datetime.now().isoformat()
+        }, thought="Task exceeded timeout limit")
+        
+    except Exception as e:
+        exc = traceback.format_exc()
+        _update_task(task_id, {
+            "status": "failed",
+            "response": f"Exception occured: {exc}",
+            "error_message": f"Exception: {str(e)}",
+            "error_trace": exc,
+            "completed_at": datetime.now().isoformat()
+        }, thought=f"Task failed with error: {str(e)}")
+
+    finally:
+        with running_tasks_lock:
+            running_tasks.pop(task_id, None)
+            # Drop a cancellation that came in after the task finished
+            cancel_requests.discard(task_id)
 
 def process_tasks():
-    """Worker function to process tasks from the queue."""
+    """
+    Worker function to process tasks from the queue.
+    Blocks on the queue until a task is available, so idle workers don't consume any CPU.
+    Each worker keeps a single event loop for its lifetime and runs its tasks on it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
     while True:
-        if not task_queue.empty():
-            task_id, query = task_queue.get()
-            
-            # Update status to processing and set started_at timestamp
-            task_status[task_id].update({
-                "status": "processing",
-                "started_at": datetime.now().isoformat()
-            })
-            
-            add_thought(task_id, "Starting task processing")
-            
-            try:
-                add_thought(task_id, "Initializing agent query")
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                add_thought(task_id, "Executing agent query with 30-second timeout")
-                response, parsed_log = loop.run_until_complete(
-                    asyncio.wait_for(
-                        query_tiny_agent(query), 
-                        timeout=30.0
-                    )
-                )
-                loop.close()
-                
-                add_thought(task_id, "Query completed successfully")
-                task_status[task_id].update({
-                    "status": "completed",
-                    "response": response,
-                    "parsed_agent_log": parsed_log,
-                    "completed_at": datetime.now().isoformat(),
-                    "task_description": task_status[task_id]["task_description"]
-                })
-                
-            except asyncio.TimeoutError:
-                add_thought(task_id, "Task exceeded timeout limit")
-                task_status[task_id].update({
-                    "status": "failed",
-                    "error_message": "Task exceeded 30 second timeout limit",
-                    "completed_at": datetime.now().isoformat(),
-                    "task_description": task_status[task_id]["task_description"]
-                })
-                
-            except Exception as e:
-                exc = traceback.format_exc()
-                add_thought(task_id, f"Task failed with error: {str(e)}")
-                task_status[task_id].update({
-                    "status": "failed",
-                    "response": f"Exception occured: {exc}",
-                    "error_message": f"Exception: {str(e)}",
-                    "error_trace": exc,
-                    "completed_at": datetime.now().isoformat(),
-                    "task_description": task_status[task_id]["task_description"]
-                })
-                
+        task_id, query = task_queue.get()
+        try:
+            run_task(loop, task_id, query)
+        finally:
             task_queue.task_done()
 
-# Start the background worker
-worker_thread = Thread(target=process_tasks, daemon=True)
-worker_thread.start()
+def start_workers(num_workers=NUM_WORKERS):
+    """Start the pool of background workers that share the task queue."""
+    for i in range(num_workers):
+        worker_thread = Thread(target=process_tasks, name=f"tinyagent-worker-{i}", daemon=True)
+        worker_thread.start()
+        workers.append(worker_thread)
+
+def requeue_unfinished_tasks():
+    """Put the tasks that were not finished when the server stopped back into the queue."""
+    for task in task_store.list_unfinished():
+        try:
+            task_queue.put_nowait(
+                (task["task_id"], task["task_description"]),
+                priority=task.get("metadata", {}).get("priority", DEFAULT_PRIORITY),
+                client_id=task.get("client_id"),
+            )
+        except Full:
+            _update_task(task["task_id"], {
+                "status": "failed",
+                "error_message": "Task could not be requeued after a server restart",
+                "completed_at": datetime.now().isoformat()
+            }, thought="Task could not be requeued after a server restart")
+            continue
+        _update_task(task["task_id"], {"status": "pending"}, thought="Task requeued after a server restart")
 
-def add_task(query):
-    """Add a new task to the queue and return the task ID."""
+_start_lock = Lock()
+
+def start():
+    """
+    Start the background workers and resume the work that was lost on the last shutdown.
+    Must be called once by the process that serves the requests, not at import time, since other
+    processes (e.g. the parent process of the Flask reloader) also import this module and would run the
+    requeued tasks a second time. Calling it again in the same process does nothing.
+    """
+    with _start_lock:
+        if workers:
+            return
+        start_workers()
+        requeue_unfinished_tasks()
+
+def _get_query_hash(query, client_id):
+    """Hash of the query of a client, ignoring the differences in whitespace."""
+    normalized_query = " ".join(query.split())
+    return hashlib.sha256(json.dumps([client_id, normalized_query]).encode()).hexdigest()
+
+def _get_dedup_mode(dedup):
+    """Deduplication mode of a submission: the deployment's one, unless the submission opts in or out."""
+    if dedup is None:
+        return DEDUP_MODE
+    if not dedup:
+        return "off"
+    return DEDUP_MODE if DEDUP_MODE != "off" else "in_flight"
+
+def _find_duplicate_task(query_hash, dedup_mode):
+    """Return the task that a submission with the given query hash can be served by, and the reason, or (None, None)."""
+    if dedup_mode == "off":
+        return None, None
+
+    completed_since = None
+    if dedup_mode == "completed":
+        completed_since = (datetime.now() - timedelta(seconds=DEDUP_RESULT_TTL_SECONDS)).isoformat(timespec="microseconds")
+    task = task_store.find_duplicate(query_hash, completed_since)
+    if task is None:
+        return None, None
+    return task, "completed" if task["status"] == "completed" else "in_flight"
+
+def add_task(query, priority=DEFAULT_PRIORITY, client_id=None, idempotency_key=None, dedup=None):
+    """
+    Add a new task to the queue and return the task ID and whether the submission was deduplicated.
+    A submission is served by an existing task instead if it reuses an idempotency key, or if the same
+    query of the client is in flight (or recently completed) and deduplication applies: dedup is None
+    to follow DEDUP_MODE, True to deduplicate the in-flight queries even if DEDUP_MODE is off, and False
+    to always run the submission.
+    Raises IdempotencyKeyMismatch if the idempotency key was used for a different query.
+    """
+    query_hash = _get_query_hash(query, client_id)
+
+    with submit_lock:
+        if idempotency_key is not None:
+            entry = task_store.get_idempotency_key(idempotency_key)
+            if entry is not None and task_store.exists(entry[0]):
+                task_id, request_hash = entry
+                if request_hash != query_hash:
+                    raise IdempotencyKeyMismatch(f"Idempotency key {idempotency_key} was used for a different query")
+                dedup_stats["idempotency_key"] += 1
+                return task_id, True
+
+        duplicate_task, reason = _find_duplicate_task(query_hash, _get_dedup_mode(dedup))
+        if duplicate_task is not None:
+            task_id = duplicate_task["task_id"]
+            dedup_stats[reason] += 1
+            add_thought(task_id, "Duplicate submission served by this task")
+        else:
+            task_id = _create_task(query, priority, client_id, query_hash)
+
+        if idempotency_key is not None:
+            task_store.set_idempotency_key(idempotency_key, task_id, query_hash)
+    return task_id, duplicate_task is not None
+
+def _create_task(query, priority, client_id, query_hash):
     task_id = str(uuid.uuid4())
     current_time = datetime.now().isoformat()
     
     # Initialize task with all required fields
-    task_status[task_id] = {
+    task_store.create({
         "task_id": task_id,
         "task_description": query,
         "status": "pending",
@@ -104,24 +260,92 @@ def add_task(query):
         "error_message": None,
         "thoughts": [],
         "parsed_agent_log": {},
+        "client_id": client_id,
+        "query_hash": query_hash,
         "metadata": {
             "agent_version": "1.0",
-            "priority": "normal",
+            "priority": priority,
             "retries": 0
         }
-    }
+    })
+    event_bus.publish("status", task_id, {"status": "pending", "started_at": None, "completed_at": None, "error_message": None})
     
     # Add initial thought
     add_thought(task_id, "Task created and added to queue")
     
-    # Add task to processing queue
-    task_queue.put((task_id, query))
+    # Add task to processing queue without blocking the request if the queue is full
+    try:
+        task_queue.put_nowait((task_id, query), priority=priority, client_id=client_id)
+    except Full:
+        delete_task(task_id)
+        raise
     return task_id
 
 def get_task_status(task_id):
     """Retrieve the status of a specific task."""
-    return task_status.get(task_id, "not found")
+    task = task_store.get(task_id)
+    return task if task is not None else "not found"
+
+def get_queue_stats():
+    """Return the queue-wait time statistics per priority class, and the number of deduplicated submissions."""
+    with submit_lock:
+        deduplicated = dict(dedup_stats)
+    return {**task_queue.get_stats(), "deduplicated": deduplicated}
 
 def get_all_tasks():
     """Return all tasks and their statuses."""
-    return task_status
\ No newline at end of file
+    return {task["task_id"]: task for task in task_store.list()}
+
+def query_tasks(keys=None, statuses=None, updated_since=None, cursor=None, limit=None):
+    """Return a page of tasks and the cursor of the next page. See TaskStore.query."""
+    return task_store.query(keys, statuses, updated_since, cursor, limit)
+
+def get_deleted_task_ids(since):
+    """Return the IDs of the tasks that were deleted after the given time."""
+    return task_store.deleted_since(since)
+
+def update_task(task_id, fields):
+    """Merge the given fields into a task. Returns False if the task doesn't exist."""
+    return _update_task(task_id, fields) is not None
+
+def cancel_task(task_id):
+    """
+    Cancel a queued or running task. A queued task is removed from the queue, and a running task has its
+    agent run cancelled, which also cancels its planner and tool calls and frees the worker right away.
+    Returns False if the task is neither queued nor running.
+    """
+    with running_tasks_lock:
+        # The status is read under the lock since workers record the outcome of a task before they release
+        # it under this lock. Hence a task that is unfinished here has its cancel request dropped by its
+        # worker when it's done, or below if it's still queued.
+        task = task_store.get(task_id)
+        if task is None or task["status"] not in ("pending", "processing"):
+            return False
+
+        running_task = running_tasks.get(task_id)
+        if running_task is not None:
+            loop, future = running_task
+            loop.call_soon_threadsafe(future.cancel)
+            return True
+        # A worker may have just taken the task from the queue, in which case it cancels the task itself
+        cancel_requests.add(task_id)
+
+    if task_queue.remove(lambda item: item[0] == task_id) > 0:
+        with running_tasks_lock:
+            cancel_requests.discard(task_id)
+        _update_task(task_id, {
+            "status": "cancelled",
+            "completed_at": datetime.now().isoformat()
+        }, thought="Task cancelled before it started")
+    return True
+
+def delete_task(task_id):
+    """Delete a task, cancelling it first if it is queued or running. Returns False if the task doesn't exist."""
+    cancel_task(task_id)
+    is_deleted = task_store.delete(task_id)
+    # The task may have never reached the queue (see _create_task), in which case nothing else drops its request
+    with running_tasks_lock:
+        cancel_requests.discard(task_id)
+    if is_deleted:
+        event_bus.publish("deleted", task_id, {})
+    return is_deleted
\ No newline at end of file
@@ -0,0 +1,334 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# SQLite database that persists the tasks across restarts
+TASK_DB_PATH = os.environ.get(
+    "TINYAGENT_TASK_DB_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "tasks.db"),
+)
+# Maximum number of tasks to keep. The oldest finished tasks are evicted beyond this.
+MAX_TASKS = int(os.environ.get("TINYAGENT_MAX_TASKS", "1000"))
+# Finished tasks older than this are evicted
+TASK_RETENTION_DAYS = float(os.environ.get("TINYAGENT_TASK_RETENTION_DAYS", "7"))
+# Idempotency keys of the submitted tasks are forgotten after this
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get("TINYAGENT_IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# Statuses of the tasks that are done and can be evicted
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# Statuses of the tasks that were not finished when the server stopped
+UNFINISHED_STATUSES = ("pending", "processing")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status_created_at ON tasks (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updated_at);
+CREATE TABLE IF NOT EXISTS deleted_tasks (
+    task_id TEXT PRIMARY KEY,
+    deleted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deleted_tasks_deleted_at ON deleted_tasks (deleted_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_query_hash ON tasks (json_extract(data, '$.query_hash'), created_at);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at);
+"""
+
+
+def now():
+    """Current time as an ISO string. Always includes microseconds so the strings sort by time."""
+    return datetime.now().isoformat(timespec="microseconds")
+
+
+def encode_cursor(sort_value, task_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, task_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor returned by TaskStore.query. Raises ValueError if it is malformed."""
+    try:
+        sort_value, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(sort_value, str) or not isinstance(task_id, str):
+            raise ValueError("The cursor fields must be strings")
+        # The sort value is the created_at or updated_at timestamp of the last task of the page
+        datetime.fromisoformat(sort_value)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return sort_value, task_id
+
+
+class TaskStore:
+    """
+    SQLite-backed store of the tasks and their statuses.
+    The indexed fields are kept in their own columns and the rest of the task is stored as a JSON blob.
+    Each thread gets its own connection, and the database runs in WAL mode so that the API threads can
+    read while a worker is writing.
+    """
+
+    def __init__(
+        self,
+        path=TASK_DB_PATH,
+        max_tasks=MAX_TASKS,
+        retention_days=TASK_RETENTION_DAYS,
+        idempotency_key_ttl_hours=IDEMPOTENCY_KEY_TTL_HOURS,
+    ):
+        self.path = path
+        self.max_tasks = max_tasks
+        self.retention = timedelta(days=retention_days)
+        self.idempotency_key_ttl = timedelta(hours=idempotency_key_ttl_hours)
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode, transactions are started explicitly where they are needed
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _row_to_task(row):
+        task = json.loads(row[1])
+        task["status"] = row[0]
+        task["updated_at"] = row[2]
+        return task
+
+    def create(self, task):
+        """Insert a new task, which must have a task_id and a status, then evict the old tasks."""
+        timestamp = now()
+        self._connection().execute(
+            "INSERT INTO tasks (task_id, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+            (task["task_id"], task["status"], timestamp, timestamp, json.dumps(task)),
+        )
+        self.evict()
+
+    def get(self, task_id):
+        """Return the task with the given ID, or None if it doesn't exist."""
+        row = self._connection().execute(
+            "SELECT status, data, updated_at FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return TaskStore._row_to_task(row) if row is not None else None
+
+    def exists(self, task_id):
+        row = self._connection().execute(
+            "SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row is not None
+
+    def update(self, task_id, fields=None, thought=None):
+        """
+        Merge the given fields into the task and optionally append a thought to it, atomically.
+        Returns the updated task, or None if the task doesn't exist.
+        """
+        connection = self._connection()
+        # Take the write lock before reading so that concurrent updates of the same task don't get lost
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT status, data, updated_at FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                connection.execute("ROLLBACK")
+                return None
+
+            task = TaskStore._row_to_task(row)
+            task.update(fields or {})
+            if thought is not None:
+                thoughts = task.setdefault("thoughts", [])
+                thoughts.append({
+                    "step": len(thoughts) + 1,
+                    "thought": thought,
+                    "timestamp": datetime.now().isoformat()
+                })
+
+            task["updated_at"] = now()
+            connection.execute(
+                "UPDATE tasks SET status = ?, updated_at = ?, data = ? WHERE task_id = ?",
+                (task["status"], task["updated_at"], json.dumps(task), task_id),
+            )
+            connection.execute("COMMIT")
+            return task
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete(self, task_id):
+        """Delete the task with the given ID. Returns False if the task doesn't exist."""
+        return self._delete([task_id]) > 0
+
+    def _delete(self, task_ids):
+        """Delete the given tasks and leave tombstones for them, so that delta queries see the deletes."""
+        if len(task_ids) == 0:
+            return 0
+
+        connection = self._connection()
+        timestamp = now()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            num_deleted = 0
+            for task_id in task_ids:
+                cursor = connection.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+                if cursor.rowcount > 0:
+                    num_deleted += 1
+                    connection.execute(
+                        "INSERT OR REPLACE INTO deleted_tasks (task_id, deleted_at) VALUES (?, ?)",
+                        (task_id, timestamp),
+                    )
+            connection.execute("COMMIT")
+            return num_deleted
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def list(self):
+        """Return all the tasks, oldest first."""
+        rows = self._connection().execute(
+            "SELECT status, data, updated_at FROM tasks ORDER BY created_at"
+        ).fetchall()
+        return [TaskStore._row_to_task(row) for row in rows]
+
+    def query(self, keys=None, statuses=None, updated_since=None, cursor=None, limit=None):
+        """
+        Return a page of tasks and the cursor of the next page, which is None on the last page.
+        The tasks are ordered by created_at, or by updated_at if updated_since is given, in which case only
+        the tasks that changed after it are returned. If keys is given, only those keys of the task data are
+        loaded, on top of the task_id, status and updated_at.
+        """
+        order_column = "updated_at" if updated_since is not None else "created_at"
+
+        params = []
+        if keys is None:
+            data_sql = "data"
+        else:
+            # Build the projected object in SQLite so that the large fields are never loaded
+            data_sql = "json_object('task_id', task_id"
+            for key in keys:
+                data_sql += ", ?, json_extract(data, ?)"
+                params.extend([key, f'$."{key}"'])
+            data_sql += ")"
+
+        conditions = []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if updated_since is not None:
+            conditions.append("updated_at > ?")
+            params.append(updated_since)
+        if cursor is not None:
+            conditions.append(f"({order_column}, task_id) > (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = f"SELECT status, {data_sql}, updated_at, {order_column}, task_id FROM tasks"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {order_column}, task_id"
+        if limit is not None:
+            # Fetch one more row to know if there is a next page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][3], rows[-1][4])
+
+        return [TaskStore._row_to_task(row) for row in rows], next_cursor
+
+    def deleted_since(self, since):
+        """Return the IDs of the tasks that were deleted after the given time."""
+        rows = self._connection().execute(
+            "SELECT task_id FROM deleted_tasks WHERE deleted_at > ? ORDER BY deleted_at", (since,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def find_duplicate(self, query_hash, completed_since=None):
+        """
+        Return the most recent unfinished task with the given query hash, or None. If completed_since is
+        given, the tasks with that hash that completed after it are also considered.
+        """
+        statuses = list(UNFINISHED_STATUSES)
+        sql = (
+            "SELECT status, data, updated_at FROM tasks WHERE json_extract(data, '$.query_hash') = ? "
+            f"AND (status IN ({', '.join('?' * len(statuses))})"
+        )
+        params = [query_hash, *statuses]
+        if completed_since is not None:
+            sql += " OR (status = 'completed' AND updated_at > ?)"
+            params.append(completed_since)
+        sql += ") ORDER BY created_at DESC LIMIT 1"
+
+        row = self._connection().execute(sql, params).fetchone()
+        return TaskStore._row_to_task(row) if row is not None else None
+
+    def get_idempotency_key(self, key):
+        """Return the (task_id, request_hash) that the idempotency key maps to, or None if it is unknown or expired."""
+        cutoff = (datetime.now() - self.idempotency_key_ttl).isoformat(timespec="microseconds")
+        row = self._connection().execute(
+            "SELECT task_id, request_hash FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+            (key, cutoff),
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def set_idempotency_key(self, key, task_id, request_hash):
+        """Map the idempotency key to the given task, replacing the previous mapping if there is one."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO idempotency_keys (key, task_id, request_hash, created_at) VALUES (?, ?, ?, ?)",
+            (key, task_id, request_hash, now()),
+        )
+
+    def list_unfinished(self):
+        """Return the tasks that were pending or processing, oldest first."""
+        rows = self._connection().execute(
+            f"SELECT status, data, updated_at FROM tasks WHERE status IN ({', '.join('?' * len(UNFINISHED_STATUSES))}) "
+            "ORDER BY created_at",
+            UNFINISHED_STATUSES,
+        ).fetchall()
+        return [TaskStore._row_to_task(row) for row in rows]
+
+    def evict(self):
+        """
+        Delete the finished tasks that are older than the retention period, and then the oldest finished
+        tasks until at most max_tasks are left. Unfinished tasks are never evicted. Also drops the
+        expired idempotency keys.
+        """
+        connection = self._connection()
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        cutoff = (datetime.now() - self.retention).isoformat(timespec="microseconds")
+        expired_rows = connection.execute(
+            f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND created_at < ?",
+            (*FINISHED_STATUSES, cutoff),
+        ).fetchall()
+        self._delete([row[0] for row in expired_rows])
+
+        num_tasks = connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        if num_tasks > self.max_tasks:
+            oldest_rows = connection.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) ORDER BY created_at LIMIT ?",
+                (*FINISHED_STATUSES, num_tasks - self.max_tasks),
+            ).fetchall()
+            self._delete([row[0] for row in oldest_rows])
+
+        # Clients that haven't synced for longer than the retention period need a full reload anyway
+        connection.execute("DELETE FROM deleted_tasks WHERE deleted_at < ?", (cutoff,))
+        key_cutoff = (datetime.now() - self.idempotency_key_ttl).isoformat(timespec="microseconds")
+        connection.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (key_cutoff,))
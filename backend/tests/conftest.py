@@ -0,0 +1,59 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+
+class StubAgent:
+    """
+    Stands in for query_tiny_agent, so that the tests cover the task queue without the models.
+    Each query sleeps for delay seconds, then fails if it starts with "fail" or answers with its text.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.queries = []
+
+    async def __call__(self, query):
+        self.queries.append(query)
+        await asyncio.sleep(self.delay)
+        if query.startswith("fail"):
+            raise RuntimeError(f"Agent failed on {query}")
+        return f"Response to {query}", {}
+
+
+_stub_agent = StubAgent()
+
+# backend.services loads the agent config and the models on import, so it is replaced before the task
+# queue imports it
+_services = types.ModuleType("backend.services")
+_services.TASK_TIMEOUT = 5.0
+_services.query_tiny_agent = _stub_agent
+sys.modules["backend.services"] = _services
+
+from backend import task_queue as task_queue_module  # noqa: E402
+from backend.events import EventBus  # noqa: E402
+from backend.scheduler import FairPriorityQueue  # noqa: E402
+from backend.task_store import TaskStore  # noqa: E402
+
+
+@pytest.fixture
+def stub_agent():
+    _stub_agent.delay = 0.0
+    _stub_agent.queries = []
+    return _stub_agent
+
+
+@pytest.fixture
+def task_queue(tmp_path, monkeypatch, stub_agent):
+    """The task queue module with a fresh store, queue and state, and no workers until a test starts them."""
+    monkeypatch.setattr(task_queue_module, "task_store", TaskStore(path=str(tmp_path / "tasks.db")))
+    monkeypatch.setattr(task_queue_module, "task_queue", FairPriorityQueue(maxsize=10))
+    monkeypatch.setattr(task_queue_module, "event_bus", EventBus())
+    monkeypatch.setattr(task_queue_module, "workers", [])
+    monkeypatch.setattr(task_queue_module, "running_tasks", {})
+    monkeypatch.setattr(task_queue_module, "cancel_requests", set())
+    monkeypatch.setattr(task_queue_module, "dedup_stats", {"idempotency_key": 0, "in_flight": 0, "completed": 0})
+    monkeypatch.setattr(task_queue_module, "DEDUP_MODE", "off")
+    return task_queue_module
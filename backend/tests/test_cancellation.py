@@ -0,0 +1,118 @@
+import time
+from queue import Full
+
+import pytest
+
+from backend.scheduler import FairPriorityQueue
+
+
+def wait_for_status(task_queue, task_id, statuses, timeout=5.0):
+    """Wait until the task has one of the given statuses and return it."""
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        task = task_queue.task_store.get(task_id)
+        if task is not None and task["status"] in statuses:
+            return task
+        time.sleep(0.01)
+    raise AssertionError(f"Task {task_id} did not reach {statuses}: {task_queue.task_store.get(task_id)}")
+
+
+def wait_until_running(task_queue, task_id, timeout=5.0):
+    """Wait until a worker runs the agent of the task, which is when it can be cancelled in flight."""
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        with task_queue.running_tasks_lock:
+            if task_id in task_queue.running_tasks:
+                return
+        time.sleep(0.01)
+    raise AssertionError(f"Task {task_id} did not start running")
+
+
+def wait_until_released(task_queue, task_id, timeout=2.0):
+    """Wait until the worker is done with the task, which happens right after it records the outcome."""
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        with task_queue.running_tasks_lock:
+            if task_id not in task_queue.running_tasks:
+                return
+        time.sleep(0.01)
+    raise AssertionError(f"Task {task_id} is still running")
+
+
+def test_cancel_queued_task(task_queue):
+    task_id, _ = task_queue.add_task("open the notes")
+
+    assert task_queue.cancel_task(task_id)
+
+    task = task_queue.task_store.get(task_id)
+    assert task["status"] == "cancelled"
+    assert task["completed_at"] is not None
+    assert task_queue.task_queue.qsize() == 0
+    assert task_queue.cancel_requests == set()
+
+
+def test_cancel_running_task(task_queue, stub_agent):
+    stub_agent.delay = 10.0
+    task_queue.start_workers(1)
+    task_id, _ = task_queue.add_task("open the notes")
+    wait_until_running(task_queue, task_id)
+
+    assert task_queue.cancel_task(task_id)
+
+    # The agent run is cancelled right away rather than after its delay
+    task = wait_for_status(task_queue, task_id, ("cancelled",), timeout=2.0)
+    assert task["thoughts"][-1]["thought"] == "Task cancelled"
+    wait_until_released(task_queue, task_id)
+    assert task_queue.cancel_requests == set()
+
+
+def test_cancelled_worker_takes_the_next_task(task_queue, stub_agent):
+    stub_agent.delay = 10.0
+    task_queue.start_workers(1)
+    first_id, _ = task_queue.add_task("first")
+    wait_until_running(task_queue, first_id)
+
+    stub_agent.delay = 0.0
+    second_id, _ = task_queue.add_task("second")
+    task_queue.cancel_task(first_id)
+
+    assert wait_for_status(task_queue, second_id, ("completed",))["response"] == "Response to second"
+
+
+def test_cancel_finished_task(task_queue):
+    task_queue.start_workers(1)
+    task_id, _ = task_queue.add_task("open the notes")
+    wait_for_status(task_queue, task_id, ("completed",))
+
+    assert not task_queue.cancel_task(task_id)
+    assert task_queue.task_store.get(task_id)["status"] == "completed"
+    assert task_queue.cancel_requests == set()
+
+
+def test_cancel_unknown_task(task_queue):
+    assert not task_queue.cancel_task("unknown")
+    assert task_queue.cancel_requests == set()
+
+
+def test_rejected_submission_leaves_no_task_behind(task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "task_queue", FairPriorityQueue(maxsize=1))
+    task_queue.add_task("first")
+
+    with pytest.raises(Full):
+        task_queue.add_task("second")
+
+    assert [task["task_description"] for task in task_queue.task_store.list()] == ["first"]
+    assert task_queue.cancel_requests == set()
+
+
+def test_delete_running_task(task_queue, stub_agent):
+    stub_agent.delay = 10.0
+    task_queue.start_workers(1)
+    task_id, _ = task_queue.add_task("open the notes")
+    wait_until_running(task_queue, task_id)
+
+    assert task_queue.delete_task(task_id)
+
+    assert task_queue.task_store.get(task_id) is None
+    wait_until_released(task_queue, task_id)
+    assert task_queue.cancel_requests == set()
@@ -0,0 +1,80 @@
+import types
+from queue import Full
+
+import pytest
+
+from backend import scheduler
+from backend.scheduler import FairPriorityQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock of the scheduler, advanced by setting clock.now."""
+    fake_clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(scheduler, "time", types.SimpleNamespace(monotonic=lambda: fake_clock.now))
+    return fake_clock
+
+
+def test_higher_priorities_are_served_first(clock):
+    queue = FairPriorityQueue()
+    queue.put_nowait("low", priority="low")
+    queue.put_nowait("normal", priority="normal")
+    queue.put_nowait("high", priority="high")
+
+    assert [queue.get() for _ in range(3)] == ["high", "normal", "low"]
+
+
+def test_same_priority_is_fifo(clock):
+    queue = FairPriorityQueue()
+    for i in range(3):
+        queue.put_nowait(i)
+
+    assert [queue.get() for _ in range(3)] == [0, 1, 2]
+
+
+def test_waiting_task_is_promoted_with_age(clock):
+    queue = FairPriorityQueue(aging_seconds=10)
+    queue.put_nowait("low", priority="low")
+    # After 5 seconds the low priority task is still behind a new high priority one
+    clock.now = 5
+    queue.put_nowait("high 1", priority="high")
+    assert queue.get() == "high 1"
+
+    # After 25 seconds it is promoted by more than two classes, ahead of a new high priority task
+    clock.now = 25
+    queue.put_nowait("high 2", priority="high")
+    assert queue.get() == "low"
+    assert queue.get() == "high 2"
+
+
+def test_clients_take_turns_within_a_priority(clock):
+    queue = FairPriorityQueue()
+    for i in range(3):
+        queue.put_nowait(f"a{i}", client_id="a")
+    queue.put_nowait("b0", client_id="b")
+
+    assert [queue.get() for _ in range(4)] == ["a0", "b0", "a1", "a2"]
+
+
+def test_full_queue_rejects_tasks(clock):
+    queue = FairPriorityQueue(maxsize=1)
+    queue.put_nowait("first")
+
+    with pytest.raises(Full):
+        queue.put_nowait("second")
+
+
+def test_unknown_priority_is_rejected(clock):
+    with pytest.raises(ValueError):
+        FairPriorityQueue().put_nowait("task", priority="urgent")
+
+
+def test_remove(clock):
+    queue = FairPriorityQueue()
+    queue.put_nowait("a0", client_id="a")
+    queue.put_nowait("b0", client_id="b")
+    queue.put_nowait("a1", client_id="a")
+
+    assert queue.remove(lambda item: item.startswith("a")) == 2
+    assert queue.qsize() == 1
+    assert queue.get() == "b0"
@@ -0,0 +1,165 @@
+import time
+
+import pytest
+from flask import Flask
+
+from backend import routes
+from backend.routes import tinyagent_bp
+
+
+@pytest.fixture
+def client(task_queue):
+    app = Flask(__name__)
+    app.register_blueprint(tinyagent_bp)
+    return app.test_client()
+
+
+def submit(client, query, client_id="client-a", idempotency_key=None, **fields):
+    headers = {"X-Client-Id": client_id}
+    if idempotency_key is not None:
+        headers["Idempotency-Key"] = idempotency_key
+    return client.post("/tasks/submit", json={"query": query, **fields}, headers=headers)
+
+
+def test_submit_creates_a_pending_task(client, task_queue):
+    response = submit(client, "open the notes", priority="high")
+
+    assert response.status_code == 200
+    assert response.json["status"] == "pending"
+    assert not response.json["deduplicated"]
+    task = task_queue.task_store.get(response.json["task_id"])
+    assert task["metadata"]["priority"] == "high"
+    assert [thought["thought"] for thought in task["thoughts"]] == ["Task created and added to queue"]
+
+
+def test_idempotency_key_returns_the_same_task(client, task_queue):
+    first = submit(client, "open the notes", idempotency_key="key-1")
+    second = submit(client, "open the notes", idempotency_key="key-1")
+
+    assert second.status_code == 200
+    assert second.json["task_id"] == first.json["task_id"]
+    assert second.json["deduplicated"]
+    assert task_queue.task_queue.qsize() == 1
+
+
+def test_idempotency_key_mismatch_returns_422(client, task_queue):
+    submit(client, "open the notes", idempotency_key="key-1")
+
+    response = submit(client, "delete the notes", idempotency_key="key-1")
+
+    assert response.status_code == 422
+    assert task_queue.task_queue.qsize() == 1
+
+
+def test_dedup_is_off_by_default(client):
+    first = submit(client, "open the notes")
+    second = submit(client, "open the notes")
+
+    assert second.json["task_id"] != first.json["task_id"]
+    assert not second.json["deduplicated"]
+
+
+def test_in_flight_query_is_deduplicated(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "in_flight")
+    first = submit(client, "open the notes")
+
+    # Differences in whitespace don't make a different query
+    second = submit(client, "open  the notes ")
+
+    assert second.json["task_id"] == first.json["task_id"]
+    assert second.json["deduplicated"]
+    assert second.json["status"] == "pending"
+    assert task_queue.task_queue.qsize() == 1
+    assert task_queue.dedup_stats["in_flight"] == 1
+
+
+def test_queries_of_different_clients_are_not_deduplicated(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "in_flight")
+    first = submit(client, "open the notes", client_id="client-a")
+    second = submit(client, "open the notes", client_id="client-b")
+
+    assert second.json["task_id"] != first.json["task_id"]
+
+
+def test_submission_can_opt_into_dedup(client, task_queue):
+    first = submit(client, "open the notes")
+    second = submit(client, "open the notes", dedup=True)
+
+    assert second.json["task_id"] == first.json["task_id"]
+    assert second.json["deduplicated"]
+
+
+def test_submission_can_opt_out_of_dedup(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "in_flight")
+    first = submit(client, "open the notes")
+    second = submit(client, "open the notes", dedup=False)
+
+    assert second.json["task_id"] != first.json["task_id"]
+
+
+def test_invalid_dedup_returns_400(client):
+    assert submit(client, "open the notes", dedup="yes").status_code == 400
+
+
+def test_completed_query_is_served_in_completed_mode(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "completed")
+    task_queue.start_workers(1)
+    first = submit(client, "open the notes")
+    end_time = time.monotonic() + 5.0
+    while task_queue.task_store.get(first.json["task_id"])["status"] != "completed":
+        assert time.monotonic() < end_time
+        time.sleep(0.01)
+
+    second = submit(client, "open the notes")
+
+    assert second.json["task_id"] == first.json["task_id"]
+    assert second.json["status"] == "completed"
+    assert task_queue.dedup_stats["completed"] == 1
+
+
+def test_completed_query_runs_again_in_in_flight_mode(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "in_flight")
+    task_queue.start_workers(1)
+    first = submit(client, "open the notes")
+    end_time = time.monotonic() + 5.0
+    while task_queue.task_store.get(first.json["task_id"])["status"] != "completed":
+        assert time.monotonic() < end_time
+        time.sleep(0.01)
+
+    second = submit(client, "open the notes")
+
+    assert second.json["task_id"] != first.json["task_id"]
+
+
+def test_submit_keeps_the_progress_of_the_worker(client, task_queue):
+    task_queue.start_workers(1)
+    response = submit(client, "open the notes")
+    end_time = time.monotonic() + 5.0
+    while task_queue.task_store.get(response.json["task_id"])["status"] != "completed":
+        assert time.monotonic() < end_time
+        time.sleep(0.01)
+
+    task = task_queue.task_store.get(response.json["task_id"])
+    assert task["started_at"] is not None
+    assert task["thoughts"][0]["thought"] == "Task created and added to queue"
+    assert task["thoughts"][-1]["thought"] == "Query completed successfully"
+
+
+def test_deleted_duplicate_is_submitted_again(client, task_queue, monkeypatch):
+    monkeypatch.setattr(task_queue, "DEDUP_MODE", "in_flight")
+    first = submit(client, "open the notes")
+
+    # The duplicate is deleted between its lookup and the response
+    def add_task_and_delete(*args, **kwargs):
+        task_id, deduplicated = task_queue.add_task(*args, **kwargs)
+        if deduplicated:
+            task_queue.delete_task(task_id)
+        return task_id, deduplicated
+    monkeypatch.setattr(routes, "add_task", add_task_and_delete)
+
+    second = submit(client, "open the notes")
+
+    assert second.status_code == 200
+    assert second.json["task_id"] != first.json["task_id"]
+    assert not second.json["deduplicated"]
+    assert task_queue.task_store.get(second.json["task_id"])["status"] == "pending"
@@ -0,0 +1,100 @@
+import time
+
+
+def wait_for_statuses(task_queue, task_ids, statuses, timeout=5.0):
+    """Wait until all the tasks have one of the given statuses and return them."""
+    end_time = time.monotonic() + timeout
+    while time.monotonic() < end_time:
+        tasks = [task_queue.task_store.get(task_id) for task_id in task_ids]
+        if all(task is not None and task["status"] in statuses for task in tasks):
+            return tasks
+        time.sleep(0.01)
+    raise AssertionError(f"Tasks did not reach {statuses}")
+
+
+def test_worker_completes_task(task_queue, stub_agent):
+    task_queue.start_workers(1)
+    task_id, _ = task_queue.add_task("open the notes")
+
+    [task] = wait_for_statuses(task_queue, [task_id], ("completed",))
+
+    assert task["response"] == "Response to open the notes"
+    assert task["started_at"] is not None
+    assert task["completed_at"] is not None
+    assert [thought["thought"] for thought in task["thoughts"]] == [
+        "Task created and added to queue",
+        "Starting task processing",
+        "Initializing agent query",
+        "Executing agent query with 5-second timeout",
+        "Query completed successfully",
+    ]
+    assert stub_agent.queries == ["open the notes"]
+
+
+def test_failed_query_marks_task_failed(task_queue):
+    task_queue.start_workers(1)
+    task_id, _ = task_queue.add_task("fail to open the notes")
+
+    [task] = wait_for_statuses(task_queue, [task_id], ("failed",))
+
+    assert "Agent failed on fail to open the notes" in task["error_message"]
+    assert task["completed_at"] is not None
+
+
+def test_worker_survives_failed_query(task_queue):
+    task_queue.start_workers(1)
+    failed_id, _ = task_queue.add_task("fail to open the notes")
+    completed_id, _ = task_queue.add_task("open the notes")
+
+    wait_for_statuses(task_queue, [failed_id], ("failed",))
+    wait_for_statuses(task_queue, [completed_id], ("completed",))
+
+
+def test_workers_run_tasks_concurrently(task_queue, stub_agent):
+    stub_agent.delay = 0.5
+    task_queue.start_workers(4)
+    start_time = time.monotonic()
+
+    task_ids = [task_queue.add_task(f"query {i}")[0] for i in range(4)]
+    wait_for_statuses(task_queue, task_ids, ("completed",))
+
+    # One worker would take 2 seconds
+    assert time.monotonic() - start_time < 1.5
+    assert len(task_queue.workers) == 4
+
+
+def test_deleted_queued_task_is_skipped(task_queue):
+    first_id, _ = task_queue.add_task("first")
+    second_id, _ = task_queue.add_task("second")
+    task_queue.delete_task(first_id)
+    task_queue.start_workers(1)
+
+    wait_for_statuses(task_queue, [second_id], ("completed",))
+    assert task_queue.task_store.get(first_id) is None
+
+
+def test_start_requeues_unfinished_tasks(task_queue):
+    # A task that a worker was running when the server stopped
+    task_queue.task_store.create({
+        "task_id": "interrupted",
+        "task_description": "open the notes",
+        "status": "processing",
+        "thoughts": [],
+        "client_id": "client-a",
+        "metadata": {"priority": "high"},
+    })
+
+    task_queue.start()
+
+    [task] = wait_for_statuses(task_queue, ["interrupted"], ("completed",))
+    assert task["response"] == "Response to open the notes"
+
+
+def test_start_is_idempotent(task_queue):
+    task_queue.start()
+    num_workers = len(task_queue.workers)
+
+    task_queue.start()
+
+    assert num_workers == task_queue.NUM_WORKERS
+    assert len(task_queue.workers) == num_workers
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of the scheduling overhead of the TaskFetchingUnit.
+
+Builds plans of no-op tools in two shapes, N independent tasks followed by a join (wide) and a chain of N
+tasks where each one depends on the previous one (deep), and times TaskFetchingUnit.schedule on them.
+Since the tools return right away, the time is the scheduling overhead. Run from the repository root:
+
+    python -m tinyagent.bench_task_fetching_unit --sizes 10,100,1000 --repeats 5
+
+To compare with another version of the scheduler, run the same command on a checkout of that version.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from tinyagent.src.llm_compiler.task_fetching_unit import Task, TaskFetchingUnit
+
+
+async def _noop() -> str:
+    return ""
+
+
+def build_wide_plan(size: int) -> dict[int, Task]:
+    """size independent tasks, followed by a join that depends on all of them."""
+    tasks = {
+        idx: Task(idx=idx, name="noop", tool=_noop, args=(), dependencies=[])
+        for idx in range(1, size + 1)
+    }
+    tasks[size + 1] = Task(
+        idx=size + 1,
+        name="join",
+        tool=_noop,
+        args=(),
+        dependencies=list(range(1, size + 1)),
+        is_join=True,
+    )
+    return tasks
+
+
+def build_deep_plan(size: int) -> dict[int, Task]:
+    """A chain of size tasks, each one depending on the previous one, followed by a join."""
+    tasks = {
+        idx: Task(
+            idx=idx,
+            name="noop",
+            tool=_noop,
+            args=(),
+            dependencies=[idx - 1] if idx > 1 else [],
+        )
+        for idx in range(1, size + 1)
+    }
+    tasks[size + 1] = Task(
+        idx=size + 1, name="join", tool=_noop, args=(), dependencies=[size], is_join=True
+    )
+    return tasks
+
+
+async def time_schedule(tasks: dict[int, Task]) -> float:
+    task_fetching_unit = TaskFetchingUnit()
+    task_fetching_unit.set_tasks(tasks)
+    start_time = time.perf_counter()
+    await task_fetching_unit.schedule()
+    return time.perf_counter() - start_time
+
+
+async def run_benchmark(sizes: list[int], repeats: int) -> list[tuple[str, int, float, float]]:
+    """Returns a list of (shape, size, median seconds, min seconds) for each shape and size."""
+    results = []
+    for shape, build_plan in (("wide", build_wide_plan), ("deep", build_deep_plan)):
+        for size in sizes:
+            durations = [await time_schedule(build_plan(size)) for _ in range(repeats)]
+            results.append((shape, size, statistics.median(durations), min(durations)))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", default="10,100,1000", help="Comma-separated numbers of tasks per plan"
+    )
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per shape and size")
+    args = parser.parse_args()
+
+    sizes = [int(value) for value in args.sizes.split(",")]
+    results = asyncio.run(run_benchmark(sizes, args.repeats))
+
+    print(f"{'shape':>6} {'tasks':>6} {'median ms':>10} {'min ms':>10}")
+    for shape, size, median, minimum in results:
+        print(f"{shape:>6} {size:>6} {median * 1000:>10.2f} {minimum * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
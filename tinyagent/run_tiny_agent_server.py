@@ -1,6 +1,7 @@
 import asyncio
 import os
 import signal
+from contextlib import asynccontextmanager
 from http import HTTPStatus
 from typing import cast
 
@@ -11,18 +12,18 @@ from pydantic import BaseModel
 from starlette.datastructures import UploadFile
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from tinyagent.src.tiny_agent.config import get_tiny_agent_config
+from tinyagent.src.tiny_agent.agent_pool import TinyAgentPool
+from tinyagent.src.tiny_agent.config import get_cached_tiny_agent_config
 from tinyagent.src.tiny_agent.models import (
     LLM_ERROR_TOKEN,
     TINY_AGENT_DIR,
     ModelType,
-    streaming_queue,
 )
-from tinyagent.src.tiny_agent.tiny_agent import TinyAgent
 from tinyagent.src.tiny_agent.transcription import (
     TranscriptionService,
     WhisperCppClient,
     WhisperOpenAIClient,
+    create_whisper_http_client,
 )
 from tinyagent.src.utils.logger_utils import enable_logging, enable_logging_to_file, log
 
@@ -31,17 +32,25 @@ enable_logging_to_file(True)
 
 CONFIG_PATH = os.path.join(TINY_AGENT_DIR, "config.json")
 
-app = FastAPI()
 
 
-def empty_queue(q: asyncio.Queue) -> None:
-    while not q.empty():
-        try:
-            q.get_nowait()
-            q.task_done()
-        except asyncio.QueueEmpty:
-            # Handle the case where the queue is already empty
-            break
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Owns the resources that live as long as the server, such as the pooled HTTP client of the
+    Whisper.cpp server, which keeps its connections alive across the voice commands.
+    """
+    app.state.whisper_http_client = create_whisper_http_client()
+    try:
+        yield
+    finally:
+        await app.state.whisper_http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Warm TinyAgent instances that are reused across the requests
+tiny_agent_pool = TinyAgentPool()
 
 
 class TinyAgentRequest(BaseModel):
@@ -64,9 +73,6 @@ async def execute_command(request: TinyAgentRequest) -> StreamingResponse:
     """
     log(f"\n\n====\nReceived request: {request.query}")
 
-    # First, ensure the queue is empty
-    empty_queue(streaming_queue)
-
     query = request.query
 
     if not query or len(query) <= 0:
@@ -75,17 +81,28 @@ async def execute_command(request: TinyAgentRequest) -> StreamingResponse:
         )
 
     try:
-        tiny_agent_config = get_tiny_agent_config(config_path=CONFIG_PATH)
-        tiny_agent = TinyAgent(tiny_agent_config)
+        tiny_agent_config = get_cached_tiny_agent_config(config_path=CONFIG_PATH)
     except Exception as e:
         raise HTTPException(
             status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
             detail=f"Error: {e}",
         )
 
+    # Each request streams its tokens through its own queue so concurrent requests don't interfere
+    streaming_queue = asyncio.Queue[str | None]()
+
     async def generate():
+        # The agent is checked out here rather than in the endpoint, so that it is only taken from the
+        # pool if the response is actually streamed, and is always given back
+        tiny_agent = None
+        response_task = None
+        # Only return the agent to the pool if the run finished cleanly
+        discard = True
         try:
-            response_task = asyncio.create_task(tiny_agent.arun(query))
+            tiny_agent = tiny_agent_pool.acquire(tiny_agent_config)
+            response_task = asyncio.create_task(
+                tiny_agent.arun(query, streaming_queue=streaming_queue)
+            )
 
             while True:
                 # Await a small timeout to periodically check if the task is done
@@ -111,12 +128,24 @@ async def execute_command(request: TinyAgentRequest) -> StreamingResponse:
             await response_task
             response = response_task.result()
             yield f"\n\n{response}"
+            discard = False
         except Exception as e:
             # You cannot raise HTTPExceptions in an async generator, it doesn't
             # get caught by the FastAPI exception handling middleware. Hence,
             # we are manually catching the exceptions and yielding/logging them.
             yield f"Error: {e}"
             log(f"Error: {e}")
+        finally:
+            if response_task is not None and not response_task.done():
+                # Stop the run, e.g. after an LLM error or if the client disconnected, before the pool
+                # closes the agent it runs on
+                response_task.cancel()
+                try:
+                    await response_task
+                except (asyncio.CancelledError, Exception):
+                    pass
+            if tiny_agent is not None:
+                tiny_agent_pool.release(tiny_agent_config, tiny_agent, discard=discard)
 
     return StreamingResponse(generate(), media_type="text/event-stream")
 
@@ -144,7 +173,7 @@ async def get_voice_transcription(request: Request) -> Response:
         )
 
     try:
-        tiny_agent_config = get_tiny_agent_config(config_path=CONFIG_PATH)
+        tiny_agent_config = get_cached_tiny_agent_config(config_path=CONFIG_PATH)
     except Exception as e:
         raise HTTPException(
             status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -154,7 +183,9 @@ async def get_voice_transcription(request: Request) -> Response:
     whisper_client = (
         WhisperOpenAIClient(tiny_agent_config)
         if tiny_agent_config.whisper_config.provider == ModelType.OPENAI
-        else WhisperCppClient(tiny_agent_config)
+        else WhisperCppClient(
+            tiny_agent_config, http_client=request.app.state.whisper_http_client
+        )
     )
 
     transcription_service = TranscriptionService(whisper_client)
@@ -54,11 +54,18 @@ class AsyncStatsCallbackHandler(AsyncCallbackHandler):
         self.encoder = tiktoken.encoding_for_model("gpt-4")
         self.stream = stream
         self.all_times = []
+        # Prompt tokens that were served from the prompt cache of the provider (OpenAI, vLLM with
+        # --enable-prefix-caching). Only reported in the usage of the non-streamed calls.
+        self.cached_input_tokens = 0
+        # Time to first token of each streamed call
+        self.ttfts = []
         self.additional_fields = {}
         self.start_time = 0
+        self._awaiting_first_token = False
 
     async def on_chat_model_start(self, serialized, prompts, **kwargs):
         self.start_time = time.time()
+        self._awaiting_first_token = True
         if self.stream:
             # if streaming mode, on_llm_end response is not collected
             # therefore, we need to count input token based on the
@@ -67,6 +74,9 @@ class AsyncStatsCallbackHandler(AsyncCallbackHandler):
             self.input_tokens += len(self.encoder.encode(prompts[0][0].content))
 
     async def on_llm_new_token(self, token, *args, **kwargs):
+        if self._awaiting_first_token:
+            self._awaiting_first_token = False
+            self.ttfts.append(round(time.time() - self.start_time, 3))
         if self.stream:
             # if streaming mode, on_llm_end response is not collected
             # therefore, we need to manually count output token based on the
@@ -81,6 +91,8 @@ class AsyncStatsCallbackHandler(AsyncCallbackHandler):
             token_usage = response.llm_output["token_usage"]
             self.input_tokens += token_usage["prompt_tokens"]
             self.output_tokens += token_usage["completion_tokens"]
+            prompt_tokens_details = token_usage.get("prompt_tokens_details") or {}
+            self.cached_input_tokens += prompt_tokens_details.get("cached_tokens") or 0
             self.cnt += 1
 
     def reset(self) -> None:
@@ -88,13 +100,18 @@ class AsyncStatsCallbackHandler(AsyncCallbackHandler):
         self.input_tokens = 0
         self.output_tokens = 0
         self.all_times = []
+        self.cached_input_tokens = 0
+        self.ttfts = []
         self.additional_fields = {}
 
     def get_stats(self) -> dict[str, int]:
         return {
             "calls": self.cnt,
             "input_tokens": self.input_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "uncached_input_tokens": self.input_tokens - self.cached_input_tokens,
             "output_tokens": self.output_tokens,
             "all_times": self.all_times,
+            "ttfts": self.ttfts,
             **self.additional_fields,
         }
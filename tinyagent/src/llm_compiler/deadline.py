@@ -0,0 +1,97 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Literal, Optional, TypeVar
+
+T = TypeVar("T")
+
+Stage = Literal["planner", "task", "joinner"]
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when a stage of the run doesn't finish within its budget."""
+
+    def __init__(self, stage: Optional[Stage], timeout: float) -> None:
+        self.stage = stage
+        self.timeout = timeout
+        stage_name = stage if stage is not None else "run"
+        super().__init__(f"The {stage_name} timed out after {timeout:.1f} seconds")
+
+
+@dataclass
+class StageBudgets:
+    """
+    The maximum number of seconds that each stage of a run can take. None means that the stage is only
+    bounded by the time left until the deadline.
+    """
+
+    planner: Optional[float] = None
+    # Budget of each tool call
+    task: Optional[float] = None
+    # The joinner budget is also held back from the planner and the tools, so that the joinner can still
+    # turn the observations into an answer when they run late
+    joinner: Optional[float] = None
+
+
+@dataclass
+class Deadline:
+    """
+    The deadline of a run, which is passed down from the request to the planner, the tools and the joinner
+    so that each of them knows how much time is left.
+    """
+
+    # The time.monotonic() value at which the run is out of time
+    expires_at: float
+    budgets: StageBudgets = field(default_factory=StageBudgets)
+
+    @staticmethod
+    def after(seconds: float, budgets: Optional[StageBudgets] = None) -> "Deadline":
+        return Deadline(
+            expires_at=time.monotonic() + seconds,
+            budgets=budgets if budgets is not None else StageBudgets(),
+        )
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def is_expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout_for(self, stage: Optional[Stage] = None) -> float:
+        """
+        Returns the timeout of the given stage, which is its budget capped by the time left. The stages
+        before the joinner also leave the joinner budget untouched. If stage is None, returns the time
+        left for the planner and the tools together.
+        """
+        remaining = self.remaining()
+        if stage != "joinner" and self.budgets.joinner is not None:
+            remaining -= self.budgets.joinner
+
+        budget = getattr(self.budgets, stage) if stage is not None else None
+        timeout = min(remaining, budget) if budget is not None else remaining
+        return max(0.0, timeout)
+
+    def can_afford_replan(self) -> bool:
+        """Whether there is enough time left for another planner call and joinner call."""
+        needed = (self.budgets.planner or 0.0) + (self.budgets.joinner or 0.0)
+        return self.remaining() > needed
+
+    async def run(self, awaitable: Awaitable[T], stage: Optional[Stage] = None) -> T:
+        """Awaits the given awaitable within the timeout of the stage. Raises DeadlineExceeded otherwise."""
+        timeout = self.timeout_for(stage)
+        try:
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+        except DeadlineExceeded:
+            # An inner stage already ran out of time
+            raise
+        except asyncio.TimeoutError as e:
+            raise DeadlineExceeded(stage, timeout) from e
+
+
+async def run_with_deadline(
+    awaitable: Awaitable[T], deadline: Optional[Deadline], stage: Optional[Stage] = None
+) -> T:
+    """Same as Deadline.run, but simply awaits the awaitable if there is no deadline."""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, stage)
@@ -1,5 +1,17 @@
 import asyncio
-from typing import Any, Dict, List, Mapping, Optional, Sequence, Union, cast
+import re
+import time
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+    cast,
+)
 
 from langchain.callbacks.manager import (
     AsyncCallbackManagerForChainRun,
@@ -13,11 +25,32 @@ from langchain.prompts.base import StringPromptValue
 from tinyagent.src.callbacks.callbacks import AsyncStatsCallbackHandler
 from tinyagent.src.chains.chain import Chain
 from tinyagent.src.llm_compiler.constants import JOINNER_REPLAN
-from tinyagent.src.llm_compiler.planner import Planner
+from tinyagent.src.llm_compiler.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    run_with_deadline,
+)
+from tinyagent.src.llm_compiler.plan_cache import PlanCache
+from tinyagent.src.llm_compiler.planner import Planner, PrebuiltPlan
 from tinyagent.src.llm_compiler.task_fetching_unit import Task, TaskFetchingUnit
-from tinyagent.src.tiny_agent.models import streaming_queue
+from tinyagent.src.llm_compiler.trace import IterationTrace, RunTrace, TaskTrace
 from tinyagent.src.tools.base import StructuredTool, Tool
-from tinyagent.src.utils.logger_utils import log
+from tinyagent.src.utils.logger_utils import get_run_id, log, log_event
+
+# The tools report most of their failures as regular observations, e.g. "No contacts found"
+_ERROR_OBSERVATION_PATTERN = re.compile(
+    r"\b(error|failed|can't|cannot|could not|couldn't|unable|invalid|not found|no \w+ found|"
+    r"no exact match|no message selected|only supported on|has to be)\b",
+    re.IGNORECASE,
+)
+
+
+def _is_error_observation(observation: Any) -> bool:
+    """
+    Whether a task failed, which covers both the tool errors that the task fetching unit reports as
+    "Error: ..." observations and the failures that the tools report themselves.
+    """
+    return _ERROR_OBSERVATION_PATTERN.search(str(observation)) is not None
 
 
 class LLMCompilerAgent:
@@ -47,6 +80,14 @@ class LLMCompiler(Chain, extra="allow"):
     """The step container to use."""
     input_key: str = "input"
     output_key: str = "output"
+    # Optional input that carries the channel the tokens of this run are streamed to
+    streaming_queue_key: str = "streaming_queue"
+    # Optional input with the Deadline of the run, which bounds the planner, the tools and the joinner
+    deadline_key: str = "deadline"
+    # Optional input with a PrebuiltPlan that is run instead of calling the planner in the first iteration
+    prebuilt_plan_key: str = "prebuilt_plan"
+    # Extra output with the RunTrace of the run, which is not part of output_keys so that arun still works
+    trace_key: str = "trace"
 
     def __init__(
         self,
@@ -62,6 +103,10 @@ class LLMCompiler(Chain, extra="allow"):
         max_replans: int,
         benchmark: bool,
         planner_custom_instructions_prompt: str | None = None,
+        planner_prefix_stable_prompt: bool = False,
+        plan_cache: Optional[PlanCache] = None,
+        side_effect_tools: Optional[Collection[str]] = None,
+        lookup_tools: Collection[str] = (),
         **kwargs,
     ) -> None:
         """
@@ -69,6 +114,8 @@ class LLMCompiler(Chain, extra="allow"):
             tools: List of tools to use.
             max_replans: Maximum number of replans to do.
             benchmark: Whether to collect benchmark stats.
+            plan_cache: Cache of the successful plans, which are reused for the queries of the same
+                shape instead of calling the planner. If not assigned, the planner is always called.
 
         Planner Args:
             planner_llm: LLM to use for planning.
@@ -78,12 +125,19 @@ class LLMCompiler(Chain, extra="allow"):
                 If not assigned, default to `planner_example_prompt`.
             planner_stop: Stop tokens for planning.
             planner_stream: Whether to stream the planning.
+            planner_prefix_stable_prompt: Whether to lay out the planner prompt so that its prefix is
+                shared across queries, for the prompt caching of the LLM provider.
 
         Agent Args:
             agent_llm: LLM to use for agent.
             joinner_prompt: Prompt to use for joinner.
             joinner_prompt_final: Prompt to use for joinner at the final replanning iter.
                 If not assigned, default to `joinner_prompt`.
+            side_effect_tools: Names of the tools whose outputs are only statuses. If a plan only
+                calls these tools and the lookup tools, and they all succeed, the joinner is skipped
+                and the statuses are the answer. If not assigned, the joinner is always called.
+            lookup_tools: Names of the tools whose outputs don't need the joinner as long as they
+                are passed to other tools.
         """
         super().__init__(**kwargs)
 
@@ -100,6 +154,7 @@ class LLMCompiler(Chain, extra="allow"):
             custom_instructions=planner_custom_instructions_prompt,
             tools=tools,
             stop=planner_stop,
+            prefix_stable_prompt=planner_prefix_stable_prompt,
         )
 
         self.agent = LLMCompilerAgent(agent_llm)
@@ -107,6 +162,11 @@ class LLMCompiler(Chain, extra="allow"):
         self.joinner_prompt_final = joinner_prompt_final or joinner_prompt
         self.planner_stream = planner_stream
         self.max_replans = max_replans
+        self.plan_cache = plan_cache
+        self.side_effect_tools = (
+            frozenset(side_effect_tools) if side_effect_tools is not None else None
+        )
+        self.lookup_tools = frozenset(lookup_tools)
 
         # callbacks
         self.benchmark = benchmark
@@ -207,8 +267,86 @@ class LLMCompiler(Chain, extra="allow"):
         formatted_contexts += "Current Plan:\n\n"
         return formatted_contexts
 
+    def _generate_partial_answer(self, tasks: Sequence[TaskTrace]) -> str:
+        """
+        Answer of a run that ran out of time before the joinner could answer, which lists the observations
+        that were collected so far.
+        """
+        observations = [
+            f"- {task.name}: {task.observation}"
+            for task in tasks
+            if not task.is_join
+            and task.observation is not None
+            and not task.observation.startswith("Error:")
+        ]
+        if len(observations) == 0:
+            return "I ran out of time before I could answer your question. Please try again."
+        return (
+            "I ran out of time before I could finish. Here is what I found so far:\n"
+            + "\n".join(observations)
+        )
+
+    def _is_plan_cacheable(self, trace: RunTrace) -> bool:
+        """
+        Whether the plan of the run is worth reusing: the first plan was generated by the planner, and it
+        answered the query without errors, replanning or running out of time.
+        """
+        if trace.is_partial or len(trace.iterations) != 1:
+            return False
+        iteration = trace.iterations[0]
+        if (
+            iteration.plan_source != "planner"
+            or iteration.joinner_replan
+            or iteration.planner_latency is None
+        ):
+            return False
+        # A join with an observation carries a planner error
+        return all(
+            (
+                task.observation is None
+                if task.is_join
+                else task.observation is not None
+                and not _is_error_observation(task.observation)
+            )
+            for task in iteration.tasks
+        )
+
+    def _get_short_circuit_answer(self, tasks: Mapping[int, Task]) -> Optional[str]:
+        """
+        Returns the answer of a plan whose outcome is already known without the joinner: every task is
+        a side effect tool, or a lookup tool whose output is passed to another task, and none of them
+        failed. The answer lists the statuses of the side effect tools. Returns None otherwise.
+        """
+        if self.side_effect_tools is None:
+            return None
+
+        tool_tasks = [task for task in tasks.values() if not task.is_join]
+        if any(task.observation is not None for task in tasks.values() if task.is_join):
+            # The join carries a planner error
+            return None
+
+        consumed_idxs = {
+            dependency for task in tool_tasks for dependency in task.dependencies
+        }
+        statuses = []
+        for task in tool_tasks:
+            if task.observation is None or _is_error_observation(task.observation):
+                return None
+            if task.name in self.side_effect_tools:
+                statuses.append(str(task.observation))
+            elif task.name not in self.lookup_tools or task.idx not in consumed_idxs:
+                return None
+
+        if len(statuses) == 0:
+            return None
+        return "\n".join(statuses)
+
     async def join(
-        self, input_query: str, agent_scratchpad: str, is_final: bool
+        self,
+        input_query: str,
+        agent_scratchpad: str,
+        is_final: bool,
+        deadline: Optional[Deadline] = None,
     ) -> str:
         if is_final:
             joinner_prompt = self.joinner_prompt_final
@@ -221,8 +359,12 @@ class LLMCompiler(Chain, extra="allow"):
             # "---\n"
         )
         log("Joining prompt:\n", prompt, block=True)
-        response = await self.agent.arun(
-            prompt, callbacks=[self.executor_callback] if self.benchmark else None
+        response = await run_with_deadline(
+            self.agent.arun(
+                prompt, callbacks=[self.executor_callback] if self.benchmark else None
+            ),
+            deadline,
+            "joinner",
         )
         raw_answer = cast(str, response)
         log("Question: \n", input_query, block=True)
@@ -231,6 +373,7 @@ class LLMCompiler(Chain, extra="allow"):
         if is_final:
             # If final, we don't need to replan
             is_replan = False
+        log_event("join", thought=thought, answer=answer, is_replan=is_replan)
         return thought, answer, is_replan
 
     def _call(
@@ -245,43 +388,105 @@ class LLMCompiler(Chain, extra="allow"):
         inputs: Dict[str, Any],
         run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
     ) -> Dict[str, Any]:
+        # Each run gets its own token channel so that concurrent runs don't steal each other's tokens
+        streaming_queue = inputs.get(self.streaming_queue_key)
+        if streaming_queue is None:
+            streaming_queue = asyncio.Queue()
+        deadline: Optional[Deadline] = inputs.get(self.deadline_key)
+
+        trace = RunTrace(query=inputs[self.input_key], run_id=get_run_id())
         contexts = []
         joinner_thought = ""
         agent_scratchpad = ""
         for i in range(self.max_replans):
             is_first_iter = i == 0
             is_final_iter = i == self.max_replans - 1
-
-            task_fetching_unit = TaskFetchingUnit()
-            if self.planner_stream:
-                task_queue = asyncio.Queue()
-                asyncio.create_task(
-                    self.planner.aplan(
+            iteration_trace = IterationTrace(is_replan=not is_first_iter)
+            trace.iterations.append(iteration_trace)
+
+            task_fetching_unit = TaskFetchingUnit(deadline)
+            # Whether the planner or the tools ran out of time, in which case the joinner answers with
+            # the observations collected so far
+            is_timed_out = False
+            prebuilt_plan: Optional[PrebuiltPlan] = None
+            if is_first_iter:
+                prebuilt_plan = inputs.get(self.prebuilt_plan_key)
+                if prebuilt_plan is None and self.plan_cache is not None:
+                    prebuilt_plan = self.plan_cache.lookup(
+                        inputs[self.input_key], self.planner.tools
+                    )
+            try:
+                if prebuilt_plan is not None:
+                    log(
+                        f"Using prebuilt plan from {prebuilt_plan.source}:\n",
+                        prebuilt_plan.plan,
+                        block=True,
+                    )
+                    log_event(
+                        "prebuilt_plan",
+                        source=prebuilt_plan.source,
+                        plan=prebuilt_plan.plan,
+                    )
+                    iteration_trace.planner_response = prebuilt_plan.plan
+                    iteration_trace.plan_source = prebuilt_plan.source
+                    # Stream the plan as if the planner generated it
+                    await streaming_queue.put(prebuilt_plan.plan)
+                    task_fetching_unit.set_tasks(prebuilt_plan.tasks)
+                    await run_with_deadline(task_fetching_unit.schedule(), deadline)
+                elif self.planner_stream:
+                    task_queue = asyncio.Queue()
+                    planner_task = asyncio.create_task(
+                        self.planner.aplan(
+                            inputs=inputs,
+                            task_queue=task_queue,
+                            streaming_queue=streaming_queue,
+                            is_replan=not is_first_iter,
+                            callbacks=(
+                                [self.planner_callback] if self.planner_callback else None
+                            ),
+                            trace=iteration_trace,
+                            deadline=deadline,
+                        )
+                    )
+                    try:
+                        await run_with_deadline(
+                            task_fetching_unit.aschedule(
+                                task_queue=task_queue, func=lambda x: None
+                            ),
+                            deadline,
+                        )
+                    except (asyncio.CancelledError, DeadlineExceeded):
+                        # Stop the planner stream too, otherwise it keeps generating for a stopped run
+                        planner_task.cancel()
+                        raise
+                else:
+                    tasks = await self.planner.plan(
                         inputs=inputs,
-                        task_queue=task_queue,
+                        streaming_queue=streaming_queue,
                         is_replan=not is_first_iter,
+                        # callbacks=run_manager.get_child() if run_manager else None,
                         callbacks=(
                             [self.planner_callback] if self.planner_callback else None
                         ),
+                        trace=iteration_trace,
+                        deadline=deadline,
                     )
-                )
-                await task_fetching_unit.aschedule(
-                    task_queue=task_queue, func=lambda x: None
-                )
-            else:
-                tasks = await self.planner.plan(
-                    inputs=inputs,
-                    is_replan=not is_first_iter,
-                    # callbacks=run_manager.get_child() if run_manager else None,
-                    callbacks=(
-                        [self.planner_callback] if self.planner_callback else None
-                    ),
-                )
-                log("Graph of tasks: ", tasks, block=True)
-                if self.benchmark:
-                    self.planner_callback.additional_fields["num_tasks"] = len(tasks)
-                task_fetching_unit.set_tasks(tasks)
-                await task_fetching_unit.schedule()
+                    log("Graph of tasks: ", tasks, block=True)
+                    log_event(
+                        "plan",
+                        tasks=[
+                            {"idx": task.idx, "name": task.name, "args": task.args}
+                            for task in tasks.values()
+                        ],
+                    )
+                    if self.benchmark:
+                        self.planner_callback.additional_fields["num_tasks"] = len(tasks)
+                    task_fetching_unit.set_tasks(tasks)
+                    await run_with_deadline(task_fetching_unit.schedule(), deadline)
+            except DeadlineExceeded as e:
+                log(f"Deadline exceeded: {e}")
+                log_event("deadline_exceeded", stage=e.stage, timeout=e.timeout)
+                is_timed_out = True
             tasks = task_fetching_unit.tasks
 
             # collect thought-action-observation
@@ -292,19 +497,53 @@ class LLMCompiler(Chain, extra="allow"):
                         include_action=True, include_thought=True
                     )
                     for task in tasks.values()
-                    if not task.is_join
-                    # Also allow join tasks with observation which are there to propagate errors from the planning phase
-                    or (task.is_join and task.observation is not None)
+                    if (not task.is_join and not is_timed_out)
+                    # Also allow join tasks with observation which are there to propagate errors from the planning phase.
+                    # If the run ran out of time, only the tasks that finished are kept
+                    or task.observation is not None
                 ]
             )
             agent_scratchpad = agent_scratchpad.strip()
 
             log("Agent scratchpad:\n", agent_scratchpad, block=True)
-            joinner_thought, answer, is_replan = await self.join(
-                inputs["input"],
-                agent_scratchpad=agent_scratchpad,
-                is_final=is_final_iter,
+            log_event("agent_scratchpad", agent_scratchpad=agent_scratchpad)
+            iteration_trace.tasks = [TaskTrace.from_task(task) for task in tasks.values()]
+            iteration_trace.agent_scratchpad = agent_scratchpad
+            # Don't let the joinner replan if the rest of the budget can't cover another iteration
+            is_final = is_final_iter or is_timed_out
+            if not is_final and deadline is not None and not deadline.can_afford_replan():
+                log("Not enough time left to replan.")
+                is_final = True
+            trace.is_partial = is_timed_out
+            short_circuit_answer = (
+                None if is_timed_out else self._get_short_circuit_answer(tasks)
             )
+            if short_circuit_answer is not None:
+                log(
+                    "Skipping the joinner since the plan succeeded:\n",
+                    short_circuit_answer,
+                    block=True,
+                )
+                log_event("join_skipped", answer=short_circuit_answer)
+                answer = short_circuit_answer
+                iteration_trace.joinner_answer = answer
+                break
+            try:
+                joinner_thought, answer, is_replan = await self.join(
+                    inputs["input"],
+                    agent_scratchpad=agent_scratchpad,
+                    is_final=is_final,
+                    deadline=deadline,
+                )
+            except DeadlineExceeded as e:
+                log(f"Deadline exceeded: {e}")
+                log_event("deadline_exceeded", stage=e.stage, timeout=e.timeout)
+                answer = self._generate_partial_answer(trace.tasks)
+                trace.is_partial = True
+                break
+            iteration_trace.joinner_thought = joinner_thought
+            iteration_trace.joinner_answer = answer
+            iteration_trace.joinner_replan = is_replan
             if not is_replan:
                 log("Break out of replan loop.")
                 break
@@ -321,7 +560,18 @@ class LLMCompiler(Chain, extra="allow"):
         if is_final_iter:
             log("Reached max replan limit.")
 
+        if self.plan_cache is not None and self._is_plan_cacheable(trace):
+            self.plan_cache.add(
+                trace.query,
+                trace.iterations[0].planner_response,
+                planner_prompt=f"{self.planner.system_prompt}\nQuestion: {trace.query}",
+                planner_latency=trace.iterations[0].planner_latency,
+            )
+
         # End the generation request
         await streaming_queue.put(None)
 
-        return {self.output_key: answer}
+        trace.answer = answer
+        trace.end_time = time.time()
+
+        return {self.output_key: answer, self.trace_key: trace}
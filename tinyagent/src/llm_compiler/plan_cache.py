@@ -0,0 +1,424 @@
+import ast
+import datetime
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence, Union
+
+import tiktoken
+import torch
+
+from tinyagent.src.llm_compiler.constants import END_OF_PLAN
+from tinyagent.src.llm_compiler.output_parser import (
+    ACTION_PATTERN,
+    ID_PATTERN,
+    THOUGHT_PATTERN,
+    instantiate_task,
+)
+from tinyagent.src.llm_compiler.planner import PrebuiltPlan
+from tinyagent.src.tools.base import StructuredTool, Tool
+from tinyagent.src.utils.logger_utils import log
+
+# Minimum cosine similarity between a query and the query of a cached plan for the plan to be reused
+PLAN_CACHE_SIMILARITY_THRESHOLD = float(
+    os.environ.get("TINYAGENT_PLAN_CACHE_SIMILARITY", "0.9")
+)
+# Plans with absolute dates are usually resolved from relative ones in the query ("tomorrow at 3pm"),
+# so they are only reused on the day they were planned
+_DATE_PATTERN = r"\b\d{4}-\d{2}-\d{2}\b"
+# Slots are marked in the template strings with their index between NUL characters, which never
+# appear in the planner output
+_SLOT_MARKER_PATTERN = "\x00(\\d+)\x00"
+_MIN_SLOT_LENGTH = 2
+
+_encoder = None
+
+
+def _count_tokens(text: str) -> int:
+    global _encoder
+    if _encoder is None:
+        # same for gpt-3.5
+        _encoder = tiktoken.encoding_for_model("gpt-4")
+    return len(_encoder.encode(text))
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split()).rstrip(".!? ")
+
+
+def _get_string_leaves(value: Any) -> list[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [leaf for item in value for leaf in _get_string_leaves(item)]
+    return []
+
+
+def _map_string_leaves(value: Any, func: Callable[[str], str]) -> Any:
+    if isinstance(value, str):
+        return func(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_string_leaves(item, func) for item in value)
+    return value
+
+
+def _format_arg(value: Any) -> str:
+    if isinstance(value, str):
+        # The planner writes double quoted strings, whose escapes are the same in Python and JSON
+        escaped = (
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        return f'"{escaped}"'
+    if isinstance(value, list):
+        return "[" + ", ".join(_format_arg(item) for item in value) + "]"
+    if isinstance(value, tuple):
+        return ", ".join(_format_arg(item) for item in value)
+    return repr(value)
+
+
+def _get_word_pattern(value: str) -> str:
+    return r"(?<!\w)" + re.escape(value) + r"(?!\w)"
+
+
+@dataclass(frozen=True)
+class _TemplateAction:
+    idx: int
+    tool_name: str
+    # The parsed arguments, where the slot values in the strings are replaced by slot markers
+    args: tuple[Any, ...]
+    thought: str
+
+
+@dataclass
+class PlanTemplate:
+    """
+    A successful plan with the parts that come from the query replaced by slots, e.g. the plan of
+    "Text John that I'm running late" with the slots "John" and "I'm running late".
+    """
+
+    # The normalized query that the plan was made for
+    query: str
+    # Matches the queries that only differ from the original one in the slot values, and captures them
+    query_pattern: re.Pattern
+    actions: list[_TemplateAction]
+    num_slots: int
+    # L2-normalized embedding of the query
+    embedding: torch.Tensor
+    # What a planner call for the query cost, which is saved on every reuse
+    planner_latency: float
+    planner_tokens: int
+    # The time.time() after which the plan is no longer reused, if any
+    expires_at: Optional[float] = None
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def render(self, slot_values: Sequence[str]) -> list[_TemplateAction]:
+        def fill_slots(text: str) -> str:
+            return re.sub(
+                _SLOT_MARKER_PATTERN, lambda match: slot_values[int(match.group(1))], text
+            )
+
+        return [
+            _TemplateAction(
+                idx=action.idx,
+                tool_name=action.tool_name,
+                args=_map_string_leaves(action.args, fill_slots),
+                thought=fill_slots(action.thought),
+            )
+            for action in self.actions
+        ]
+
+
+@dataclass
+class CachedPlan(PrebuiltPlan):
+    """A plan that was rendered from a cached template for a new query."""
+
+    similarity: float
+
+
+def build_plan_template(
+    query: str,
+    planner_response: str,
+    embedding: torch.Tensor,
+    planner_latency: float,
+    planner_tokens: int,
+) -> Optional[PlanTemplate]:
+    """
+    Builds the template of the plan that the planner generated for the query. The string arguments
+    that appear in the query once, as whole words, become slots. Returns None if the plan can't be
+    turned into a template, e.g. if its arguments are not Python literals.
+    """
+    query = _normalize_query(query)
+    actions: list[_TemplateAction] = []
+    matches = re.findall(rf"(?:{THOUGHT_PATTERN}\n)?{ACTION_PATTERN}", planner_response)
+    for thought, idx, tool_name, args, _ in matches:
+        if tool_name == "join":
+            actions.append(_TemplateAction(int(idx), tool_name, (), thought))
+            break
+        try:
+            parsed_args = ast.literal_eval(args) if args != "" else ()
+        except (ValueError, SyntaxError):
+            return None
+        if not isinstance(parsed_args, (list, tuple)):
+            parsed_args = (parsed_args,)
+        actions.append(_TemplateAction(int(idx), tool_name, tuple(parsed_args), thought))
+
+    if len(actions) == 0 or actions[-1].tool_name != "join":
+        return None
+
+    # Pick the shortest values first, so that "John" is a slot and "Meeting with John" is filled from it
+    candidates = {
+        value.strip().lower(): value.strip()
+        for action in actions
+        for value in _get_string_leaves(action.args)
+        if len(value.strip()) >= _MIN_SLOT_LENGTH
+        and re.search(r"\w", value)
+        and not re.search(ID_PATTERN, value)
+    }
+    slot_spans: list[tuple[int, int]] = []
+    slot_values: list[str] = []
+    for value in sorted(candidates.values(), key=len):
+        occurrences = list(
+            re.finditer(_get_word_pattern(value), query, flags=re.IGNORECASE)
+        )
+        if len(occurrences) != 1:
+            continue
+        start, end = occurrences[0].span()
+        if any(start < slot_end and slot_start < end for slot_start, slot_end in slot_spans):
+            continue
+        slot_spans.append((start, end))
+        slot_values.append(value)
+
+    def mark_slots(text: str) -> str:
+        for i, value in enumerate(slot_values):
+            text = re.sub(
+                _get_word_pattern(value), f"\x00{i}\x00", text, flags=re.IGNORECASE
+            )
+        return text
+
+    actions = [
+        _TemplateAction(
+            idx=action.idx,
+            tool_name=action.tool_name,
+            args=_map_string_leaves(action.args, mark_slots),
+            thought=mark_slots(action.thought),
+        )
+        for action in actions
+    ]
+
+    pattern_parts = []
+    position = 0
+    for i, (start, end) in sorted(
+        enumerate(slot_spans), key=lambda slot: slot[1][0]
+    ):
+        pattern_parts.append(re.escape(query[position:start]))
+        pattern_parts.append(f"(?P<slot{i}>.+?)")
+        position = end
+    pattern_parts.append(re.escape(query[position:]))
+
+    expires_at = None
+    if re.search(_DATE_PATTERN, planner_response):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        expires_at = datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+    return PlanTemplate(
+        query=query,
+        query_pattern=re.compile("".join(pattern_parts), flags=re.IGNORECASE),
+        actions=actions,
+        num_slots=len(slot_values),
+        embedding=torch.nn.functional.normalize(embedding.to(torch.float32), dim=0),
+        planner_latency=planner_latency,
+        planner_tokens=planner_tokens,
+        expires_at=expires_at,
+    )
+
+
+class PlanCache:
+    """
+    A bounded LRU cache of the successful plans, stored as templates and indexed by the query embedding,
+    so that the queries that have the same shape as an earlier one ("Text X that Y") skip the planner LLM.
+    A template is only reused if the query is similar enough to its query and differs from it only in
+    the slot values, otherwise the planner is called as usual.
+    The arguments that the planner derived from the query without copying it (e.g. an email subject)
+    are reused as is, which is why the cache is opt-in.
+    """
+
+    _DEFAULT_MAX_SIZE = 256
+
+    # Templates by their query pattern, so that a newer plan for the same query shape replaces the older one
+    _templates: OrderedDict[str, PlanTemplate]
+    # (num_templates, embedding_dim) matrix of the template embeddings, rebuilt when the templates change
+    _embeddings: Optional[torch.Tensor]
+    _embed_query: Callable[[str], torch.Tensor]
+    _similarity_threshold: float
+    _max_size: int
+    _lock: threading.Lock
+    _hits: int
+    _misses: int
+    _seconds_saved: float
+    _tokens_saved: int
+
+    def __init__(
+        self,
+        embed_query: Callable[[str], torch.Tensor],
+        similarity_threshold: float = PLAN_CACHE_SIMILARITY_THRESHOLD,
+        max_size: int = _DEFAULT_MAX_SIZE,
+    ) -> None:
+        self._templates = OrderedDict()
+        self._embeddings = None
+        self._embed_query = embed_query
+        self._similarity_threshold = similarity_threshold
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._seconds_saved = 0.0
+        self._tokens_saved = 0
+
+    def _get_query_embedding(self, query: str) -> torch.Tensor:
+        embedding = torch.as_tensor(self._embed_query(query), dtype=torch.float32)
+        return torch.nn.functional.normalize(embedding, dim=0)
+
+    def lookup(
+        self, query: str, tools: Sequence[Union[Tool, StructuredTool]]
+    ) -> Optional[CachedPlan]:
+        """Returns the plan of the query rendered from a cached template, or None on a miss."""
+        with self._lock:
+            templates = list(self._templates.values())
+            embeddings = self._embeddings
+        if len(templates) == 0:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        try:
+            query_embedding = self._get_query_embedding(query)
+        except Exception as e:
+            # The cache must never fail the run, the planner is called instead
+            log(f"Plan cache lookup failed: {e}")
+            with self._lock:
+                self._misses += 1
+            return None
+        similarities = embeddings @ query_embedding
+        normalized_query = _normalize_query(query)
+        for i in torch.argsort(similarities, descending=True).tolist():
+            similarity = float(similarities[i])
+            if similarity < self._similarity_threshold:
+                break
+            template = templates[i]
+            if template.is_expired():
+                continue
+            cached_plan = self._render(template, normalized_query, tools, similarity)
+            if cached_plan is None:
+                continue
+
+            with self._lock:
+                if template.query_pattern.pattern in self._templates:
+                    self._templates.move_to_end(template.query_pattern.pattern)
+                self._hits += 1
+                self._seconds_saved += template.planner_latency
+                self._tokens_saved += template.planner_tokens
+            log(f"Plan cache hit with similarity {similarity:.4f}")
+            return cached_plan
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    @staticmethod
+    def _render(
+        template: PlanTemplate,
+        query: str,
+        tools: Sequence[Union[Tool, StructuredTool]],
+        similarity: float,
+    ) -> Optional[CachedPlan]:
+        match = template.query_pattern.fullmatch(query)
+        if match is None:
+            return None
+        slot_values = [match.group(f"slot{i}").strip() for i in range(template.num_slots)]
+        if any(
+            len(value) == 0 or re.search(ID_PATTERN, value) for value in slot_values
+        ):
+            return None
+
+        plan_lines = []
+        tasks = {}
+        for action in template.render(slot_values):
+            args = _format_arg(action.args) if len(action.args) > 0 else ""
+            if action.thought:
+                plan_lines.append(f"Thought: {action.thought}")
+            plan_lines.append(f"{action.idx}. {action.tool_name}({args})")
+            try:
+                tasks[action.idx] = instantiate_task(
+                    tools=tools,
+                    idx=action.idx,
+                    tool_name=action.tool_name,
+                    args=args,
+                    thought=action.thought,
+                )
+            except Exception as e:
+                # The tool of the cached plan is not available anymore
+                log(f"Cached plan could not be used: {e}")
+                return None
+        plan_lines.append(END_OF_PLAN)
+
+        return CachedPlan(
+            plan="\n".join(plan_lines),
+            tasks=tasks,
+            source="plan_cache",
+            similarity=similarity,
+        )
+
+    def add(
+        self,
+        query: str,
+        planner_response: str,
+        planner_prompt: str,
+        planner_latency: float,
+    ) -> None:
+        """Caches the plan that the planner generated for the query, once it is known to be successful."""
+        try:
+            template = build_plan_template(
+                query,
+                planner_response,
+                self._get_query_embedding(query),
+                planner_latency=planner_latency,
+                planner_tokens=_count_tokens(planner_prompt)
+                + _count_tokens(planner_response),
+            )
+        except Exception as e:
+            log(f"Plan could not be cached: {e}")
+            return
+        if template is None:
+            return
+
+        with self._lock:
+            key = template.query_pattern.pattern
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self._max_size:
+                self._templates.popitem(last=False)
+            self._embeddings = torch.stack(
+                [template.embedding for template in self._templates.values()]
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+            self._embeddings = None
+
+    def get_stats(self) -> dict[str, float]:
+        with self._lock:
+            num_lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / num_lookups if num_lookups > 0 else 0.0,
+                "size": len(self._templates),
+                "planner_seconds_saved": round(self._seconds_saved, 3),
+                "planner_tokens_saved": self._tokens_saved,
+            }
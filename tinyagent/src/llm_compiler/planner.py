@@ -2,6 +2,8 @@
 
 import asyncio
 import re
+import time
+from dataclasses import dataclass
 from typing import Any, List, Optional, Sequence, Union
 from uuid import UUID
 
@@ -13,6 +15,11 @@ from langchain.schema.messages import HumanMessage, SystemMessage
 
 from tinyagent.src.executors.schema import Plan
 from tinyagent.src.llm_compiler.constants import END_OF_PLAN
+from tinyagent.src.llm_compiler.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    run_with_deadline,
+)
 from tinyagent.src.llm_compiler.output_parser import (
     ACTION_PATTERN,
     THOUGHT_PATTERN,
@@ -20,9 +27,10 @@ from tinyagent.src.llm_compiler.output_parser import (
     instantiate_task,
 )
 from tinyagent.src.llm_compiler.task_fetching_unit import Task
-from tinyagent.src.tiny_agent.models import LLM_ERROR_TOKEN, streaming_queue
+from tinyagent.src.llm_compiler.trace import IterationTrace
+from tinyagent.src.tiny_agent.models import LLM_ERROR_TOKEN
 from tinyagent.src.tools.base import StructuredTool, Tool
-from tinyagent.src.utils.logger_utils import log
+from tinyagent.src.utils.logger_utils import log, log_event
 
 JOIN_DESCRIPTION = (
     "join():\n"
@@ -34,58 +42,126 @@ JOIN_DESCRIPTION = (
 )
 
 
+def _get_guidelines_prompt(actions_position: str) -> str:
+    return (
+        "Guidelines:\n"
+        f" - Each action described {actions_position} contains input/output types and description.\n"
+        "    - You must strictly adhere to the input and output types for each action.\n"
+        "    - The action descriptions contain the guidelines. You MUST strictly follow those guidelines when you use the actions.\n"
+        f" - Each action in the plan should strictly be one of the {actions_position} types. Follow the Python conventions for each action.\n"
+        " - Each action MUST have a unique ID, which is strictly increasing.\n"
+        " - Inputs for actions can either be constants or outputs from preceding actions. "
+        "In the latter case, use the format $id to denote the ID of the previous action whose output will be the input.\n"
+        f" - Always call join as the last action in the plan. Say '{END_OF_PLAN}' after you call join\n"
+        " - Ensure the plan maximizes parallelizability.\n"
+        " - Only use the provided action types. If a query cannot be addressed using these, invoke the join action for the next steps.\n"
+        " - Never explain the plan with comments (e.g. #).\n"
+        " - Never introduce new actions other than the ones provided.\n\n"
+    )
+
+
+_REPLAN_PROMPT = (
+    ' - You are given "Previous Plan" which is the plan that the previous agent created along with the execution results '
+    "(given as Observation) of each plan and a general thought (given as Thought) about the executed results."
+    'You MUST use these information to create the next plan under "Current Plan".\n'
+    ' - When starting the Current Plan, you should start with "Thought" that outlines the strategy for the next plan.\n'
+    " - In the Current Plan, you should NEVER repeat the actions that are already executed in the Previous Plan.\n"
+)
+
+
 def generate_llm_compiler_prompt(
     tools: Sequence[Union[Tool, StructuredTool]],
     example_prompt: str,
     custom_instructions: str | None,
     is_replan: bool = False,
+    prefix_stable: bool = False,
 ):
-    prefix = (
+    """
+    Builds the planner system prompt. If prefix_stable is True, the prompt is laid out from the most
+    static to the most dynamic content (guidelines, custom instructions, tools sorted by name, then the
+    in-context examples), so that the prompts of different queries share a long prefix that the prompt
+    caching of the LLM providers and vLLM can reuse.
+    """
+    if prefix_stable:
+        return _generate_prefix_stable_llm_compiler_prompt(
+            tools, example_prompt, custom_instructions, is_replan
+        )
+
+    # The prompt is a few kilobytes, so it is built as a list of parts that are joined once
+    parts = [
         "Given a user query, create a plan to solve it with the utmost parallelizability. "
         f"Each plan should comprise an action from the following {len(tools) + 1} types:\n"
-    )
+    ]
 
     # Tools
     for i, tool in enumerate(tools):
-        prefix += f"{i+1}. {tool.description}\n"
+        parts.append(f"{i+1}. {tool.description}\n")
 
     # Join operation
-    prefix += f"{i+2}. {JOIN_DESCRIPTION}\n\n"
+    parts.append(f"{len(tools) + 1}. {JOIN_DESCRIPTION}\n\n")
 
     # Guidelines
-    prefix += (
-        "Guidelines:\n"
-        " - Each action described above contains input/output types and description.\n"
-        "    - You must strictly adhere to the input and output types for each action.\n"
-        "    - The action descriptions contain the guidelines. You MUST strictly follow those guidelines when you use the actions.\n"
-        " - Each action in the plan should strictly be one of the above types. Follow the Python conventions for each action.\n"
-        " - Each action MUST have a unique ID, which is strictly increasing.\n"
-        " - Inputs for actions can either be constants or outputs from preceding actions. "
-        "In the latter case, use the format $id to denote the ID of the previous action whose output will be the input.\n"
-        f" - Always call join as the last action in the plan. Say '{END_OF_PLAN}' after you call join\n"
-        " - Ensure the plan maximizes parallelizability.\n"
-        " - Only use the provided action types. If a query cannot be addressed using these, invoke the join action for the next steps.\n"
-        " - Never explain the plan with comments (e.g. #).\n"
-        " - Never introduce new actions other than the ones provided.\n\n"
-    )
+    parts.append(_get_guidelines_prompt("above"))
 
     if custom_instructions:
-        prefix += f"{custom_instructions}\n\n"
+        parts.append(f"{custom_instructions}\n\n")
 
     if is_replan:
-        prefix += (
-            ' - You are given "Previous Plan" which is the plan that the previous agent created along with the execution results '
-            "(given as Observation) of each plan and a general thought (given as Thought) about the executed results."
-            'You MUST use these information to create the next plan under "Current Plan".\n'
-            ' - When starting the Current Plan, you should start with "Thought" that outlines the strategy for the next plan.\n'
-            " - In the Current Plan, you should NEVER repeat the actions that are already executed in the Previous Plan.\n"
-        )
+        parts.append(_REPLAN_PROMPT)
 
     # Examples
-    prefix += "Here are some examples:\n\n"
-    prefix += example_prompt
+    parts.append("Here are some examples:\n\n")
+    parts.append(example_prompt)
 
-    return prefix
+    return "".join(parts)
+
+
+def _generate_prefix_stable_llm_compiler_prompt(
+    tools: Sequence[Union[Tool, StructuredTool]],
+    example_prompt: str,
+    custom_instructions: str | None,
+    is_replan: bool,
+) -> str:
+    # Static for all the queries
+    parts = [
+        "Given a user query, create a plan to solve it with the utmost parallelizability. "
+        "Each plan should comprise an action from the types listed under 'Actions' below.\n\n",
+        _get_guidelines_prompt("below"),
+    ]
+    if is_replan:
+        parts.append(_REPLAN_PROMPT + "\n")
+
+    # Static for a given config and tool set
+    if custom_instructions:
+        parts.append(f"{custom_instructions}\n\n")
+
+    # Depends on the tools retrieved for the query, which are sorted so that the same set always
+    # gives the same text
+    parts.append("Actions:\n")
+    sorted_tools = sorted(tools, key=lambda tool: tool.name)
+    for i, tool in enumerate(sorted_tools):
+        parts.append(f"{i+1}. {tool.description}\n")
+    parts.append(f"{len(sorted_tools) + 1}. {JOIN_DESCRIPTION}\n\n")
+
+    # Depends on the query the most
+    parts.append("Here are some examples:\n\n")
+    parts.append(example_prompt)
+
+    return "".join(parts)
+
+
+@dataclass
+class PrebuiltPlan:
+    """
+    A plan that was made without calling the planner LLM, e.g. reused from the plan cache or built by a
+    fast path router, which is run in place of the first plan of a run.
+    """
+
+    # The plan in the planner output format, for the trace and the streamed tokens
+    plan: str
+    tasks: dict[int, Task]
+    # Where the plan comes from, e.g. "plan_cache" or "fast_path"
+    source: str
 
 
 class StreamingGraphParser:
@@ -157,19 +233,30 @@ class TinyAgentEarlyStop(BaseException):
 
 class LLMCompilerCallback(AsyncCallbackHandler):
     _queue: asyncio.Queue[Optional[Task]]
+    # Channel of the current run that the raw planner tokens and the errors are streamed to
+    _streaming_queue: asyncio.Queue[Optional[str]]
     _parser: StreamingGraphParser
     _tools: Sequence[Union[Tool, StructuredTool]]
     _curr_idx: int
+    # Raw tokens received so far, which is the planner response even if the generation is stopped early
+    _tokens: list[str]
 
     def __init__(
         self,
         queue: asyncio.Queue[Optional[str]],
+        streaming_queue: asyncio.Queue[Optional[str]],
         tools: Sequence[Union[Tool, StructuredTool]],
     ):
         self._queue = queue
+        self._streaming_queue = streaming_queue
         self._parser = StreamingGraphParser(tools=tools)
         self._tools = tools
         self._curr_idx = 0
+        self._tokens = []
+
+    @property
+    def response(self) -> str:
+        return "".join(self._tokens)
 
     async def on_llm_start(self, serialized, prompts, **kwargs: Any) -> Any:
         """Run when LLM starts running."""
@@ -182,10 +269,11 @@ class LLMCompilerCallback(AsyncCallbackHandler):
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> None:
+        self._tokens.append(token)
         try:
             parsed_data = self._parser.ingest_token(token)
             print(token, end="", flush=True)
-            await streaming_queue.put(token)
+            await self._streaming_queue.put(token)
             if parsed_data:
                 self._curr_idx = parsed_data.idx
                 await self._queue.put(parsed_data)
@@ -195,18 +283,24 @@ class LLMCompilerCallback(AsyncCallbackHandler):
             # If there was an error in parsing the token, stop the LLM and propagate the error to
             # the joinner for it to handle. The error message will be presented as an observation in the join action.
             # This usually happens when the tool name is not recognized/hallucinated by the LLM.
-            join_tool = instantiate_task(
-                tools=self._tools,
-                idx=self._curr_idx + 1,
-                tool_name="join",
-                args="",
-                thought="",
+            await self.stop_with_observation(
+                f"The plan generation was stopped due to an error in tool '{self._parser.buffer.strip()}'! Error: {str(e)}! You MUST correct this error and try again!"
             )
-            join_tool.observation = f"The plan generation was stopped due to an error in tool '{self._parser.buffer.strip()}'! Error: {str(e)}! You MUST correct this error and try again!"
-            await self._queue.put(join_tool)
-            await self._queue.put(None)
             raise TinyAgentEarlyStop(str(e))
 
+    async def stop_with_observation(self, observation: str) -> None:
+        """Ends the plan with a join task that presents the given observation to the joinner."""
+        join_tool = instantiate_task(
+            tools=self._tools,
+            idx=self._curr_idx + 1,
+            tool_name="join",
+            args="",
+            thought="",
+        )
+        join_tool.observation = observation
+        await self._queue.put(join_tool)
+        await self._queue.put(None)
+
     async def on_llm_end(
         self,
         response: LLMResult,
@@ -230,10 +324,11 @@ class LLMCompilerCallback(AsyncCallbackHandler):
         tags: Optional[List[str]] = None,
         **kwargs: Any,
     ) -> None:
-        if isinstance(error, TinyAgentEarlyStop):
-            # Only allow the TinyAgentEarlyStop exception since it is a controlled stop
+        if isinstance(error, (TinyAgentEarlyStop, asyncio.CancelledError)):
+            # Only allow the TinyAgentEarlyStop exception and the cancellations (by the user or by the
+            # deadline of the run) since they are controlled stops
             return
-        await streaming_queue.put(f"{LLM_ERROR_TOKEN}LLMError: {error}")
+        await self._streaming_queue.put(f"{LLM_ERROR_TOKEN}LLMError: {error}")
 
     async def on_chain_error(
         self,
@@ -244,7 +339,7 @@ class LLMCompilerCallback(AsyncCallbackHandler):
         tags: Optional[List[str]] = None,
         **kwargs: Any,
     ) -> None:
-        await streaming_queue.put(f"{LLM_ERROR_TOKEN}ChainError: {error}")
+        await self._streaming_queue.put(f"{LLM_ERROR_TOKEN}ChainError: {error}")
 
 
 class Planner:
@@ -256,6 +351,7 @@ class Planner:
         example_prompt_replan: str,
         tools: Sequence[Union[Tool, StructuredTool]],
         stop: Optional[list[str]],
+        prefix_stable_prompt: bool = False,
     ):
         self.llm = llm
         # different system prompt is needed when replanning
@@ -265,12 +361,14 @@ class Planner:
             custom_instructions=custom_instructions,
             example_prompt=example_prompt,
             is_replan=False,
+            prefix_stable=prefix_stable_prompt,
         )
         self.system_prompt_replan = generate_llm_compiler_prompt(
             tools=tools,
             custom_instructions=custom_instructions,
             example_prompt=example_prompt_replan,
             is_replan=True,
+            prefix_stable=prefix_stable_prompt,
         )
         self.tools = tools
         self.output_parser = LLMCompilerPlanParser(tools=tools)
@@ -279,10 +377,15 @@ class Planner:
     async def run_llm(
         self,
         inputs: dict[str, Any],
+        streaming_queue: asyncio.Queue[Optional[str]],
         is_replan: bool = False,
         callbacks: Callbacks = None,
+        deadline: Optional[Deadline] = None,
     ) -> str:
-        """Run the LLM."""
+        """
+        Run the LLM. Errors are also reported to the streaming_queue of the current run.
+        If a deadline is given, raises DeadlineExceeded when the LLM doesn't respond within the planner budget.
+        """
         if is_replan:
             system_prompt = self.system_prompt_replan
             assert "context" in inputs, "If replanning, context must be provided"
@@ -296,11 +399,17 @@ class Planner:
                 HumanMessage(content=human_prompt),
             ]
             try:
-                llm_response = await self.llm._call_async(
-                    messages,
-                    callbacks=callbacks,
-                    stop=self.stop,
+                llm_response = await run_with_deadline(
+                    self.llm._call_async(
+                        messages,
+                        callbacks=callbacks,
+                        stop=self.stop,
+                    ),
+                    deadline,
+                    "planner",
                 )
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 # Put this exception in the streaming queue to stop the LLM since the whole planner
                 # system is running as an async tasks concurrently and is never awaited. Hence
@@ -309,24 +418,44 @@ class Planner:
             response = llm_response.content
         elif isinstance(self.llm, BaseLLM):
             message = system_prompt + "\n\n" + human_prompt
-            response = await self.llm.apredict(
-                message,
-                callbacks=callbacks,
-                stop=self.stop,
+            response = await run_with_deadline(
+                self.llm.apredict(
+                    message,
+                    callbacks=callbacks,
+                    stop=self.stop,
+                ),
+                deadline,
+                "planner",
             )
         else:
             raise ValueError("LLM must be either BaseChatModel or BaseLLM")
 
         log("LLMCompiler planner response: \n", response, block=True)
+        log_event("planner_response", response=response, is_replan=is_replan)
 
         return response
 
     async def plan(
-        self, inputs: dict, is_replan: bool, callbacks: Callbacks = None, **kwargs: Any
+        self,
+        inputs: dict,
+        streaming_queue: asyncio.Queue[Optional[str]],
+        is_replan: bool,
+        callbacks: Callbacks = None,
+        trace: Optional[IterationTrace] = None,
+        deadline: Optional[Deadline] = None,
+        **kwargs: Any,
     ):
+        start_time = time.time()
         llm_response = await self.run_llm(
-            inputs=inputs, is_replan=is_replan, callbacks=callbacks
+            inputs=inputs,
+            streaming_queue=streaming_queue,
+            is_replan=is_replan,
+            callbacks=callbacks,
+            deadline=deadline,
         )
+        if trace is not None:
+            trace.planner_response = llm_response
+            trace.planner_latency = time.time() - start_time
         llm_response = llm_response + "\n"
         return self.output_parser.parse(llm_response)
 
@@ -334,23 +463,41 @@ class Planner:
         self,
         inputs: dict,
         task_queue: asyncio.Queue[Optional[str]],
+        streaming_queue: asyncio.Queue[Optional[str]],
         is_replan: bool,
         callbacks: Callbacks = None,
+        trace: Optional[IterationTrace] = None,
+        deadline: Optional[Deadline] = None,
         **kwargs: Any,
     ) -> Plan:
         """Given input, asynchronously decide what to do."""
-        all_callbacks = [
-            LLMCompilerCallback(
-                queue=task_queue,
-                tools=self.tools,
-            )
-        ]
+        llm_compiler_callback = LLMCompilerCallback(
+            queue=task_queue,
+            streaming_queue=streaming_queue,
+            tools=self.tools,
+        )
+        all_callbacks = [llm_compiler_callback]
         if callbacks:
             all_callbacks.extend(callbacks)
+        start_time = time.time()
         try:
             # Actually, we don't need this try-except block here, but we keep it just in case...
             await self.run_llm(
-                inputs=inputs, is_replan=is_replan, callbacks=all_callbacks
+                inputs=inputs,
+                streaming_queue=streaming_queue,
+                is_replan=is_replan,
+                callbacks=all_callbacks,
+                deadline=deadline,
             )
         except TinyAgentEarlyStop as e:
             pass
+        except DeadlineExceeded as e:
+            # Let the tasks that were already streamed finish, and tell the joinner that the plan is cut short
+            await llm_compiler_callback.stop_with_observation(
+                f"The plan generation was stopped because {str(e).lower()}! "
+                "Answer with the observations that are available."
+            )
+        finally:
+            if trace is not None:
+                trace.planner_response = llm_compiler_callback.response
+                trace.planner_latency = time.time() - start_time
@@ -1,13 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import time
 from dataclasses import dataclass
 from typing import Any, Callable, Collection, Dict, List, Optional
 
-from tinyagent.src.utils.logger_utils import log
-
-SCHEDULING_INTERVAL = 0.01  # seconds
-
+from tinyagent.src.llm_compiler.deadline import Deadline, run_with_deadline
+from tinyagent.src.utils.logger_utils import log, log_event
 
 def _default_stringify_rule_for_arguments(args):
     if len(args) == 1:
@@ -49,11 +48,24 @@ class Task:
     thought: Optional[str] = None
     observation: Optional[str] = None
     is_join: bool = False
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
 
-    async def __call__(self) -> Any:
+    async def __call__(self, deadline: Optional[Deadline] = None) -> Any:
         log(f"running task {self.name}")
-        x = await self.tool(*self.args)
+        log_event("task_start", idx=self.idx, name=self.name)
+        self.start_time = time.time()
+        try:
+            x = await run_with_deadline(self.tool(*self.args), deadline, "task")
+        finally:
+            self.end_time = time.time()
         log(f"done task {self.name}")
+        log_event(
+            "task_done",
+            idx=self.idx,
+            name=self.name,
+            duration=round(self.end_time - self.start_time, 3),
+        )
         return x
 
     def get_though_action_observation(
@@ -80,31 +92,92 @@ class Task:
 
 
 class TaskFetchingUnit:
+    """
+    Runs the tasks of a plan in parallel while respecting their dependencies.
+    Scheduling is event-driven: every task keeps a counter of its unfinished dependencies and is
+    started as soon as the last of them finishes, so the total scheduling work is O(tasks + edges).
+    """
+
     tasks: Dict[str, Task]
     tasks_done: Dict[str, asyncio.Event]
     remaining_tasks: set[str]
-
-    def __init__(self):
+    # Number of unfinished dependencies of each task that is not started yet
+    _num_pending_dependencies: Dict[int, int]
+    # Tasks that are waiting for each task to finish
+    _dependents: Dict[int, List[int]]
+    # Tasks that are currently running, kept so that they are not garbage collected
+    _running_tasks: set[asyncio.Task]
+    # Number of tasks that are not finished yet
+    _num_unfinished_tasks: int
+    # Whether all the tasks of the plan are received
+    _no_more_tasks: bool
+    _all_tasks_done: asyncio.Event
+    # Deadline of the run, which bounds each tool call
+    _deadline: Optional[Deadline]
+
+    def __init__(self, deadline: Optional[Deadline] = None):
         self.tasks = {}
         self.tasks_done = {}
         self.remaining_tasks = set()
+        self._num_pending_dependencies = {}
+        self._dependents = {}
+        self._running_tasks = set()
+        self._num_unfinished_tasks = 0
+        self._no_more_tasks = False
+        self._all_tasks_done = asyncio.Event()
+        self._deadline = deadline
 
     def set_tasks(self, tasks: dict[str, Any]):
+        self._num_unfinished_tasks += len(set(tasks.keys()) - set(self.tasks.keys()))
         self.tasks.update(tasks)
         self.tasks_done.update({task_idx: asyncio.Event() for task_idx in tasks})
         self.remaining_tasks.update(set(tasks.keys()))
-
-    def _all_tasks_done(self):
-        return all(self.tasks_done[d].is_set() for d in self.tasks_done)
-
-    def _get_all_executable_tasks(self):
-        return [
-            task_name
-            for task_name in self.remaining_tasks
-            if all(
-                self.tasks_done[d].is_set() for d in self.tasks[task_name].dependencies
-            )
-        ]
+        for task_idx in tasks:
+            self._register_dependencies(task_idx)
+
+    def _register_dependencies(self, task_idx: int):
+        """
+        Counts the unfinished dependencies of the task and subscribes it to them.
+        Dependencies on tasks that don't exist in the plan can never be met, hence they are ignored.
+        """
+        num_pending_dependencies = 0
+        for dependency in self.tasks[task_idx].dependencies:
+            if dependency in self.tasks_done and not self.tasks_done[dependency].is_set():
+                self._dependents.setdefault(dependency, []).append(task_idx)
+                num_pending_dependencies += 1
+        self._num_pending_dependencies[task_idx] = num_pending_dependencies
+
+    def _start_task(self, task_idx: int):
+        # The task is executed in a separate task to avoid blocking the scheduler
+        # without explicitly awaiting it. This, unfortunately, means that the
+        # task will not be able to propagate exceptions to the calling context.
+        # Hence, we need to handle exceptions within the task itself. See ._run_task()
+        self.remaining_tasks.remove(task_idx)
+        running_task = asyncio.create_task(self._run_task(self.tasks[task_idx]))
+        self._running_tasks.add(running_task)
+        running_task.add_done_callback(self._running_tasks.discard)
+
+    def _start_executable_tasks(self):
+        for task_idx in list(self.remaining_tasks):
+            if self._num_pending_dependencies[task_idx] == 0:
+                self._start_task(task_idx)
+
+    def _on_task_done(self, task_idx: int):
+        """Starts the dependents whose last dependency was this task."""
+        self.tasks_done[task_idx].set()
+        self._num_unfinished_tasks -= 1
+        for dependent in self._dependents.pop(task_idx, []):
+            self._num_pending_dependencies[dependent] -= 1
+            if (
+                self._num_pending_dependencies[dependent] == 0
+                and dependent in self.remaining_tasks
+            ):
+                self._start_task(dependent)
+        self._check_all_tasks_done()
+
+    def _check_all_tasks_done(self):
+        if self._no_more_tasks and self._num_unfinished_tasks <= 0:
+            self._all_tasks_done.set()
 
     def _preprocess_args(self, task: Task):
         """Replace dependency placeholders, i.e. ${1}, in task.args with the actual observation."""
@@ -118,7 +191,7 @@ class TaskFetchingUnit:
         try:
             self._preprocess_args(task)
             if not task.is_join:
-                observation = await task()
+                observation = await task(self._deadline)
                 task.observation = observation
         except Exception as e:
             # If an exception occurs, stop LLM execution and propagate the error message to the joinner
@@ -131,51 +204,49 @@ class TaskFetchingUnit:
                 f"Error: {error_message}! You MUST correct this error and try again!"
             )
 
-        self.tasks_done[task.idx].set()
+        self._on_task_done(task.idx)
 
-    async def schedule(self):
-        """Run all tasks in self.tasks in parallel, respecting dependencies."""
-        # run until all tasks are done
-        while not self._all_tasks_done():
-            # Find tasks with no dependencies or with all dependencies met
-            executable_tasks = self._get_all_executable_tasks()
+    def cancel(self):
+        """Cancel the running tasks and drop the ones that are not started yet."""
+        self.remaining_tasks.clear()
+        for running_task in list(self._running_tasks):
+            running_task.cancel()
 
-            for task_name in executable_tasks:
-                asyncio.create_task(self._run_task(self.tasks[task_name]))
-                self.remaining_tasks.remove(task_name)
+    async def _wait_for_all_tasks(self):
+        try:
+            await self._all_tasks_done.wait()
+        except asyncio.CancelledError:
+            # Don't leave the tool calls running in the background if the run is cancelled
+            self.cancel()
+            raise
 
-            await asyncio.sleep(SCHEDULING_INTERVAL)
+    async def schedule(self):
+        """Run all tasks in self.tasks in parallel, respecting dependencies."""
+        self._no_more_tasks = True
+        self._start_executable_tasks()
+        self._check_all_tasks_done()
+        await self._wait_for_all_tasks()
 
     async def aschedule(self, task_queue: asyncio.Queue[Optional[Task]], func):
         """Asynchronously listen to task_queue and schedule tasks as they arrive."""
-        no_more_tasks = False  # Flag to check if all tasks are received
-
         while True:
-            if not no_more_tasks:
-                # Wait for a new task to be added to the queue
+            # Wait for a new task to be added to the queue
+            try:
                 task = await task_queue.get()
+            except asyncio.CancelledError:
+                self.cancel()
+                raise
 
-                # Check for sentinel value indicating end of tasks
-                if task is None:
-                    no_more_tasks = True
-                else:
-                    # Parse and set the new tasks
-                    self.set_tasks({task.idx: task})
-
-            # Schedule and run executable tasks
-            executable_tasks = self._get_all_executable_tasks()
-
-            if executable_tasks:
-                for task_name in executable_tasks:
-                    # The task is executed in a separate task to avoid blocking the loop
-                    # without explicitly awaiting it. This, unfortunately, means that the
-                    # task will not be able to propagate exceptions to the calling context.
-                    # Hence, we need to handle exceptions within the task itself. See ._run_task()
-                    asyncio.create_task(self._run_task(self.tasks[task_name]))
-                    self.remaining_tasks.remove(task_name)
-            elif no_more_tasks and self._all_tasks_done():
-                # Exit the loop if no more tasks are expected and all tasks are done
+            # Check for sentinel value indicating end of tasks
+            if task is None:
                 break
-            else:
-                # If no executable tasks are found, sleep for the SCHEDULING_INTERVAL
-                await asyncio.sleep(SCHEDULING_INTERVAL)
+
+            # Start the new task right away if all its dependencies are already done,
+            # otherwise it is started by the last dependency that finishes
+            self.set_tasks({task.idx: task})
+            if self._num_pending_dependencies[task.idx] == 0:
+                self._start_task(task.idx)
+
+        self._no_more_tasks = True
+        self._check_all_tasks_done()
+        await self._wait_for_all_tasks()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+from tinyagent.src.llm_compiler.task_fetching_unit import Task
+
+
+@dataclass
+class TaskTrace:
+    idx: int
+    name: str
+    args: list[Any]
+    dependencies: list[int]
+    thought: Optional[str]
+    observation: Optional[str]
+    is_join: bool
+    start_time: Optional[float]
+    end_time: Optional[float]
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    @staticmethod
+    def from_task(task: Task) -> TaskTrace:
+        return TaskTrace(
+            idx=task.idx,
+            name=task.name,
+            args=list(task.args),
+            dependencies=list(task.dependencies),
+            thought=task.thought,
+            observation=(
+                str(task.observation) if task.observation is not None else None
+            ),
+            is_join=task.is_join,
+            start_time=task.start_time,
+            end_time=task.end_time,
+        )
+
+
+@dataclass
+class IterationTrace:
+    """The trace of a single plan-execute-join iteration of a run."""
+
+    is_replan: bool
+    planner_response: str = ""
+    # Seconds that the planner LLM took, or None if the planner wasn't called
+    planner_latency: Optional[float] = None
+    # Where the plan comes from: "planner", or the source of the PrebuiltPlan that replaced the planner
+    plan_source: str = "planner"
+    tasks: list[TaskTrace] = field(default_factory=list)
+    agent_scratchpad: str = ""
+    joinner_thought: str = ""
+    joinner_answer: str = ""
+    # Whether the joinner decided to replan after this iteration
+    joinner_replan: bool = False
+
+
+@dataclass
+class RunTrace:
+    """
+    In-memory trace of an LLMCompiler run, which is returned alongside the answer so that the callers
+    don't need to recover the planner output and the observations from the log.
+    """
+
+    query: str
+    run_id: Optional[str] = None
+    iterations: list[IterationTrace] = field(default_factory=list)
+    answer: str = ""
+    # Whether the run ran out of time, so the answer is based on part of the observations
+    is_partial: bool = False
+    start_time: float = field(default_factory=time.time)
+    end_time: Optional[float] = None
+
+    @property
+    def planner_response(self) -> str:
+        return "\n\n".join(
+            iteration.planner_response.strip() for iteration in self.iterations
+        )
+
+    @property
+    def agent_scratchpad(self) -> str:
+        # The scratchpad accumulates over the iterations, hence the last one has everything
+        if len(self.iterations) == 0:
+            return ""
+        return self.iterations[-1].agent_scratchpad
+
+    @property
+    def tasks(self) -> list[TaskTrace]:
+        return [task for iteration in self.iterations for task in iteration.tasks]
+
+    def get_observations(self, tool_name: str) -> list[str]:
+        return [
+            task.observation
+            for task in self.tasks
+            if task.name == tool_name and task.observation is not None
+        ]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "planner_response": self.planner_response,
+            "agent_scratchpad": self.agent_scratchpad,
+        }
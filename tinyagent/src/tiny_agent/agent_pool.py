@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from tinyagent.src.llm_compiler.plan_cache import PlanCache
+from tinyagent.src.tiny_agent.models import ModelConfig, TinyAgentConfig
+from tinyagent.src.tiny_agent.prompt_cache import PromptCache
+from tinyagent.src.tiny_agent.tiny_agent import TinyAgent
+from tinyagent.src.utils.logger_utils import log
+
+
+def _get_model_config_key(config: ModelConfig | None) -> tuple | None:
+    if config is None:
+        return None
+    # The tokenizer is derived from the other fields, so it is left out of the key
+    return (
+        config.model_type.value,
+        config.model_name,
+        config.api_key,
+        config.context_length,
+        config.port,
+    )
+
+
+def get_config_hash(config: TinyAgentConfig) -> str:
+    """
+    Returns a stable hash of the TinyAgentConfig fields that affect how a TinyAgent is built.
+    """
+    key = (
+        tuple(sorted(app.value for app in config.apps)),
+        config.custom_instructions,
+        _get_model_config_key(config.llmcompiler_config),
+        _get_model_config_key(config.sub_agent_config),
+        _get_model_config_key(config.embedding_model_config),
+        config.azure_api_version,
+        config.azure_endpoint,
+        config.hf_token,
+        config.zoom_access_token,
+        config.tool_rag_cache_dir,
+        config.prefix_stable_prompt,
+        config.plan_cache,
+        config.fast_path,
+        config.join_short_circuit,
+    )
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+class TinyAgentPool:
+    """
+    A pool of warm TinyAgent instances keyed by the hash of their config.
+    Building a TinyAgent creates the model clients, the sub-agents, the tools, the planner prompts
+    and the ToolRAG classifier, so the instances are reused across requests instead.
+    An instance is only ever checked out by one request at a time and is reset before it goes back
+    into the pool. Since the model clients keep connections that are bound to the event loop they
+    were used on, the idle instances are also bucketed by the event loop that acquired them.
+    The caches that outlive a request are shared by all the instances of a config across the event
+    loops, so that every new instance doesn't start cold.
+    """
+
+    _DEFAULT_MAX_IDLE_PER_CONFIG = 4
+
+    _lock: threading.Lock
+    _idle: weakref.WeakKeyDictionary[
+        asyncio.AbstractEventLoop, dict[str, list[TinyAgent]]
+    ]
+    _max_idle_per_config: int
+    # Planner prompt cache and plan cache of each config hash
+    _prompt_caches: dict[str, PromptCache]
+    _plan_caches: dict[str, PlanCache]
+    # Background tasks that close the dropped instances, referenced so that they aren't garbage collected
+    _closing_tasks: set[asyncio.Task]
+
+    def __init__(self, max_idle_per_config: int = _DEFAULT_MAX_IDLE_PER_CONFIG):
+        self._lock = threading.Lock()
+        self._idle = weakref.WeakKeyDictionary()
+        self._max_idle_per_config = max_idle_per_config
+        self._prompt_caches = {}
+        self._plan_caches = {}
+        self._closing_tasks = set()
+
+    def acquire(self, config: TinyAgentConfig) -> TinyAgent:
+        """
+        Returns an idle TinyAgent for the given config, or builds a new one if there is none.
+        Must be called from the event loop that will run the agent.
+        """
+        loop = asyncio.get_running_loop()
+        config_hash = get_config_hash(config)
+        with self._lock:
+            idle_agents = self._idle.get(loop, {}).get(config_hash)
+            if idle_agents:
+                return idle_agents.pop()
+            prompt_cache = self._prompt_caches.setdefault(config_hash, PromptCache())
+            plan_cache = self._plan_caches.get(config_hash)
+
+        tiny_agent = TinyAgent(config, prompt_cache=prompt_cache, plan_cache=plan_cache)
+        if plan_cache is None and tiny_agent.agent.plan_cache is not None:
+            with self._lock:
+                # Another instance of the config may have been built meanwhile, whose cache wins
+                tiny_agent.agent.plan_cache = self._plan_caches.setdefault(
+                    config_hash, tiny_agent.agent.plan_cache
+                )
+        return tiny_agent
+
+    def release(
+        self, config: TinyAgentConfig, tiny_agent: TinyAgent, discard: bool = False
+    ) -> None:
+        """
+        Returns the TinyAgent to the pool. If discard is True, e.g. the run failed and the
+        instance might be left in an inconsistent state, the instance is dropped instead.
+        """
+        if discard:
+            self._close(tiny_agent)
+            return
+
+        tiny_agent.reset()
+        loop = asyncio.get_running_loop()
+        config_hash = get_config_hash(config)
+        with self._lock:
+            idle_agents = self._idle.setdefault(loop, {}).setdefault(config_hash, [])
+            if len(idle_agents) < self._max_idle_per_config:
+                idle_agents.append(tiny_agent)
+                return
+
+        self._close(tiny_agent)
+
+    def _close(self, tiny_agent: TinyAgent) -> None:
+        """Closes a dropped instance in the background, on the current event loop."""
+        task = asyncio.get_running_loop().create_task(tiny_agent.aclose())
+        with self._lock:
+            self._closing_tasks.add(task)
+        task.add_done_callback(self._on_closed)
+
+    def _on_closed(self, task: asyncio.Task) -> None:
+        with self._lock:
+            self._closing_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log(f"Failed to close a TinyAgent: {task.exception()}")
+
+    @asynccontextmanager
+    async def checkout(self, config: TinyAgentConfig) -> AsyncIterator[TinyAgent]:
+        """
+        Checks out a TinyAgent for the duration of the context and returns it to the pool afterwards.
+        """
+        tiny_agent = self.acquire(config)
+        try:
+            yield tiny_agent
+        except BaseException:
+            self.release(config, tiny_agent, discard=True)
+            raise
+        self.release(config, tiny_agent)
+
+    def clear(self) -> None:
+        """
+        Drops all the idle TinyAgent instances and closes them like the discarded ones. Each instance is
+        closed on the event loop that used it, as soon as that loop runs.
+        """
+        with self._lock:
+            idle_agents = [
+                (loop, tiny_agent)
+                for loop, agents_by_config in self._idle.items()
+                for agents in agents_by_config.values()
+                for tiny_agent in agents
+            ]
+            self._idle.clear()
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        for loop, tiny_agent in idle_agents:
+            if loop is current_loop:
+                self._close(tiny_agent)
+                continue
+            try:
+                loop.call_soon_threadsafe(self._close, tiny_agent)
+            except RuntimeError:
+                # The loop is closed, so the connections of the instance can't be closed anymore
+                log("Failed to close a TinyAgent: its event loop is closed")
@@ -29,3 +29,9 @@ class Computer:
         self.reminders = Reminders()
         self.sms = SMS()
         self.spotlight_search = SpotlightSearch()
+
+    async def aclose(self) -> None:
+        """Closes the network resources held by the tools."""
+        zoom = getattr(self, "zoom", None)
+        if zoom is not None:
+            await zoom.close()
@@ -1,5 +1,6 @@
 import json
 import os
+import threading
 from typing import Any
 
 from tiktoken import encoding_name_for_model, get_encoding
@@ -10,6 +11,7 @@ from tinyagent.src.tiny_agent.models import (
     App,
     ModelConfig,
     ModelType,
+    TINY_AGENT_DIR,
     TinyAgentConfig,
     WhisperConfig,
 )
@@ -17,6 +19,7 @@ from tinyagent.src.tiny_agent.models import (
 DEFAULT_SAFE_CONTEXT_LENGTH = 4096
 DEFAULT_EMBEDDING_CONTEXT_LENGTH = 8192
 DEFAULT_OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+DEFAULT_TOOL_RAG_CACHE_DIR = os.path.join(TINY_AGENT_DIR, "tool_rag_cache")
 
 
 OPENAI_MODELS = {
@@ -40,6 +43,10 @@ AGENT_TYPE_TO_CONFIG_PREFIX = {
     AgentType.EMBEDDING: "Embedding",
 }
 
+# Cache of the parsed configs keyed by the config path, along with the modification time of the file
+_config_cache: dict[str, tuple[int, TinyAgentConfig]] = {}
+_config_cache_lock = threading.Lock()
+
 
 def load_config(config_path: str) -> dict[str, Any]:
     with open(config_path, "r") as file:
@@ -189,6 +196,9 @@ def get_tiny_agent_config(config_path: str) -> TinyAgentConfig:
     # Get the other config values
     hf_token = config.get("hfToken")
     zoom_access_token = config.get("zoomAccessToken")
+    tool_rag_cache_dir = (
+        DEFAULT_TOOL_RAG_CACHE_DIR if config.get("persistToolRAGCache") else None
+    )
 
     # Get the whisper API key which is just the OpenAI API key
     if (
@@ -217,9 +227,32 @@ def get_tiny_agent_config(config_path: str) -> TinyAgentConfig:
         hf_token=hf_token,
         zoom_access_token=zoom_access_token,
         whisper_config=whisper_config,
+        tool_rag_cache_dir=tool_rag_cache_dir,
+        prefix_stable_prompt=bool(config.get("prefixStablePrompt", False)),
+        plan_cache=bool(config.get("usePlanCache", False)),
+        fast_path=bool(config.get("useFastPath", False)),
+        join_short_circuit=bool(config.get("joinShortCircuit", True)),
     )
 
 
+def get_cached_tiny_agent_config(config_path: str) -> TinyAgentConfig:
+    """
+    Same as get_tiny_agent_config, but only re-parses the config (and reloads the tokenizers)
+    when the config file has been modified since the last call.
+    """
+    mtime = os.stat(config_path).st_mtime_ns
+    with _config_cache_lock:
+        cached = _config_cache.get(config_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    config = get_tiny_agent_config(config_path)
+    with _config_cache_lock:
+        _config_cache[config_path] = (mtime, config)
+
+    return config
+
+
 def _is_valid_config_field(config: dict[str, Any], field: str) -> bool:
     return (field_value := config.get(field)) is not None and len(field_value) > 0
 
@@ -0,0 +1,189 @@
+import abc
+import datetime
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Mapping, Optional
+
+from tinyagent.src.llm_compiler.constants import END_OF_PLAN
+from tinyagent.src.tiny_agent.models import TinyAgentToolName
+
+# Minimum classifier probability of the single tool of a query for the query to take the fast path
+FAST_PATH_THRESHOLD = float(os.environ.get("TINYAGENT_FAST_PATH_THRESHOLD", "0.95"))
+# Maximum probability of every other tool, which is the ToolRAG threshold of a retrieved tool
+FAST_PATH_OTHER_TOOLS_THRESHOLD = 0.5
+# Number of recent latency samples kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+# The arguments that the rules extract are rejected if they mention a time, since turning it into a
+# date needs the planner
+_TIME_PATTERN = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|noon|midnight|morning|afternoon|evening|"
+    r"next|this|every|(mon|tues|wednes|thurs|fri|satur|sun)day|at \d|in \d+|on the|"
+    r"\d{1,2}(:\d{2})?\s*(am|pm))\b",
+    re.IGNORECASE,
+)
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def _quote(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class FastPathRouter(abc.ABC):
+    """
+    Routes the queries that only need a single tool, predicted with a very high confidence by the ToolRAG
+    classifier, to a plan that is built without the planner LLM. Subclasses implement build_plan, e.g.
+    with rules or a small local model, and return None to fall back to the planner.
+    The router also keeps the stats of how many runs take the fast path and how long the runs take.
+    """
+
+    _threshold: float
+    _lock: threading.Lock
+    _num_queries: int
+    _num_bypassed: int
+    _routing_times: deque[float]
+    _bypassed_run_times: deque[float]
+    _planned_run_times: deque[float]
+
+    def __init__(self, threshold: float = FAST_PATH_THRESHOLD) -> None:
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._num_queries = 0
+        self._num_bypassed = 0
+        self._routing_times = deque(maxlen=LATENCY_SAMPLES)
+        self._bypassed_run_times = deque(maxlen=LATENCY_SAMPLES)
+        self._planned_run_times = deque(maxlen=LATENCY_SAMPLES)
+
+    @abc.abstractmethod
+    def build_plan(self, query: str, tool_name: TinyAgentToolName) -> Optional[str]:
+        """
+        Returns the plan of the query in the planner output format, which only uses the given tool,
+        or None if the query needs the planner.
+        """
+        pass
+
+    def route(
+        self, query: str, tool_probabilities: Mapping[TinyAgentToolName, float]
+    ) -> Optional[str]:
+        """
+        Returns the fast path plan of the query if exactly one tool is predicted for it with a probability
+        above the threshold, or None if the query needs the planner.
+        """
+        start_time = time.time()
+        plan = None
+        confident_tools = [
+            tool_name
+            for tool_name, probability in tool_probabilities.items()
+            if probability > FAST_PATH_OTHER_TOOLS_THRESHOLD
+        ]
+        if (
+            len(confident_tools) == 1
+            and tool_probabilities[confident_tools[0]] >= self._threshold
+        ):
+            plan = self.build_plan(query, confident_tools[0])
+
+        with self._lock:
+            self._num_queries += 1
+            self._routing_times.append(time.time() - start_time)
+            if plan is not None:
+                self._num_bypassed += 1
+        return plan
+
+    def record_run(self, is_bypassed: bool, duration: float) -> None:
+        """Records the end-to-end duration of a run, for the latency distribution of each path."""
+        with self._lock:
+            if is_bypassed:
+                self._bypassed_run_times.append(duration)
+            else:
+                self._planned_run_times.append(duration)
+
+    @staticmethod
+    def _get_latency_stats(durations: deque[float]) -> dict[str, Optional[float]]:
+        sorted_durations = sorted(durations)
+        return {
+            "count": len(sorted_durations),
+            "mean": (
+                sum(sorted_durations) / len(sorted_durations) if sorted_durations else None
+            ),
+            "p50": _percentile(sorted_durations, 0.5),
+            "p95": _percentile(sorted_durations, 0.95),
+            "max": sorted_durations[-1] if sorted_durations else None,
+        }
+
+    def get_stats(self) -> dict[str, object]:
+        with self._lock:
+            return {
+                "queries": self._num_queries,
+                "bypassed": self._num_bypassed,
+                "bypass_rate": (
+                    self._num_bypassed / self._num_queries if self._num_queries > 0 else 0.0
+                ),
+                "routing_time": self._get_latency_stats(self._routing_times),
+                "bypassed_run_time": self._get_latency_stats(self._bypassed_run_times),
+                "planned_run_time": self._get_latency_stats(self._planned_run_times),
+            }
+
+
+class RuleBasedFastPathRouter(FastPathRouter):
+    """
+    Fast path router that extracts the arguments with regular expressions, for the simple commands that
+    map to a single tool call: opening a location in Maps and creating a reminder without a due date.
+    """
+
+    _MAPS_OPEN_LOCATION_PATTERN = re.compile(
+        r"(?:please\s+)?(?:open|show(?: me)?|find|locate|search for|look up|where is|where's)\s+"
+        r"(?P<location>.+?)(?:\s+(?:in|on)\s+(?:apple\s+)?maps)?",
+        re.IGNORECASE,
+    )
+    _CREATE_REMINDER_PATTERN = re.compile(
+        r"(?:please\s+)?(?:remind me to|(?:create|set|add) a reminder to)\s+(?P<name>.+?)",
+        re.IGNORECASE,
+    )
+    # Queries about directions need maps_show_directions rather than maps_open_location
+    _DIRECTIONS_PATTERN = re.compile(
+        r"\b(directions?|route|from|to get to|how (?:do i|to) get)\b", re.IGNORECASE
+    )
+
+    def build_plan(self, query: str, tool_name: TinyAgentToolName) -> Optional[str]:
+        query = " ".join(query.split()).rstrip(".!? ")
+        if tool_name == TinyAgentToolName.MAPS_OPEN_LOCATION:
+            return self._build_maps_open_location_plan(query)
+        if tool_name == TinyAgentToolName.CREATE_REMINDER:
+            return self._build_create_reminder_plan(query)
+        return None
+
+    def _build_maps_open_location_plan(self, query: str) -> Optional[str]:
+        match = self._MAPS_OPEN_LOCATION_PATTERN.fullmatch(query)
+        if match is None or self._DIRECTIONS_PATTERN.search(query):
+            return None
+        location = match.group("location").strip()
+        if len(location) == 0:
+            return None
+        return (
+            f"1. {TinyAgentToolName.MAPS_OPEN_LOCATION.value}({_quote(location)})\n"
+            f"2. join(){END_OF_PLAN}"
+        )
+
+    def _build_create_reminder_plan(self, query: str) -> Optional[str]:
+        match = self._CREATE_REMINDER_PATTERN.fullmatch(query)
+        if match is None:
+            return None
+        name = match.group("name").strip()
+        if len(name) == 0 or _TIME_PATTERN.search(name):
+            return None
+        # Reminders without a due date are due now, as the tool does for a missing due date
+        due_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return (
+            f"1. {TinyAgentToolName.CREATE_REMINDER.value}"
+            f'({_quote(name)}, "{due_date}", "", "", 0, False)\n'
+            f"2. join(){END_OF_PLAN}"
+        )
@@ -1,4 +1,3 @@
-import asyncio
 import os
 from dataclasses import dataclass
 from enum import Enum
@@ -8,8 +7,6 @@ import torch
 from tiktoken import Encoding
 from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
 
-streaming_queue = asyncio.Queue[str | None]()
-
 LLM_ERROR_TOKEN = "###LLM_ERROR_TOKEN###"
 
 TINY_AGENT_DIR = os.path.expanduser("~/Library/Application Support/TinyAgent")
@@ -79,6 +76,19 @@ class TinyAgentConfig:
     zoom_access_token: str | None
     # Whisper config
     whisper_config: WhisperConfig
+    # Directory to persist the ToolRAG query caches to, or None to only keep them in memory
+    tool_rag_cache_dir: str | None = None
+    # Whether to lay out the planner prompt from the most static to the most dynamic content, so that
+    # the prompt caching of the LLM provider or vLLM can reuse the shared prefix across queries
+    prefix_stable_prompt: bool = False
+    # Whether to reuse the successful plans for the queries of the same shape instead of calling the
+    # planner. Needs the embedding model of ToolRAG.
+    plan_cache: bool = False
+    # Whether to run the single-tool queries that the ToolRAG classifier is very confident about without
+    # the planner. Needs ToolRAG.
+    fast_path: bool = False
+    # Whether to skip the joinner when the plan only calls action tools that all succeed
+    join_short_circuit: bool = True
 
 
 class TinyAgentToolName(Enum):
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Collection, Hashable, Sequence
+
+from tinyagent.src.tiny_agent.models import TinyAgentToolName
+
+PromptCacheKey = tuple[frozenset[str], tuple[str, ...], str | None]
+
+
+@dataclass(frozen=True)
+class PlannerPrompt:
+    """
+    The planner system prompt that is built from the tools retrieved for a query. The tools themselves
+    are not kept, since they belong to the TinyAgent instance that built the prompt while the cache is
+    shared by all the instances of a config.
+    """
+
+    system_prompt: str
+
+
+def get_prompt_cache_key(
+    tool_names: Collection[TinyAgentToolName],
+    example_ids: Sequence[str],
+    custom_instructions: str | None,
+) -> PromptCacheKey:
+    # The order of the examples matters since it is the order they appear in the prompt
+    return (
+        frozenset(tool_name.value for tool_name in tool_names),
+        tuple(example_ids),
+        custom_instructions,
+    )
+
+
+class PromptCache:
+    """
+    A bounded LRU cache of the planner prompts, keyed by the retrieved tools, the retrieved in-context
+    examples and the custom instructions. ToolRAG picks from a small set of tools and examples, so the
+    same combinations come up again and again, and rebuilding the tools and the prompt can be skipped.
+    """
+
+    _DEFAULT_MAX_SIZE = 128
+
+    _entries: OrderedDict[Hashable, PlannerPrompt]
+    _max_size: int
+    _lock: threading.Lock
+    _hits: int
+    _misses: int
+
+    def __init__(self, max_size: int = _DEFAULT_MAX_SIZE) -> None:
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_build(
+        self, key: Hashable, build: Callable[[], PlannerPrompt]
+    ) -> PlannerPrompt:
+        """Returns the cached prompt of the given key, or builds and caches it with build()."""
+        with self._lock:
+            prompt = self._entries.get(key)
+            if prompt is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return prompt
+            self._misses += 1
+
+        prompt = build()
+        with self._lock:
+            self._entries[key] = prompt
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        return prompt
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict[str, float]:
+        with self._lock:
+            num_lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / num_lookups if num_lookups > 0 else 0.0,
+                "size": len(self._entries),
+            }
@@ -18,6 +18,9 @@ class ComposeEmailAgent(SubAgent):
     def query(self, query: str) -> None:
         self._query = query
 
+    def reset(self) -> None:
+        self._query = ""
+
     async def __call__(
         self,
         context: str,
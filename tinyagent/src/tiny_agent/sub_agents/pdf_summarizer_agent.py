@@ -1,7 +1,9 @@
 import fitz
 from langchain_core.messages import HumanMessage, SystemMessage
 
+from tinyagent.src.tiny_agent.models import App
 from tinyagent.src.tiny_agent.sub_agents.sub_agent import SubAgent
+from tinyagent.src.tiny_agent.tool_executor import run_blocking
 
 CONTEXT_LENGTHS = {"gpt-4-1106-preview": 127000, "gpt-3.5-turbo": 16000}
 
@@ -13,6 +15,9 @@ class PDFSummarizerAgent(SubAgent):
     def cached_summary_result(self) -> str:
         return self._cached_summary_result
 
+    def reset(self) -> None:
+        self.__dict__.pop("_cached_summary_result", None)
+
     async def __call__(self, pdf_path: str) -> str:
         # Check if the file exists
         if (
@@ -27,7 +32,9 @@ class PDFSummarizerAgent(SubAgent):
             return "The PDF file path is invalid or the file doesn't exist."
 
         try:
-            pdf_content = PDFSummarizerAgent._extract_text_from_pdf(pdf_path)
+            pdf_content = await run_blocking(
+                App.FILES, PDFSummarizerAgent._extract_text_from_pdf, pdf_path
+            )
         except Exception as e:
             return f"An error occurred while extracting the content from the PDF file: {str(e)}"
 
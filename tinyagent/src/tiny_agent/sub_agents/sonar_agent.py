@@ -5,7 +5,8 @@ from langchain_core.messages import HumanMessage, SystemMessage
 
 from tinyagent.src.tiny_agent.sub_agents.sub_agent import SubAgent
 
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
 import os
 
 def ask_question(question):
@@ -27,9 +28,31 @@ def ask_question(question):
     ])
 
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY") 
-client = OpenAI(api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai")
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+# Limits of the connection pool to the Perplexity API, which is shared by the parallel ask_sonar calls
+SONAR_MAX_CONNECTIONS = 10
+SONAR_MAX_KEEPALIVE_CONNECTIONS = 10
+SONAR_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
 
 class SonarAgent(SubAgent):
+    # Created lazily, within the event loop that uses it, and kept to reuse its connections
+    _client: AsyncOpenAI | None = None
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=PERPLEXITY_API_KEY,
+                base_url=PERPLEXITY_BASE_URL,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=SONAR_MAX_CONNECTIONS,
+                        max_keepalive_connections=SONAR_MAX_KEEPALIVE_CONNECTIONS,
+                    ),
+                    timeout=SONAR_TIMEOUT,
+                ),
+            )
+        return self._client
+
     async def __call__(
         self,
         question: str
@@ -37,12 +60,28 @@ class SonarAgent(SubAgent):
         # CHANGE TO USE SONAR
         messages = ask_question(question)
         
-        response = client.chat.completions.create(
+        # Stream the completion so that the event loop keeps serving the other tasks while it is generated
+        stream = await self._get_client().chat.completions.create(
             model="sonar",
             messages=messages,
+            stream=True,
         )
 
-        completion = response.choices[0].message.content
-        citations = response.citations
+        completion_chunks = []
+        citations = []
+        async for chunk in stream:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                completion_chunks.append(chunk.choices[0].delta.content)
+            # Perplexity sends the citations along with the chunks, the last ones are the complete list
+            chunk_citations = getattr(chunk, "citations", None)
+            if chunk_citations:
+                citations = chunk_citations
+        completion = "".join(completion_chunks)
         
-        return ("ASKING SONAR...\n\nCompletion: " + completion + "\n\nCitations: [" + ",".join(citations) + "]") 
\ No newline at end of file
+        return ("ASKING SONAR...\n\nCompletion: " + completion + "\n\nCitations: [" + ",".join(citations) + "]")
+
+    async def aclose(self) -> None:
+        """Closes the pooled connections to the Perplexity API."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
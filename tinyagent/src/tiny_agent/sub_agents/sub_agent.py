@@ -35,6 +35,12 @@ class SubAgent(abc.ABC):
     async def __call__(self, *args, **kwargs) -> str:
         pass
 
+    def reset(self) -> None:
+        """
+        Clears the state kept from the previous query so that the sub-agent can be reused.
+        """
+        pass
+
     def check_context_length(
         self, messages: list[BaseMessage], context: str
     ) -> str | None:
@@ -1,8 +1,24 @@
+import asyncio
+import dataclasses
+import time
+
 from tinyagent.src.llm_compiler.constants import END_OF_PLAN, SUMMARY_RESULT
+from tinyagent.src.llm_compiler.deadline import Deadline
 from tinyagent.src.llm_compiler.llm_compiler import LLMCompiler
-from tinyagent.src.llm_compiler.planner import generate_llm_compiler_prompt
+from tinyagent.src.llm_compiler.plan_cache import PlanCache
+from tinyagent.src.llm_compiler.planner import (
+    PrebuiltPlan,
+    generate_llm_compiler_prompt,
+)
+from tinyagent.src.llm_compiler.trace import RunTrace
 from tinyagent.src.tiny_agent.computer import Computer
 from tinyagent.src.tiny_agent.config import TinyAgentConfig
+from tinyagent.src.tiny_agent.fast_path import FastPathRouter, RuleBasedFastPathRouter
+from tinyagent.src.tiny_agent.prompt_cache import (
+    PlannerPrompt,
+    PromptCache,
+    get_prompt_cache_key,
+)
 from tinyagent.src.tiny_agent.prompts import (
     DEFAULT_PLANNER_IN_CONTEXT_EXAMPLES_PROMPT,
     OUTPUT_PROMPT,
@@ -15,11 +31,14 @@ from tinyagent.src.tiny_agent.sub_agents.notes_agent import NotesAgent
 from tinyagent.src.tiny_agent.sub_agents.pdf_summarizer_agent import PDFSummarizerAgent
 from tinyagent.src.tiny_agent.sub_agents.sonar_agent import SonarAgent
 from tinyagent.src.tiny_agent.tiny_agent_tools import (
+    LOOKUP_TOOL_NAMES,
+    SIDE_EFFECT_TOOL_NAMES,
     get_tiny_agent_tools,
     get_tool_names_from_apps,
 )
-from tinyagent.src.tiny_agent.tool_rag.base_tool_rag import BaseToolRAG
+from tinyagent.src.tiny_agent.tool_rag.base_tool_rag import BaseToolRAG, ToolRAGResult
 from tinyagent.src.tiny_agent.tool_rag.classifier_tool_rag import ClassifierToolRAG
+from tinyagent.src.utils.logger_utils import log, log_event, new_run_id
 from tinyagent.src.utils.model_utils import get_embedding_model, get_model
 
 
@@ -33,8 +52,20 @@ class TinyAgent:
     pdf_summarizer_agent: PDFSummarizerAgent
     compose_email_agent: ComposeEmailAgent
     tool_rag: BaseToolRAG
+    # Planner prompts of the tool sets and examples that ToolRAG retrieved for the previous queries
+    prompt_cache: PromptCache
 
-    def __init__(self, config: TinyAgentConfig) -> None:
+    def __init__(
+        self,
+        config: TinyAgentConfig,
+        prompt_cache: PromptCache | None = None,
+        plan_cache: PlanCache | None = None,
+    ) -> None:
+        """
+        If a prompt_cache or a plan_cache is given, e.g. one that is shared by the pooled instances of the
+        same config, the agent uses it instead of creating its own (the plan cache only if it is enabled
+        in the config).
+        """
         self.config = config
 
         # Define the models
@@ -107,9 +138,16 @@ class TinyAgent:
             planner_example_prompt_replan=PLANNER_PROMPT_REPLAN,
             planner_stop=[END_OF_PLAN],
             planner_stream=True,
+            planner_prefix_stable_prompt=config.prefix_stable_prompt,
             agent_llm=llm,
             joinner_prompt=OUTPUT_PROMPT,
             joinner_prompt_final=OUTPUT_PROMPT_FINAL,
+            side_effect_tools=(
+                [tool_name.value for tool_name in SIDE_EFFECT_TOOL_NAMES]
+                if config.join_short_circuit
+                else None
+            ),
+            lookup_tools=[tool_name.value for tool_name in LOOKUP_TOOL_NAMES],
             max_replans=2,
             benchmark=False,
         )
@@ -129,39 +167,191 @@ class TinyAgent:
             self.tool_rag = ClassifierToolRAG(
                 embedding_model=embedding_model,
                 tools=tools,
+                cache_dir=config.tool_rag_cache_dir,
             )
+            if config.plan_cache:
+                self.agent.plan_cache = (
+                    plan_cache
+                    if plan_cache is not None
+                    else PlanCache(self.tool_rag.embed_query)
+                )
+
+        self.fast_path_router: FastPathRouter | None = (
+            RuleBasedFastPathRouter()
+            if config.fast_path and config.embedding_model_config is not None
+            else None
+        )
+
+        self.prompt_cache = prompt_cache if prompt_cache is not None else PromptCache()
+
+        # Keep the default planner prompt so that it can be restored after ToolRAG overrides it
+        self._default_system_prompt = self.agent.planner.system_prompt
+
+    def reset(self) -> None:
+        """
+        Resets the per-request state so that the same instance can safely serve another query.
+        """
+        self.agent.planner.system_prompt = self._default_system_prompt
+        self.agent.reset_all_stats()
+        self.compose_email_agent.reset()
+        self.pdf_summarizer_agent.reset()
+        self.notes_agent.reset()
+        self.sonar_agent.reset()
+
+    def _build_planner_prompt(self, tool_rag_results: ToolRAGResult) -> PlannerPrompt:
+        new_tools = get_tiny_agent_tools(
+            computer=self.computer,
+            notes_agent=self.notes_agent,
+            pdf_summarizer_agent=self.pdf_summarizer_agent,
+            compose_email_agent=self.compose_email_agent,
+            tool_names=tool_rag_results.retrieved_tools_set,
+            zoom_access_token=self.config.zoom_access_token,
+            sonar_agent=self.sonar_agent,
+        )
+
+        system_prompt = generate_llm_compiler_prompt(
+            tools=new_tools,
+            example_prompt=tool_rag_results.in_context_examples_prompt,
+            custom_instructions=get_planner_custom_instructions_prompt(
+                tools=new_tools, custom_instructions=self.config.custom_instructions
+            ),
+            prefix_stable=self.config.prefix_stable_prompt,
+        )
+        return PlannerPrompt(system_prompt=system_prompt)
+
+    @staticmethod
+    def _sort_in_context_examples(tool_rag_results: ToolRAGResult) -> ToolRAGResult:
+        """
+        Orders the in-context examples by their IDs instead of their similarity to the query, so that the
+        queries that retrieve the same examples get the same planner prompt.
+        """
+        if len(tool_rag_results.in_context_examples) != len(
+            tool_rag_results.example_ids
+        ):
+            return tool_rag_results
 
-    async def arun(self, query: str) -> str:
+        sorted_examples = sorted(
+            zip(tool_rag_results.example_ids, tool_rag_results.in_context_examples)
+        )
+        return dataclasses.replace(
+            tool_rag_results,
+            in_context_examples_prompt=BaseToolRAG.format_in_context_examples(
+                [example for _, example in sorted_examples]
+            ),
+            example_ids=[example_id for example_id, _ in sorted_examples],
+            in_context_examples=[example for _, example in sorted_examples],
+        )
+
+    def _get_fast_path_plan(self, query: str) -> PrebuiltPlan | None:
+        """
+        Returns the plan of the query from the fast path router, or None if the query needs the planner.
+        """
+        if self.fast_path_router is None:
+            return None
+
+        plan = self.fast_path_router.route(
+            query, self.tool_rag.get_tool_probabilities(query)
+        )
+        if plan is None:
+            return None
+        try:
+            tasks = self.agent.planner.output_parser.parse(plan + "\n")
+        except Exception as e:
+            # The tool of the plan is not available
+            log(f"Fast path plan could not be used: {e}")
+            return None
+        return PrebuiltPlan(plan=plan, tasks=tasks, source="fast_path")
+
+    def get_fast_path_stats(self) -> dict[str, object] | None:
+        """The bypass rate of the fast path router and the latencies of the runs with and without it."""
+        if self.fast_path_router is None:
+            return None
+        return self.fast_path_router.get_stats()
+
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        """Hit rates of the caches that the agent uses to skip the planner prompt building and the planner."""
+        stats = {"planner_prompt": self.prompt_cache.get_stats()}
+        if self.agent.plan_cache is not None:
+            stats["plan"] = self.agent.plan_cache.get_stats()
         if self.config.embedding_model_config is not None:
+            stats.update(self.tool_rag.get_cache_stats())
+        return stats
+
+    async def aclose(self) -> None:
+        """Closes the network resources held by the agent. Must be called from the loop that used it."""
+        await self.computer.aclose()
+        await self.sonar_agent.aclose()
+
+    async def arun(
+        self,
+        query: str,
+        streaming_queue: asyncio.Queue[str | None] | None = None,
+        deadline: Deadline | None = None,
+    ) -> str:
+        """
+        Runs the agent on the given query. If a streaming_queue is given, the planner tokens are
+        streamed to it and a None is put to it once the run is over. If a deadline is given, the
+        planner, the tools and the joinner are bounded by it, and a partial answer is returned when
+        the run runs out of time.
+        """
+        result, _ = await self.arun_with_trace(query, streaming_queue, deadline)
+        return result
+
+    async def arun_with_trace(
+        self,
+        query: str,
+        streaming_queue: asyncio.Queue[str | None] | None = None,
+        deadline: Deadline | None = None,
+    ) -> tuple[str, RunTrace]:
+        """
+        Same as arun, but also returns the RunTrace with the planner output, the tasks and their
+        observations, and the joinner output of the run.
+        """
+        new_run_id()
+        log_event("run_start", query=query)
+        start_time = time.time()
+        prebuilt_plan = self._get_fast_path_plan(query)
+        if prebuilt_plan is not None:
+            # The planner is only called if the joinner replans, with the default prompt
+            self.agent.planner.system_prompt = self._default_system_prompt
+        elif self.config.embedding_model_config is not None:
             tool_rag_results = self.tool_rag.retrieve_examples_and_tools(
                 query, top_k=TinyAgent._DEFAULT_TOP_K
             )
 
-            new_tools = get_tiny_agent_tools(
-                computer=self.computer,
-                notes_agent=self.notes_agent,
-                pdf_summarizer_agent=self.pdf_summarizer_agent,
-                compose_email_agent=self.compose_email_agent,
-                tool_names=tool_rag_results.retrieved_tools_set,
-                zoom_access_token=self.config.zoom_access_token,
-                sonar_agent=self.sonar_agent,
-            )
+            if self.config.prefix_stable_prompt:
+                tool_rag_results = self._sort_in_context_examples(tool_rag_results)
 
-            self.agent.planner.system_prompt = generate_llm_compiler_prompt(
-                tools=new_tools,
-                example_prompt=tool_rag_results.in_context_examples_prompt,
-                custom_instructions=get_planner_custom_instructions_prompt(
-                    tools=new_tools, custom_instructions=self.config.custom_instructions
+            planner_prompt = self.prompt_cache.get_or_build(
+                get_prompt_cache_key(
+                    tool_rag_results.retrieved_tools_set,
+                    tool_rag_results.example_ids,
+                    self.config.custom_instructions,
                 ),
+                lambda: self._build_planner_prompt(tool_rag_results),
             )
+            self.agent.planner.system_prompt = planner_prompt.system_prompt
 
         self.compose_email_agent.query = query
-        original_result = await self.agent.arun(query)
+        outputs = await self.agent.acall(
+            {
+                self.agent.input_key: query,
+                self.agent.streaming_queue_key: streaming_queue,
+                self.agent.deadline_key: deadline,
+                self.agent.prebuilt_plan_key: prebuilt_plan,
+            }
+        )
+        original_result = outputs[self.agent.output_key]
+        trace = outputs[self.agent.trace_key]
+        if self.fast_path_router is not None:
+            self.fast_path_router.record_run(
+                prebuilt_plan is not None, time.time() - start_time
+            )
 
         try:
             if original_result == SUMMARY_RESULT:
                 result = self.pdf_summarizer_agent.cached_summary_result
 
-            return result
+            return result, trace
         except:
-            return original_result
+            return original_result, trace
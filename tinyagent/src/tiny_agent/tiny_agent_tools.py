@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 import re
@@ -15,6 +16,7 @@ from tinyagent.src.tiny_agent.sub_agents.compose_email_agent import ComposeEmail
 from tinyagent.src.tiny_agent.sub_agents.notes_agent import NotesAgent
 from tinyagent.src.tiny_agent.sub_agents.pdf_summarizer_agent import PDFSummarizerAgent
 from tinyagent.src.tiny_agent.sub_agents.sonar_agent import SonarAgent
+from tinyagent.src.tiny_agent.tool_executor import run_blocking
 from tinyagent.src.tiny_agent.tools.zoom import Zoom
 from tinyagent.src.tools.base import StructuredTool, Tool
 
@@ -28,43 +30,76 @@ def get_datetime(date: str | None) -> datetime.datetime | None:
         return None
 
 
-def ensure_phone_number_formatting(
+async def _return(value: Any) -> Any:
+    return value
+
+
+async def ensure_phone_number_formatting(
     phone_numbers: Sequence[str], computer: Computer
 ) -> list[str]:
     pattern = r"\d+"
-    return [
-        (
-            phone_number
-            if re.search(pattern, phone_number) is not None
-            else computer.contacts.get_phone_number(contact_name=phone_number)
+    # The contacts are looked up concurrently
+    return list(
+        await asyncio.gather(
+            *[
+                (
+                    _return(phone_number)
+                    if re.search(pattern, phone_number) is not None
+                    else run_blocking(
+                        App.CONTACTS,
+                        computer.contacts.get_phone_number,
+                        contact_name=phone_number,
+                    )
+                )
+                for phone_number in phone_numbers
+            ]
         )
-        for phone_number in phone_numbers
-    ]
+    )
 
 
-def ensure_email_formatting(
+async def ensure_email_formatting(
     email_addresses: Sequence[str], computer: Computer
 ) -> list[str]:
-    return [
-        email if "@" in email else computer.contacts.get_email_address(email)
-        for email in email_addresses
-    ]
-
-
-def ensure_file_paths(file_paths: Sequence[str], computer: Computer) -> list[str]:
-    return [
-        (
-            file_path
-            if os.path.exists(file_path)
-            else computer.spotlight_search.open(file_path)
+    return list(
+        await asyncio.gather(
+            *[
+                (
+                    _return(email)
+                    if "@" in email
+                    else run_blocking(
+                        App.CONTACTS, computer.contacts.get_email_address, email
+                    )
+                )
+                for email in email_addresses
+            ]
         )
-        for file_path in file_paths
-    ]
+    )
+
+
+async def ensure_file_paths(
+    file_paths: Sequence[str], computer: Computer
+) -> list[str]:
+    return list(
+        await asyncio.gather(
+            *[
+                (
+                    _return(file_path)
+                    if os.path.exists(file_path)
+                    else run_blocking(
+                        App.FILES, computer.spotlight_search.open, file_path
+                    )
+                )
+                for file_path in file_paths
+            ]
+        )
+    )
 
 
 def get_phone_number_tool(computer: Computer) -> Tool:
     async def get_phone_number(name: str) -> str:
-        phone_number = computer.contacts.get_phone_number(contact_name=name)
+        phone_number = await run_blocking(
+            App.CONTACTS, computer.contacts.get_phone_number, contact_name=name
+        )
 
         if phone_number == "No contacts found" or phone_number.startswith(
             "A contact for"
@@ -93,7 +128,9 @@ def get_phone_number_tool(computer: Computer) -> Tool:
 
 def get_email_address_tool(computer: Computer) -> Tool:
     async def get_email_address(name: str) -> str:
-        email_address = computer.contacts.get_email_address(contact_name=name)
+        email_address = await run_blocking(
+            App.CONTACTS, computer.contacts.get_email_address, contact_name=name
+        )
 
         if email_address == "No contacts found" or email_address.startswith(
             "A contact for"
@@ -159,11 +196,11 @@ def get_create_calendar_event_tool(computer: Computer) -> Tool:
 
         # Ensure consistent formatting of invitees and ensure they are email addresses
         if isinstance(invitees, str):
-            args["invitees"] = ensure_email_formatting([invitees], computer)
+            args["invitees"] = await ensure_email_formatting([invitees], computer)
         else:
-            args["invitees"] = ensure_email_formatting(invitees, computer)
+            args["invitees"] = await ensure_email_formatting(invitees, computer)
 
-        return computer.calendar.create_event(**args)
+        return await run_blocking(App.CALENDAR, computer.calendar.create_event, **args)
 
     return Tool(
         name=TinyAgentToolName.CREATE_CALENDAR_EVENT.value,
@@ -200,7 +237,9 @@ def get_create_calendar_event_tool(computer: Computer) -> Tool:
 def get_read_calendar_tool(computer: Computer) -> Tool:
     async def read_calendar() -> str:
         """Gets the next meeting's end time from the calendar."""
-        meeting_info = computer.calendar.get_next_meeting()
+        meeting_info = await run_blocking(
+            App.CALENDAR, computer.calendar.get_next_meeting
+        )
         
         if "error" in meeting_info:
             return meeting_info["error"]
@@ -222,7 +261,7 @@ def get_read_calendar_tool(computer: Computer) -> Tool:
 
 def get_open_and_get_file_path_tool(computer: Computer) -> Tool:
     async def open_and_get_file_path(file_name: str) -> str:
-        return computer.spotlight_search.open(file_name)
+        return await run_blocking(App.FILES, computer.spotlight_search.open, file_name)
 
     return Tool(
         name=TinyAgentToolName.OPEN_AND_GET_FILE_PATH.value,
@@ -240,7 +279,7 @@ def get_summarize_pdf_tool(
 ) -> Tool:
     async def summarize_pdf(pdf_path: str) -> str:
         # Check if this is a file path, if not, search for the file path first
-        pdf_path = ensure_file_paths([pdf_path], computer)[0]
+        pdf_path = (await ensure_file_paths([pdf_path], computer))[0]
 
         return await pdf_summarizer_agent(pdf_path)
 
@@ -278,22 +317,26 @@ def get_compose_new_email_tool(
         attachments: list[str],
     ) -> str:
         # Ensure consistent formatting of recipients and cc and ensure they are email addresses
-        recipients = ensure_email_formatting(
-            recipients if isinstance(recipients, list) else [recipients], computer
+        recipients, cc = await asyncio.gather(
+            ensure_email_formatting(
+                recipients if isinstance(recipients, list) else [recipients], computer
+            ),
+            ensure_email_formatting(cc if isinstance(cc, list) else [cc], computer),
         )
-        cc = ensure_email_formatting(cc if isinstance(cc, list) else [cc], computer)
 
         if isinstance(attachments, str):
             attachments = [attachments]
 
         # Ensure the attachment is a file path, if not search for the file path first
-        attachments = ensure_file_paths(attachments, computer)
+        attachments = await ensure_file_paths(attachments, computer)
 
         body = await call_compose_email_agent(
             compose_email_agent=compose_email_agent, context=context
         )
 
-        return computer.mail.compose_email(
+        return await run_blocking(
+            App.MAIL,
+            computer.mail.compose_email,
             recipients=recipients,
             cc=cc,
             subject=subject,
@@ -339,13 +382,15 @@ def get_reply_to_email_tool(
         attachments: list[str],
     ) -> str:
         # Ensure consistent formatting of cc and ensure they are email addresses
-        cc = ensure_email_formatting(cc if isinstance(cc, list) else [cc], computer)
+        cc = await ensure_email_formatting(
+            cc if isinstance(cc, list) else [cc], computer
+        )
         if isinstance(attachments, str):
             attachments = [attachments]
 
-        attachments = ensure_file_paths(attachments, computer)
+        attachments = await ensure_file_paths(attachments, computer)
 
-        email_thread = computer.mail.get_email_content()
+        email_thread = await run_blocking(App.MAIL, computer.mail.get_email_content)
         context = await call_compose_email_agent(
             compose_email_agent=compose_email_agent,
             context=context,
@@ -353,7 +398,9 @@ def get_reply_to_email_tool(
             mode=ComposeEmailMode.REPLY,
         )
 
-        return computer.mail.reply_to_email(
+        return await run_blocking(
+            App.MAIL,
+            computer.mail.reply_to_email,
             cc=cc,
             content=context,
             attachments=attachments,
@@ -390,15 +437,19 @@ def get_forward_email_tool(computer: Computer) -> Tool:
         attachments: list[str],
     ) -> str:
         # Ensure consistent formatting of recipients and cc and ensure they are email addresses
-        recipients = ensure_email_formatting(
-            recipients if isinstance(recipients, list) else [recipients], computer
+        recipients, cc = await asyncio.gather(
+            ensure_email_formatting(
+                recipients if isinstance(recipients, list) else [recipients], computer
+            ),
+            ensure_email_formatting(cc if isinstance(cc, list) else [cc], computer),
         )
-        cc = ensure_email_formatting(cc if isinstance(cc, list) else [cc], computer)
 
         if isinstance(attachments, str):
             attachments = [attachments]
 
-        return computer.mail.forward_email(
+        return await run_blocking(
+            App.MAIL,
+            computer.mail.forward_email,
             recipients=recipients,
             cc=cc,
             attachments=attachments,
@@ -431,7 +482,7 @@ def get_forward_email_tool(computer: Computer) -> Tool:
 
 def get_maps_open_location_tool(computer: Computer) -> Tool:
     async def maps_open_location(location: str) -> str:
-        return computer.maps.open_location(location)
+        return await run_blocking(App.MAPS, computer.maps.open_location, location)
 
     return Tool(
         name=TinyAgentToolName.MAPS_OPEN_LOCATION.value,
@@ -462,7 +513,7 @@ def get_maps_show_directions_tool(computer: Computer) -> Tool:
             and transport in TransportationOptions._value2member_map_
         ):
             args["transport"] = TransportationOptions(transport)
-        return computer.maps.show_directions(**args)
+        return await run_blocking(App.MAPS, computer.maps.show_directions, **args)
 
     return Tool(
         name=TinyAgentToolName.MAPS_SHOW_DIRECTIONS.value,
@@ -491,7 +542,9 @@ def get_create_note_tool(computer: Computer, notes_agent: NotesAgent) -> Tool:
     async def create_new_note(name: str, content: str, folder: str) -> str:
         # Check if content suggests using a template
         formatted_content = await notes_agent(name, content, mode=NotesMode.NEW)
-        return computer.notes.create_note(name, formatted_content, folder)
+        return await run_blocking(
+            App.NOTES, computer.notes.create_note, name, formatted_content, folder
+        )
 
     return Tool(
         name=TinyAgentToolName.CREATE_NOTE.value,
@@ -521,7 +574,9 @@ def get_create_note_tool(computer: Computer, notes_agent: NotesAgent) -> Tool:
 
 def get_open_note_tool(computer: Computer) -> Tool:
     async def open_note(name: str, folder: str) -> str:
-        return computer.notes.open_note(name, folder, return_content=True)
+        return await run_blocking(
+            App.NOTES, computer.notes.open_note, name, folder, return_content=True
+        )
 
     return Tool(
         name=TinyAgentToolName.OPEN_NOTE.value,
@@ -538,8 +593,12 @@ def get_open_note_tool(computer: Computer) -> Tool:
 
 def get_append_note_content_tool(computer: Computer, notes_agent: NotesAgent) -> Tool:
     async def append_note_content(name: str, content: str, folder: str) -> str:
-        prev_content = computer.notes.open_note(name, folder, return_content=True)
-        return computer.notes.append_to_note(
+        prev_content = await run_blocking(
+            App.NOTES, computer.notes.open_note, name, folder, return_content=True
+        )
+        return await run_blocking(
+            App.NOTES,
+            computer.notes.append_to_note,
             name,
             await notes_agent(
                 name, content, prev_content=prev_content, mode=NotesMode.APPEND
@@ -584,7 +643,9 @@ def get_create_reminder_tool(computer: Computer) -> Tool:
         if due_date_args is None:
             due_date_args = datetime.datetime.now()
 
-        return computer.reminders.create_reminder(
+        return await run_blocking(
+            App.REMINDERS,
+            computer.reminders.create_reminder,
             name=name,
             due_date=datetime.datetime.fromisoformat(due_date),
             notes=notes,
@@ -627,10 +688,12 @@ def get_create_reminder_tool(computer: Computer) -> Tool:
 def get_send_sms_tool(computer: Computer) -> Tool:
     async def send_sms(recipients: list[str], message: str) -> str:
         # Ensure consistent formatting of recipients and ensure they are phone numbers
-        recipients = ensure_phone_number_formatting(
+        recipients = await ensure_phone_number_formatting(
             recipients if isinstance(recipients, list) else [recipients], computer
         )
-        return computer.sms.send(to=recipients, message=message)
+        return await run_blocking(
+            App.SMS, computer.sms.send, to=recipients, message=message
+        )
 
     return Tool(
         name=TinyAgentToolName.SEND_SMS.value,
@@ -653,8 +716,11 @@ def get_zoom_meeting_link_tool(
             "Couldn't find the Zoom access token. Please provide it in the settings.",
         )
 
-    # Add zoom tool to computer
-    computer.zoom = Zoom(zoom_access_token)
+    # Add zoom tool to computer. The tools are rebuilt for every query, so the existing instance is
+    # kept to reuse its HTTP session.
+    zoom = getattr(computer, "zoom", None)
+    if zoom is None or zoom.access_token != zoom_access_token:
+        computer.zoom = Zoom(zoom_access_token)
 
     async def get_zoom_meeting_link(
         topic: str,
@@ -663,7 +729,7 @@ def get_zoom_meeting_link_tool(
         meeting_invitees: list[str],
     ) -> str:
         # Ensure consistent formatting of meeting invitees and ensure they are email addresses
-        meeting_invitees = ensure_email_formatting(
+        meeting_invitees = await ensure_email_formatting(
             (
                 meeting_invitees
                 if isinstance(meeting_invitees, list)
@@ -762,6 +828,31 @@ APPS_TO_TOOL_NAMES = {
 }
 
 
+# Tools that act on an app and whose outputs are only statuses, so a run that only calls them
+# successfully doesn't need the joinner to answer. The tools that return content, such as open_note
+# which returns the note body, must not be in this set since their output would become the answer.
+SIDE_EFFECT_TOOL_NAMES = {
+    TinyAgentToolName.CREATE_CALENDAR_EVENT,
+    TinyAgentToolName.COMPOSE_NEW_EMAIL,
+    TinyAgentToolName.REPLY_TO_EMAIL,
+    TinyAgentToolName.FORWARD_EMAIL,
+    TinyAgentToolName.MAPS_OPEN_LOCATION,
+    TinyAgentToolName.MAPS_SHOW_DIRECTIONS,
+    TinyAgentToolName.CREATE_NOTE,
+    TinyAgentToolName.APPEND_NOTE_CONTENT,
+    TinyAgentToolName.CREATE_REMINDER,
+    TinyAgentToolName.SEND_SMS,
+}
+# Tools that return information, which doesn't need the joinner if it is only passed to other tools
+LOOKUP_TOOL_NAMES = {
+    TinyAgentToolName.GET_PHONE_NUMBER,
+    TinyAgentToolName.GET_EMAIL_ADDRESS,
+    TinyAgentToolName.GET_ZOOM_MEETING_LINK,
+    TinyAgentToolName.OPEN_AND_GET_FILE_PATH,
+    TinyAgentToolName.OPEN_NOTE,
+}
+
+
 def get_tool_names_from_apps(apps: Collection[App]) -> Collection[TinyAgentToolName]:
     tool_names = set()
     for app in apps:
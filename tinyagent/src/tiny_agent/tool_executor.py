@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from tinyagent.src.tiny_agent.models import App
+
+T = TypeVar("T")
+
+# Maximum number of blocking tool calls (AppleScript and subprocess calls) that run at the same time
+TOOL_MAX_WORKERS = int(os.environ.get("TINYAGENT_TOOL_MAX_WORKERS", "8"))
+# Maximum number of concurrent calls to the same app, so that e.g. several Notes scripts don't race
+# each other on the app
+TOOL_APP_CONCURRENCY = int(os.environ.get("TINYAGENT_TOOL_APP_CONCURRENCY", "2"))
+# Apps that can safely serve more concurrent calls since their tools only read
+_APP_CONCURRENCY_OVERRIDES = {
+    App.CONTACTS: max(TOOL_APP_CONCURRENCY, 4),
+}
+
+
+class _AppSlots:
+    """
+    Semaphore of the concurrent calls to an app that can be awaited from any event loop, since the
+    backend runs an event loop per worker thread. The waiters are served in FIFO order and are woken on
+    their own loop, so they don't hold a thread while they wait.
+    """
+
+    _value: int
+    _lock: threading.Lock
+    _waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]]
+
+    def __init__(self, value: int) -> None:
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and len(self._waiters) == 0:
+                self._value -= 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                is_waiting = (loop, waiter) in self._waiters
+                if is_waiting:
+                    self._waiters.remove((loop, waiter))
+            if not is_waiting and waiter.done() and not waiter.cancelled():
+                # The slot was handed over right before the cancellation, so pass it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while len(self._waiters) > 0:
+                loop, waiter = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, waiter)
+                    return
+                except RuntimeError:
+                    # The loop of the waiter is closed
+                    continue
+            self._value += 1
+
+    def _hand_over(self, waiter: asyncio.Future[None]) -> None:
+        if waiter.cancelled():
+            # The waiter gave up after it was picked, so the slot goes to the next one
+            self.release()
+        else:
+            waiter.set_result(None)
+
+
+class ToolExecutor:
+    """
+    Runs the blocking tool calls in a bounded thread pool, so that the independent tasks of a plan run
+    concurrently instead of blocking the event loop one after the other.
+    The calls to the same app are limited process-wide. A call gets a slot of its app before it is
+    submitted to the pool, so the calls that wait for their app never hold a thread of the pool and
+    can't starve the calls to the other apps. The slot is freed when the call returns in its thread.
+    """
+
+    _executor: ThreadPoolExecutor
+    _app_slots: dict[App, _AppSlots]
+
+    def __init__(
+        self,
+        max_workers: int = TOOL_MAX_WORKERS,
+        app_concurrency: int = TOOL_APP_CONCURRENCY,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tinyagent-tool"
+        )
+        self._app_slots = {
+            app: _AppSlots(_APP_CONCURRENCY_OVERRIDES.get(app, app_concurrency))
+            for app in App
+        }
+
+    async def run_blocking(
+        self, app: App, func: Callable[..., T], *args, **kwargs
+    ) -> T:
+        """Runs the blocking function of the given app in the pool and returns its result."""
+        app_slots = self._app_slots[app]
+        await app_slots.acquire()
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            app_slots.release()
+            raise
+        # Free the slot when the call is done rather than when it is awaited, since a cancelled await
+        # doesn't stop a call that already runs in its thread
+        future.add_done_callback(lambda _: app_slots.release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Executor shared by all the TinyAgent instances of the process
+tool_executor = ToolExecutor()
+
+
+async def run_blocking(app: App, func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs the blocking function of the given app in the shared tool executor."""
+    return await tool_executor.run_blocking(app, func, *args, **kwargs)
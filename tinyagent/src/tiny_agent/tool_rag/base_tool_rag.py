@@ -1,16 +1,20 @@
 import abc
 import os
-import pickle
 from dataclasses import dataclass
 from typing import Collection, Sequence
 
 import torch
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
-from typing_extensions import TypedDict
 
 from tinyagent.src.tiny_agent.config import DEFAULT_OPENAI_EMBEDDING_MODEL
 from tinyagent.src.tiny_agent.models import TinyAgentToolName
+from tinyagent.src.tiny_agent.tool_rag.embedding_index import (
+    EmbeddingIndex,
+    PickledEmbedding,
+    get_embedding_index,
+)
+from tinyagent.src.tiny_agent.tool_rag.query_cache import QueryCache, get_query_cache
 from tinyagent.src.tools.base import StructuredTool, Tool
 
 TOOLRAG_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -20,12 +24,10 @@ TOOLRAG_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
 class ToolRAGResult:
     in_context_examples_prompt: str
     retrieved_tools_set: Collection[TinyAgentToolName]
-
-
-class PickledEmbedding(TypedDict):
-    example: str
-    embedding: torch.Tensor
-    tools: Sequence[str]
+    # IDs of the retrieved in-context examples, in the order they appear in the prompt
+    example_ids: Sequence[str] = ()
+    # Texts of the retrieved in-context examples, in the same order as example_ids
+    in_context_examples: Sequence[str] = ()
 
 
 class BaseToolRAG(abc.ABC):
@@ -42,6 +44,8 @@ class BaseToolRAG(abc.ABC):
     _available_tools: Sequence[TinyAgentToolName]
     # The path to the embeddings.pkl file
     _embeddings_pickle_path: str
+    # Cache of the query embeddings, shared by the ToolRAG instances that use the same embedding model
+    _query_embedding_cache: QueryCache
 
     def __init__(
         self,
@@ -49,6 +53,7 @@ class BaseToolRAG(abc.ABC):
             AzureOpenAIEmbeddings | OpenAIEmbeddings | HuggingFaceEmbeddings
         ),
         tools: Sequence[Tool | StructuredTool],
+        cache_dir: str | None = None,
     ) -> None:
         self._embedding_model = embedding_model
         self._available_tools = [TinyAgentToolName(tool.name) for tool in tools]
@@ -62,6 +67,17 @@ class BaseToolRAG(abc.ABC):
             BaseToolRAG._EMBEDDINGS_FILE_NAME,
         )
 
+        # The query embeddings are only valid for the model that computed them
+        embedding_model_name = (
+            getattr(embedding_model, "model_name", None)
+            or getattr(embedding_model, "deployment", None)
+            or getattr(embedding_model, "model", None)
+            or type(embedding_model).__name__
+        )
+        self._query_embedding_cache = get_query_cache(
+            f"query_embeddings_{embedding_model_name}", cache_dir
+        )
+
     @property
     @abc.abstractmethod
     def tool_rag_type(self) -> str:
@@ -74,55 +90,139 @@ class BaseToolRAG(abc.ABC):
         """
         pass
 
+    def retrieve_examples_and_tools_batch(
+        self, queries: Sequence[str], top_k: int
+    ) -> list[ToolRAGResult]:
+        """
+        Returns one ToolRAGResult per query. Subclasses override this to batch the model calls.
+        """
+        return [self.retrieve_examples_and_tools(query, top_k) for query in queries]
+
+    @property
+    def embedding_index(self) -> EmbeddingIndex:
+        """
+        The in-memory index of the embeddings.pkl file, which is shared across the ToolRAG instances
+        and reloaded if the file changes.
+        """
+        return get_embedding_index(self._embeddings_pickle_path)
+
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        return {"query_embeddings": self._query_embedding_cache.get_stats()}
+
     def _retrieve_top_k_embeddings(
-        self, query: str, examples: list[PickledEmbedding], top_k: int
+        self,
+        query: str,
+        top_k: int,
+        filter_tools: Collection[TinyAgentToolName] | None = None,
     ) -> list[PickledEmbedding]:
         """
-        Computes the cosine similarity of each example and retrieves the closest top_k examples.
+        Filters the examples to the ones that only use the given tools (or the available tools if none are given),
+        then computes the cosine similarity of each example and retrieves the closest top_k examples.
         If there are already less than top_k examples, returns the examples directly.
         """
-        if len(examples) <= top_k:
-            return examples
-
-        query_embedding = torch.tensor(self._embedding_model.embed_query(query))
-        embeddings = torch.stack(
-            [x["embedding"] for x in examples]
-        )  # Stacking for batch processing
-
-        # Cosine similarity between query_embedding and all chunks
-        cosine_similarities = torch.nn.functional.cosine_similarity(
-            embeddings, query_embedding.unsqueeze(0), dim=1
-        )
+        index = self.embedding_index
+        mask = index.get_filter_mask(filter_tools or self._available_tools)
 
-        # Retrieve the top k indices from cosine_similarities
-        _, top_k_indices = torch.topk(cosine_similarities, top_k)
+        if int(mask.sum()) <= top_k:
+            return index.get_examples(mask)
 
-        # Select the chunks corresponding to the top k indices
-        selected_examples = [examples[i] for i in top_k_indices]
+        query_embedding = self._embed_query(query)
 
-        return selected_examples
+        return index.search(query_embedding, mask, top_k)
 
-    def _load_filtered_embeddings(
-        self, filter_tools: list[TinyAgentToolName] | None = None
-    ) -> list[PickledEmbedding]:
+    def _retrieve_top_k_embeddings_batch(
+        self,
+        queries: Sequence[str],
+        top_k: int,
+        filter_tools: Sequence[Collection[TinyAgentToolName]] | None = None,
+    ) -> list[list[PickledEmbedding]]:
+        """
+        Batched version of _retrieve_top_k_embeddings, where filter_tools has the tools of each query.
+        Only the queries that have more than top_k candidate examples are embedded, in a single batch.
         """
-        Loads the embeddings.pkl file that contains a list of PickledEmbedding objects
-        and returns the filtered results based on the available tools.
+        index = self.embedding_index
+        masks = [
+            index.get_filter_mask(
+                (filter_tools[i] if filter_tools is not None else None)
+                or self._available_tools
+            )
+            for i in range(len(queries))
+        ]
+
+        results: list[list[PickledEmbedding]] = [[] for _ in queries]
+        search_ids = []
+        for i, mask in enumerate(masks):
+            if int(mask.sum()) <= top_k:
+                results[i] = index.get_examples(mask)
+            else:
+                search_ids.append(i)
+
+        if len(search_ids) > 0:
+            query_embeddings = self._embed_queries([queries[i] for i in search_ids])
+            search_results = index.search_batch(
+                query_embeddings, torch.stack([masks[i] for i in search_ids]), top_k
+            )
+            for i, search_result in zip(search_ids, search_results):
+                results[i] = search_result
+
+        return results
+
+    def embed_query(self, query: str) -> torch.Tensor:
+        """Returns the embedding of the query, which is shared with the retrieval of the examples."""
+        return self._embed_query(query)
+
+    def _embed_query(self, query: str) -> torch.Tensor:
         """
-        with open(self._embeddings_pickle_path, "rb") as file:
-            embeddings: dict[str, PickledEmbedding] = pickle.load(file)
+        Returns the embedding of the query, only calling the embedding model on a cache miss.
+        """
+        embedding = self._query_embedding_cache.get(query)
+        if embedding is None:
+            embedding = self._embedding_model.embed_query(query)
+            self._query_embedding_cache.put(query, embedding)
 
-        filtered_embeddings = []
-        tool_names = [tool.value for tool in filter_tools or self._available_tools]
-        for embedding in embeddings.values():
-            # Check if all tools are available in this example
-            if all(tool in tool_names for tool in embedding["tools"]):
-                filtered_embeddings.append(embedding)
+        return torch.tensor(embedding)
 
-        return filtered_embeddings
+    def _embed_queries(self, queries: Sequence[str]) -> torch.Tensor:
+        """
+        Returns the (num_queries, embedding_dim) matrix of the query embeddings. The cache misses
+        are deduplicated and embedded with a single embed_documents call.
+        """
+        embeddings = [self._query_embedding_cache.get(query) for query in queries]
+
+        missing_queries: dict[str, str] = {}
+        for query, embedding in zip(queries, embeddings):
+            if embedding is None:
+                missing_queries.setdefault(QueryCache.normalize_query(query), query)
+
+        if len(missing_queries) > 0:
+            missing_embeddings = dict(
+                zip(
+                    missing_queries.keys(),
+                    self._embedding_model.embed_documents(
+                        list(missing_queries.values())
+                    ),
+                )
+            )
+            for key, embedding in missing_embeddings.items():
+                self._query_embedding_cache.put(key, embedding)
+            embeddings = [
+                (
+                    embedding
+                    if embedding is not None
+                    else missing_embeddings[QueryCache.normalize_query(query)]
+                )
+                for query, embedding in zip(queries, embeddings)
+            ]
+
+        return torch.tensor(embeddings)
 
     @staticmethod
     def _get_in_context_examples_prompt(embeddings: list[PickledEmbedding]) -> str:
-        examples = [example["example"] for example in embeddings]
+        return BaseToolRAG.format_in_context_examples(
+            [example["example"] for example in embeddings]
+        )
+
+    @staticmethod
+    def format_in_context_examples(examples: Sequence[str]) -> str:
         examples_prompt = "###\n".join(examples)
         return f"{examples_prompt}###\n"
@@ -1,4 +1,5 @@
 import os
+import threading
 from typing import Any, Sequence
 
 import torch
@@ -13,12 +14,15 @@ from transformers import (
 
 from tinyagent.src.tiny_agent.models import TinyAgentToolName
 from tinyagent.src.tiny_agent.tool_rag.base_tool_rag import BaseToolRAG, ToolRAGResult
+from tinyagent.src.tiny_agent.tool_rag.query_cache import QueryCache, get_query_cache
 from tinyagent.src.tools.base import StructuredTool, Tool
 
 
 class ClassifierToolRAG(BaseToolRAG):
     _CLASSIFIER_MODEL_NAME = "squeeze-ai-lab/TinyAgent-ToolRAG"
     _DEFAULT_TOOL_THRESHOLD = 0.5
+    # Number of queries per classifier forward pass in the batched API
+    _CLASSIFIER_BATCH_SIZE = 32
     _NUM_LABELS = 17
     _ID_TO_TOOL = {
         0: TinyAgentToolName.CREATE_CALENDAR_EVENT,
@@ -40,9 +44,19 @@ class ClassifierToolRAG(BaseToolRAG):
         16: TinyAgentToolName.ASK_SONAR,
     }
 
+    # The classifier is loaded once per process and shared by all the ClassifierToolRAG instances
+    _shared_tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast | None = None
+    _shared_classifier_model: Any = None
+    _shared_classifier_lock = threading.Lock()
+    # Serializes the tokenizer and model calls, since the HF fast tokenizers can't be called concurrently
+    # (they raise "Already borrowed") and the backend workers and pooled agents share them
+    _shared_inference_lock = threading.Lock()
+
     _tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast
     _classifier_model: Any
     _tool_threshold: float
+    # Cache of the classifier probabilities, so that repeated queries skip the forward pass
+    _tool_probabilities_cache: QueryCache
 
     def __init__(
         self,
@@ -51,23 +65,48 @@ class ClassifierToolRAG(BaseToolRAG):
         ),
         tools: Sequence[Tool | StructuredTool],
         tool_threshold: float = _DEFAULT_TOOL_THRESHOLD,
+        cache_dir: str | None = None,
     ):
-        super().__init__(embedding_model, tools)
+        super().__init__(embedding_model, tools, cache_dir)
 
-        self._tokenizer = AutoTokenizer.from_pretrained(
-            ClassifierToolRAG._CLASSIFIER_MODEL_NAME
+        self._tokenizer, self._classifier_model = ClassifierToolRAG._load_classifier()
+        self._tool_threshold = tool_threshold
+        # The probabilities are cached rather than the tools so that the cache doesn't depend on the threshold
+        self._tool_probabilities_cache = get_query_cache(
+            f"tool_probabilities_{ClassifierToolRAG._CLASSIFIER_MODEL_NAME}", cache_dir
         )
-        self._classifier_model = AutoModelForSequenceClassification.from_pretrained(
-            ClassifierToolRAG._CLASSIFIER_MODEL_NAME,
-            num_labels=ClassifierToolRAG._NUM_LABELS,
-            ignore_mismatched_sizes=True
+
+    @staticmethod
+    def _load_classifier() -> tuple[PreTrainedTokenizer | PreTrainedTokenizerFast, Any]:
+        with ClassifierToolRAG._shared_classifier_lock:
+            if ClassifierToolRAG._shared_classifier_model is None:
+                ClassifierToolRAG._shared_tokenizer = AutoTokenizer.from_pretrained(
+                    ClassifierToolRAG._CLASSIFIER_MODEL_NAME
+                )
+                ClassifierToolRAG._shared_classifier_model = (
+                    AutoModelForSequenceClassification.from_pretrained(
+                        ClassifierToolRAG._CLASSIFIER_MODEL_NAME,
+                        num_labels=ClassifierToolRAG._NUM_LABELS,
+                        ignore_mismatched_sizes=True,
+                    )
+                )
+                ClassifierToolRAG._shared_classifier_model.eval()
+
+        return (
+            ClassifierToolRAG._shared_tokenizer,
+            ClassifierToolRAG._shared_classifier_model,
         )
-        self._tool_threshold = tool_threshold
 
     @property
     def tool_rag_type(self) -> str:
         return "classifier_tool_rag"
 
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        return {
+            **super().get_cache_stats(),
+            "tool_probabilities": self._tool_probabilities_cache.get_stats(),
+        }
+
     def retrieve_examples_and_tools(self, query: str, top_k: int) -> ToolRAGResult:
         """
         Returns the in-context examples as a formatted prompt and the tools that are relevant to the query.
@@ -77,9 +116,8 @@ class ClassifierToolRAG(BaseToolRAG):
         retrieved_tools = self._classify_tools(query)
         # Filter the tools that are available
         retrieved_tools = list(set(retrieved_tools) & set(self._available_tools))
-        filtered_embeddings = self._load_filtered_embeddings(retrieved_tools)
         retrieved_embeddings = self._retrieve_top_k_embeddings(
-            query, filtered_embeddings, top_k
+            query, top_k, filter_tools=retrieved_tools
         )
 
         in_context_examples_prompt = BaseToolRAG._get_in_context_examples_prompt(
@@ -89,27 +127,133 @@ class ClassifierToolRAG(BaseToolRAG):
         return ToolRAGResult(
             in_context_examples_prompt=in_context_examples_prompt,
             retrieved_tools_set=retrieved_tools,
+            example_ids=self.embedding_index.get_example_ids(retrieved_embeddings),
+            in_context_examples=[
+                example["example"] for example in retrieved_embeddings
+            ],
         )
 
-    def _classify_tools(self, query: str) -> list[TinyAgentToolName]:
+    def retrieve_examples_and_tools_batch(
+        self, queries: Sequence[str], top_k: int
+    ) -> list[ToolRAGResult]:
         """
-        Retrieves the best tools for the given query by classification.
+        Batched version of retrieve_examples_and_tools that classifies the queries in batches,
+        embeds them with a single call and retrieves the examples of all the queries at once.
         """
-        inputs = self._tokenizer(
-            query, return_tensors="pt", padding=True, truncation=True, max_length=512
+        retrieved_tools = [
+            list(set(self._get_tools_above_threshold(probs)) & set(self._available_tools))
+            for probs in self._get_tool_probabilities_batch(queries)
+        ]
+        retrieved_embeddings = self._retrieve_top_k_embeddings_batch(
+            queries, top_k, filter_tools=retrieved_tools
         )
 
-        # Get the output probabilities
-        with torch.no_grad():
-            outputs = self._classifier_model(**inputs)
-            logits = outputs.logits
-            probs = torch.sigmoid(logits)
+        return [
+            ToolRAGResult(
+                in_context_examples_prompt=BaseToolRAG._get_in_context_examples_prompt(
+                    embeddings
+                ),
+                retrieved_tools_set=tools,
+                example_ids=self.embedding_index.get_example_ids(embeddings),
+                in_context_examples=[example["example"] for example in embeddings],
+            )
+            for tools, embeddings in zip(retrieved_tools, retrieved_embeddings)
+        ]
 
-        # Retrieve the tools that have a probability greater than the threshold
-        retrieved_tools = [
+    def get_tool_probabilities(self, query: str) -> dict[TinyAgentToolName, float]:
+        """
+        Returns the classifier probability of each available tool for the given query.
+        """
+        probs = self._get_tool_probabilities(query)
+        return {
+            tool_name: probs[i]
+            for i, tool_name in ClassifierToolRAG._ID_TO_TOOL.items()
+            if tool_name in self._available_tools
+        }
+
+    def _classify_tools(self, query: str) -> list[TinyAgentToolName]:
+        """
+        Retrieves the best tools for the given query by classification.
+        """
+        return self._get_tools_above_threshold(self._get_tool_probabilities(query))
+
+    def _get_tools_above_threshold(
+        self, probs: Sequence[float]
+    ) -> list[TinyAgentToolName]:
+        """
+        Retrieves the tools that have a probability greater than the threshold.
+        """
+        return [
             ClassifierToolRAG._ID_TO_TOOL[i]
-            for i, prob in enumerate(probs[0])
+            for i, prob in enumerate(probs)
             if prob > self._tool_threshold
         ]
 
-        return retrieved_tools
+    def _get_tool_probabilities(self, query: str) -> list[float]:
+        """
+        Returns the classifier probability of each tool for the given query, indexed by the tool id.
+        """
+        probs = self._tool_probabilities_cache.get(query)
+        if probs is not None:
+            return probs
+
+        with ClassifierToolRAG._shared_inference_lock:
+            inputs = self._tokenizer(
+                query, return_tensors="pt", padding=True, truncation=True, max_length=512
+            )
+
+            # Get the output probabilities
+            with torch.no_grad():
+                outputs = self._classifier_model(**inputs)
+                logits = outputs.logits
+                probs = torch.sigmoid(logits)[0].tolist()
+
+        self._tool_probabilities_cache.put(query, probs)
+
+        return probs
+
+    def _get_tool_probabilities_batch(
+        self, queries: Sequence[str]
+    ) -> list[list[float]]:
+        """
+        Batched version of _get_tool_probabilities. The cache misses are deduplicated and
+        run through the classifier in padded batches of _CLASSIFIER_BATCH_SIZE queries.
+        """
+        probs_list = [self._tool_probabilities_cache.get(query) for query in queries]
+
+        missing_queries: dict[str, str] = {}
+        for query, probs in zip(queries, probs_list):
+            if probs is None:
+                missing_queries.setdefault(QueryCache.normalize_query(query), query)
+
+        missing_keys = list(missing_queries.keys())
+        missing_probs: dict[str, list[float]] = {}
+        for start in range(0, len(missing_keys), ClassifierToolRAG._CLASSIFIER_BATCH_SIZE):
+            batch_keys = missing_keys[
+                start : start + ClassifierToolRAG._CLASSIFIER_BATCH_SIZE
+            ]
+            with ClassifierToolRAG._shared_inference_lock:
+                inputs = self._tokenizer(
+                    [missing_queries[key] for key in batch_keys],
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                    max_length=512,
+                )
+
+                with torch.no_grad():
+                    outputs = self._classifier_model(**inputs)
+                    batch_probs = torch.sigmoid(outputs.logits).tolist()
+
+            for key, probs in zip(batch_keys, batch_probs):
+                missing_probs[key] = probs
+                self._tool_probabilities_cache.put(key, probs)
+
+        return [
+            (
+                probs
+                if probs is not None
+                else missing_probs[QueryCache.normalize_query(query)]
+            )
+            for query, probs in zip(queries, probs_list)
+        ]
@@ -0,0 +1,159 @@
+import os
+import pickle
+import threading
+from typing import Collection, Sequence
+
+import torch
+from typing_extensions import TypedDict
+
+from tinyagent.src.tiny_agent.models import TinyAgentToolName
+
+
+class PickledEmbedding(TypedDict):
+    example: str
+    embedding: torch.Tensor
+    tools: Sequence[str]
+
+
+# Bit of each tool in the bitmask of a tool set
+_TOOL_TO_BIT = {tool.value: 1 << i for i, tool in enumerate(TinyAgentToolName)}
+# Unknown tools share a bit that is never available, so the examples that use them are filtered out
+_UNKNOWN_TOOL_BIT = 1 << len(TinyAgentToolName)
+
+
+def get_tools_bitmask(tools: Collection[str | TinyAgentToolName]) -> int:
+    bitmask = 0
+    for tool in tools:
+        tool_name = tool.value if isinstance(tool, TinyAgentToolName) else tool
+        bitmask |= _TOOL_TO_BIT.get(tool_name, _UNKNOWN_TOOL_BIT)
+    return bitmask
+
+
+class EmbeddingIndex:
+    """
+    In-memory index of the in-context examples in the embeddings.pkl file.
+    The example embeddings are kept in a single contiguous, L2-normalized float32 matrix and the
+    tools used by each example are kept as a bitmask, so that filtering the examples by the available
+    tools and retrieving the top k examples is a single masked matrix multiplication.
+    The index is read-only after it is built, hence it can be shared by all the ToolRAG instances.
+    """
+
+    # The modification time of the embeddings file that the index is built from
+    mtime: int
+    example_ids: list[str]
+    examples: list[PickledEmbedding]
+    # (num_examples, embedding_dim) matrix of the normalized example embeddings
+    _embeddings: torch.Tensor
+    # (num_examples,) bitmasks of the tools that each example uses
+    _tools_bitmasks: torch.Tensor
+    # ID of each example by the identity of its object, which is stable since the index is read-only
+    _example_ids_by_object: dict[int, str]
+
+    def __init__(self, embeddings: dict[str, PickledEmbedding], mtime: int) -> None:
+        self.mtime = mtime
+        self.example_ids = list(embeddings.keys())
+        self.examples = list(embeddings.values())
+        self._example_ids_by_object = {
+            id(example): example_id for example_id, example in embeddings.items()
+        }
+
+        if len(self.examples) > 0:
+            matrix = torch.stack(
+                [
+                    torch.as_tensor(example["embedding"], dtype=torch.float32)
+                    for example in self.examples
+                ]
+            )
+            self._embeddings = torch.nn.functional.normalize(matrix, dim=1).contiguous()
+        else:
+            self._embeddings = torch.empty((0, 0), dtype=torch.float32)
+
+        self._tools_bitmasks = torch.tensor(
+            [get_tools_bitmask(example["tools"]) for example in self.examples],
+            dtype=torch.int64,
+        )
+
+    @staticmethod
+    def load(path: str) -> "EmbeddingIndex":
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "rb") as file:
+            embeddings: dict[str, PickledEmbedding] = pickle.load(file)
+        return EmbeddingIndex(embeddings, mtime)
+
+    def get_filter_mask(self, tools: Collection[str | TinyAgentToolName]) -> torch.Tensor:
+        """
+        Returns a boolean mask of the examples whose tools are all in the given tools.
+        """
+        disallowed_bitmask = ~get_tools_bitmask(tools)
+        return torch.bitwise_and(self._tools_bitmasks, disallowed_bitmask) == 0
+
+    def get_example_ids(self, examples: Sequence[PickledEmbedding]) -> list[str]:
+        """
+        Returns the IDs of the given examples. The examples that don't come from this index, e.g. from
+        the index before the embeddings file was reloaded, are identified by their text instead.
+        """
+        return [
+            self._example_ids_by_object.get(id(example), example["example"])
+            for example in examples
+        ]
+
+    def get_examples(self, mask: torch.Tensor) -> list[PickledEmbedding]:
+        return [self.examples[i] for i in mask.nonzero().flatten().tolist()]
+
+    def search(
+        self, query_embedding: torch.Tensor, mask: torch.Tensor, top_k: int
+    ) -> list[PickledEmbedding]:
+        """
+        Returns the top k examples among the masked ones by the cosine similarity to the query.
+        """
+        query_embedding = torch.nn.functional.normalize(
+            query_embedding.to(torch.float32), dim=0
+        )
+        similarities = self._embeddings @ query_embedding
+        similarities = similarities.masked_fill(~mask, float("-inf"))
+
+        top_k = min(top_k, int(mask.sum()))
+        _, top_k_indices = torch.topk(similarities, top_k)
+
+        return [self.examples[i] for i in top_k_indices.tolist()]
+
+    def search_batch(
+        self, query_embeddings: torch.Tensor, masks: torch.Tensor, top_k: int
+    ) -> list[list[PickledEmbedding]]:
+        """
+        Batched version of search: query_embeddings is a (num_queries, embedding_dim) matrix and
+        masks is a (num_queries, num_examples) boolean matrix with the filter mask of each query.
+        """
+        query_embeddings = torch.nn.functional.normalize(
+            query_embeddings.to(torch.float32), dim=1
+        )
+        similarities = query_embeddings @ self._embeddings.T
+        similarities = similarities.masked_fill(~masks, float("-inf"))
+
+        top_k = min(top_k, similarities.shape[1])
+        _, top_k_indices = torch.topk(similarities, top_k, dim=1)
+        num_allowed = masks.sum(dim=1).tolist()
+
+        return [
+            [self.examples[i] for i in indices[: min(top_k, allowed)]]
+            for indices, allowed in zip(top_k_indices.tolist(), num_allowed)
+        ]
+
+
+_embedding_indices: dict[str, EmbeddingIndex] = {}
+_embedding_indices_lock = threading.Lock()
+
+
+def get_embedding_index(path: str) -> EmbeddingIndex:
+    """
+    Returns the shared EmbeddingIndex of the given embeddings file.
+    The file is only loaded the first time, and again whenever it is modified.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    with _embedding_indices_lock:
+        index = _embedding_indices.get(path)
+        if index is None or index.mtime != mtime:
+            index = EmbeddingIndex.load(path)
+            _embedding_indices[path] = index
+
+    return index
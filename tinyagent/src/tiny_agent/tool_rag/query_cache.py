@@ -0,0 +1,181 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from tinyagent.src.utils.logger_utils import log
+
+
+class QueryCache:
+    """
+    A bounded LRU cache with a TTL for the per-query results of the ToolRAG, such as the query embeddings
+    and the classifier probabilities. The entries are keyed by the normalized query text so that the same
+    command with different casing or spacing hits the same entry. If a persist_path is given, the cache
+    is loaded from that file on creation and written back periodically, on a background thread so that
+    the retrieval path never waits on the disk, and at exit.
+    """
+
+    _DEFAULT_MAX_SIZE = 2048
+    _DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+    # Number of writes after which a persisted cache is saved to disk
+    _SAVE_EVERY = 32
+
+    _entries: OrderedDict[str, tuple[float, list[float]]]
+    _max_size: int
+    _ttl_seconds: float
+    _persist_path: str | None
+    _lock: threading.Lock
+    # Serializes the writes of the cache file, which happen outside of _lock
+    _save_lock: threading.Lock
+    _hits: int
+    _misses: int
+    _num_unsaved_writes: int
+    _is_saving: bool
+
+    def __init__(
+        self,
+        max_size: int = _DEFAULT_MAX_SIZE,
+        ttl_seconds: float = _DEFAULT_TTL_SECONDS,
+        persist_path: str | None = None,
+    ) -> None:
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._persist_path = persist_path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._num_unsaved_writes = 0
+        self._is_saving = False
+
+        if persist_path is not None:
+            self._load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, query: str) -> list[float] | None:
+        key = QueryCache.normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self._ttl_seconds:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, query: str, value: list[float]) -> None:
+        key = QueryCache.normalize_query(query)
+        with self._lock:
+            self._entries[key] = (time.time(), list(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+            self._num_unsaved_writes += 1
+            should_save = (
+                self._persist_path is not None
+                and not self._is_saving
+                and self._num_unsaved_writes >= QueryCache._SAVE_EVERY
+            )
+            if should_save:
+                self._is_saving = True
+
+        if should_save:
+            threading.Thread(target=self._save_in_background, daemon=True).start()
+
+    def get_stats(self) -> dict[str, float]:
+        with self._lock:
+            num_lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / num_lookups if num_lookups > 0 else 0.0,
+                "size": len(self._entries),
+            }
+
+    def save(self) -> None:
+        if self._persist_path is None:
+            return
+
+        with self._save_lock:
+            # The values are copied on put and never mutated, so a shallow snapshot is enough
+            with self._lock:
+                entries = list(self._entries.items())
+                self._num_unsaved_writes = 0
+
+            persist_dir = os.path.dirname(self._persist_path) or "."
+            os.makedirs(persist_dir, exist_ok=True)
+            # Write to a unique temporary file first so that a crash doesn't leave a corrupted cache
+            # behind, and so that concurrent writers of the same file don't clobber each other
+            with tempfile.NamedTemporaryFile(
+                "w", dir=persist_dir, suffix=".tmp", delete=False
+            ) as file:
+                tmp_path = file.name
+                try:
+                    json.dump(entries, file)
+                except BaseException:
+                    file.close()
+                    os.remove(tmp_path)
+                    raise
+            os.replace(tmp_path, self._persist_path)
+
+    def _save_in_background(self) -> None:
+        try:
+            self.save()
+        except OSError as e:
+            # Failing to persist the cache is not fatal, it is retried on the next writes and at exit
+            log(f"Failed to save the query cache to {self._persist_path}: {e}")
+        finally:
+            with self._lock:
+                self._is_saving = False
+
+    def _load(self) -> None:
+        if self._persist_path is None or not os.path.exists(self._persist_path):
+            return
+
+        try:
+            with open(self._persist_path, "r") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            # A corrupted cache is not fatal, just start from an empty one
+            return
+
+        now = time.time()
+        for key, (timestamp, value) in entries[-self._max_size :]:
+            if now - timestamp <= self._ttl_seconds:
+                self._entries[key] = (timestamp, value)
+
+
+_query_caches: dict[tuple[str, str | None], QueryCache] = {}
+_query_caches_lock = threading.Lock()
+
+
+def get_query_cache(name: str, persist_dir: str | None = None) -> QueryCache:
+    """
+    Returns the process-wide QueryCache with the given name and persist_dir, creating it on the first call.
+    If persist_dir is given, the cache is persisted to a file named after the cache in that directory.
+    """
+    persist_path = (
+        os.path.abspath(os.path.join(persist_dir, f"{name.replace('/', '_')}.json"))
+        if persist_dir is not None
+        else None
+    )
+    with _query_caches_lock:
+        cache = _query_caches.get((name, persist_path))
+        if cache is None:
+            cache = QueryCache(persist_path=persist_path)
+            _query_caches[(name, persist_path)] = cache
+
+    return cache
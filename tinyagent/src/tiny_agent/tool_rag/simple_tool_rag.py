@@ -5,6 +5,7 @@ from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
 
 from tinyagent.src.tiny_agent.models import TinyAgentToolName
 from tinyagent.src.tiny_agent.tool_rag.base_tool_rag import BaseToolRAG, ToolRAGResult
+from tinyagent.src.tiny_agent.tool_rag.embedding_index import PickledEmbedding
 from tinyagent.src.tools.base import StructuredTool, Tool
 
 
@@ -15,23 +16,40 @@ class SimpleToolRAG(BaseToolRAG):
             AzureOpenAIEmbeddings | OpenAIEmbeddings | HuggingFaceEmbeddings
         ),
         tools: Sequence[Tool | StructuredTool],
+        cache_dir: str | None = None,
     ):
-        super().__init__(embedding_model, tools)
+        super().__init__(embedding_model, tools, cache_dir)
 
     @property
     def tool_rag_type(self) -> str:
         return "simple_tool_rag"
 
+    def retrieve_examples_and_tools_batch(
+        self, queries: Sequence[str], top_k: int
+    ) -> list[ToolRAGResult]:
+        """
+        Batched version of retrieve_examples_and_tools that embeds all the queries with a single call.
+        """
+        return [
+            self._get_tool_rag_result(retrieved_embeddings)
+            for retrieved_embeddings in self._retrieve_top_k_embeddings_batch(
+                queries, top_k
+            )
+        ]
+
     def retrieve_examples_and_tools(self, query: str, top_k: int) -> ToolRAGResult:
         """
         Returns the in-context examples as a formatted prompt and the tools that are relevant to the query
         It first filters the examples based on the tools that are available and then retrieves the examples
         and tools based on the query.
         """
-        filtered_embeddings = self._load_filtered_embeddings()
-        retrieved_embeddings = self._retrieve_top_k_embeddings(
-            query, filtered_embeddings, top_k
-        )
+        retrieved_embeddings = self._retrieve_top_k_embeddings(query, top_k)
+        return self._get_tool_rag_result(retrieved_embeddings)
+
+    def _get_tool_rag_result(
+        self,
+        retrieved_embeddings: list[PickledEmbedding],
+    ) -> ToolRAGResult:
         in_context_examples_prompt = BaseToolRAG._get_in_context_examples_prompt(
             retrieved_embeddings
         )
@@ -49,4 +67,8 @@ class SimpleToolRAG(BaseToolRAG):
         return ToolRAGResult(
             in_context_examples_prompt=in_context_examples_prompt,
             retrieved_tools_set=tools_names,
+            example_ids=self.embedding_index.get_example_ids(retrieved_embeddings),
+            in_context_examples=[
+                example["example"] for example in retrieved_embeddings
+            ],
         )
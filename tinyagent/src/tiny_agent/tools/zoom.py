@@ -1,5 +1,7 @@
+import asyncio
 import datetime
-from typing import Sequence, TypedDict
+import email.utils
+from typing import Any, Sequence, TypedDict
 from zoneinfo import ZoneInfo
 
 import aiohttp
@@ -9,6 +11,16 @@ import dateutil.parser
 class Zoom:
     _TIMEZONE = "US/Pacific"
     _MEETINGS_ENDPOINT = "https://api.zoom.us/v2/users/me/meetings"
+    _TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5)
+    _CONNECTION_LIMIT = 10
+    _MAX_RETRIES = 3
+    _RETRY_BACKOFF_SECONDS = 0.5
+    # Statuses for which the request was not processed, so it can be retried without creating the
+    # meeting twice. Gateway errors (502, 504) are not among them since the gateway may give up after
+    # Zoom has already created the meeting.
+    _RETRY_STATUSES = {429, 503}
+    # A Retry-After longer than this isn't waited for, the request fails instead
+    _MAX_RETRY_AFTER_SECONDS = 10.0
 
     class ZoomMeetingInfo(TypedDict):
         """
@@ -19,8 +31,93 @@ class Zoom:
 
         join_url: str
 
+    _access_token: str
+    # Shared session, which keeps the connections to the Zoom API alive across the calls. It is created
+    # lazily since it must be created within the event loop that uses it.
+    _session: aiohttp.ClientSession | None
+
     def __init__(self, access_token: str) -> None:
         self._access_token = access_token
+        self._session = None
+
+    @property
+    def access_token(self) -> str:
+        return self._access_token
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=Zoom._CONNECTION_LIMIT),
+                timeout=Zoom._TIMEOUT,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Closes the shared session. A new one is created if the instance is used again."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, url: str, payload: dict[str, Any]) -> dict[str, Any]:
+        """
+        Posts the payload to the Zoom API and returns the JSON response. Retries with exponential backoff
+        on the errors to connect, which happen before the request is sent, and on the statuses for which
+        the request was not processed, honoring their Retry-After.
+        """
+        attempt = 0
+        while True:
+            delay = Zoom._RETRY_BACKOFF_SECONDS * 2**attempt
+            try:
+                async with self._get_session().post(
+                    url,
+                    headers={
+                        "Authorization": f"Bearer {self._access_token}",
+                        "Content-Type": "application/json",
+                    },
+                    json=payload,
+                ) as resp:
+                    retry_after = Zoom._get_retry_after(resp)
+                    if (
+                        resp.status not in Zoom._RETRY_STATUSES
+                        or attempt == Zoom._MAX_RETRIES
+                        or (
+                            retry_after is not None
+                            and retry_after > Zoom._MAX_RETRY_AFTER_SECONDS
+                        )
+                    ):
+                        if resp.status >= 400:
+                            raise ValueError(
+                                f"Zoom API request failed with status {resp.status}: {await resp.text()}"
+                            )
+                        return await resp.json()
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+            except aiohttp.ClientConnectorError:
+                if attempt == Zoom._MAX_RETRIES:
+                    raise
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _get_retry_after(resp: aiohttp.ClientResponse) -> float | None:
+        """Seconds to wait according to the Retry-After header, which is either seconds or an HTTP date."""
+        value = resp.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(
+            (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0
+        )
 
     async def get_meeting_link(
         self,
@@ -41,13 +138,9 @@ class Zoom:
 
         topic = topic[:200]
 
-        resp = await aiohttp.ClientSession().post(
+        info: Zoom.ZoomMeetingInfo = await self._post(
             Zoom._MEETINGS_ENDPOINT,
-            headers={
-                "Authorization": f"Bearer {self._access_token}",
-                "Content-Type": "application/json",
-            },
-            json={
+            {
                 "topic": topic,
                 "start_time": start_time_utc,
                 "duration": duration,
@@ -55,6 +148,4 @@ class Zoom:
             },
         )
 
-        info: Zoom.ZoomMeetingInfo = await resp.json()
-
         return info["join_url"]
@@ -2,6 +2,7 @@ import abc
 import audioop
 import io
 import json
+import os
 import wave
 from dataclasses import dataclass
 
@@ -10,6 +11,31 @@ from openai import AsyncOpenAI
 
 from tinyagent.src.tiny_agent.models import TinyAgentConfig
 
+# Connection pool limits and timeouts of the HTTP client used to talk to the local Whisper.cpp server
+WHISPER_MAX_CONNECTIONS = int(os.environ.get("TINYAGENT_WHISPER_MAX_CONNECTIONS", "4"))
+WHISPER_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("TINYAGENT_WHISPER_MAX_KEEPALIVE_CONNECTIONS", "4")
+)
+WHISPER_KEEPALIVE_EXPIRY = float(os.environ.get("TINYAGENT_WHISPER_KEEPALIVE_EXPIRY", "300"))
+# The read timeout has to cover the inference itself, which can take a while for long recordings
+WHISPER_TIMEOUT = float(os.environ.get("TINYAGENT_WHISPER_TIMEOUT", "60"))
+WHISPER_CONNECT_TIMEOUT = 5.0
+
+
+def create_whisper_http_client() -> httpx.AsyncClient:
+    """
+    Creates the long-lived HTTP client for the Whisper.cpp server, which keeps its connections alive
+    across the transcriptions. The caller owns it and has to close it with aclose().
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=WHISPER_MAX_CONNECTIONS,
+            max_keepalive_connections=WHISPER_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=WHISPER_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(WHISPER_TIMEOUT, connect=WHISPER_CONNECT_TIMEOUT),
+    )
+
 
 @dataclass
 class ResampledAudio:
@@ -65,19 +91,30 @@ class WhisperCppClient(WhisperClient):
     }
 
     _base_url: str
+    # Shared client with pooled keep-alive connections, which is owned by the caller. If None, each
+    # transcription opens its own client.
+    _http_client: httpx.AsyncClient | None
 
-    def __init__(self, config: TinyAgentConfig):
+    def __init__(
+        self, config: TinyAgentConfig, http_client: httpx.AsyncClient | None = None
+    ):
         self._base_url = f"http://localhost:{config.whisper_config.port}/inference"
+        self._http_client = http_client
 
     async def transcribe(self, file: io.BytesIO) -> str:
         # Preparing the files dictionary
         files = {"file": ("audio.wav", file, "audio/wav")}
 
         # Send the request to the Whisper.cpp server
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        if self._http_client is not None:
+            response = await self._http_client.post(
                 self._base_url, files=files, data=WhisperCppClient._NON_DATA_FIELDS
             )
+        else:
+            async with create_whisper_http_client() as client:
+                response = await client.post(
+                    self._base_url, files=files, data=WhisperCppClient._NON_DATA_FIELDS
+                )
 
         data = response.json()
         if "text" not in data:
@@ -1,7 +1,14 @@
+import atexit
+import contextvars
+import io
 import json
 import os
+import queue
+import threading
 import time
+import uuid
 from collections import defaultdict
+from typing import Any
 
 import numpy as np
 
@@ -11,6 +18,11 @@ from tinyagent.src.tiny_agent.models import TINY_AGENT_DIR
 LOG_ENABLED = True
 LOG_TO_FILE = True
 LOG_FILE_PATH = os.path.join(TINY_AGENT_DIR, "log.txt")
+# Structured events, one JSON object per line, for consumers that shouldn't have to scrape the text log
+EVENTS_FILE_PATH = os.path.join(TINY_AGENT_DIR, "events.jsonl")
+# Log files are rotated once they exceed this size, keeping LOG_BACKUP_COUNT old files
+LOG_MAX_BYTES = int(os.environ.get("TINYAGENT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("TINYAGENT_LOG_BACKUP_COUNT", "3"))
 
 # Create the log file if it doesn't exist
 if not os.path.exists(LOG_FILE_PATH):
@@ -72,6 +84,132 @@ def enable_logging_to_file(enable=True):
     LOG_TO_FILE = enable
 
 
+# Correlation ID of the current run, which is inherited by the asyncio tasks spawned by the run
+_run_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "tinyagent_run_id", default=None
+)
+
+
+def new_run_id() -> str:
+    """Start a new run in the current context and return its correlation ID."""
+    run_id = uuid.uuid4().hex
+    _run_id.set(run_id)
+    return run_id
+
+
+def get_run_id() -> str | None:
+    return _run_id.get()
+
+
+class _LogWriter:
+    """
+    Writes the log records to the log files from a background thread, so that logging never blocks the
+    event loop on file IO. The records are batched: each flush writes everything that was queued since
+    the last one. A single record is always written in one piece, so concurrent runs don't interleave
+    within a record.
+    """
+
+    _MAX_BATCH_SIZE = 256
+
+    _queue: queue.SimpleQueue
+    _thread: threading.Thread | None
+    _thread_lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def write(self, text: str | None, event: dict[str, Any] | None) -> None:
+        self._ensure_started()
+        self._queue.put(("write", text, event))
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Block until every record queued before this call has been written."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(("flush", done, None))
+        done.wait(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="tinyagent-log-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < _LogWriter._MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_commands(batch)
+            except Exception as e:
+                # Keep the thread alive, otherwise the later records are lost and flush() hangs
+                print(f"Failed to write the log: {e}")
+            finally:
+                for command, payload, _ in batch:
+                    if command == "flush":
+                        payload.set()
+
+    def _write_commands(self, batch: list[tuple[str, Any, dict[str, Any] | None]]) -> None:
+        texts: list[str] = []
+        events: list[str] = []
+        for command, payload, event in batch:
+            if command == "write":
+                if payload is not None:
+                    texts.append(payload)
+                if event is not None:
+                    try:
+                        events.append(json.dumps(event, default=str) + "\n")
+                    except ValueError as e:
+                        # e.g. a circular reference, which only loses this event
+                        print(f"Failed to serialize the log event {event.get('event')}: {e}")
+            elif command == "flush":
+                # Write out what was queued before the flush first
+                self._write_batch(texts, events)
+                texts, events = [], []
+                payload.set()
+
+        self._write_batch(texts, events)
+
+    def _write_batch(self, texts: list[str], events: list[str]) -> None:
+        try:
+            if len(texts) > 0:
+                _write_with_rotation(LOG_FILE_PATH, "".join(texts))
+            if len(events) > 0:
+                _write_with_rotation(EVENTS_FILE_PATH, "".join(events))
+        except OSError as e:
+            print(f"Failed to write the log: {e}")
+
+
+def _write_with_rotation(path: str, content: str) -> None:
+    if os.path.exists(path) and os.path.getsize(path) + len(content) > LOG_MAX_BYTES:
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if LOG_BACKUP_COUNT > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            open(path, "w").close()
+
+    with open(path, "a") as f:
+        f.write(content)
+
+
+_log_writer = _LogWriter()
+atexit.register(_log_writer.flush, 5.0)
+
+
 def log(*args, block=False, **kwargs):
     """Print the given string only if logging is enabled."""
     if LOG_ENABLED:
@@ -81,12 +219,30 @@ def log(*args, block=False, **kwargs):
         if block:
             print("=" * 80)
     if LOG_TO_FILE:
-        with open(LOG_FILE_PATH, "a") as f:
-            if block:
-                print("=" * 80, file=f)
-            print(*args, **kwargs, file=f)
-            if block:
-                print("=" * 80, file=f)
+        buffer = io.StringIO()
+        if block:
+            print("=" * 80, file=buffer)
+        print(*args, **kwargs, file=buffer)
+        if block:
+            print("=" * 80, file=buffer)
+        record = buffer.getvalue()
+        run_id = get_run_id()
+        if run_id is not None:
+            # Every line carries the run ID, so that the lines of concurrent runs can be told apart
+            record = "".join(
+                f"[{run_id}] {line}" for line in record.splitlines(keepends=True)
+            )
+        _log_writer.write(record, None)
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """Record a structured event of the current run to the events file."""
+    if LOG_TO_FILE:
+        _log_writer.write(None, _make_event(event, **fields))
+
+
+def _make_event(event: str, **fields: Any) -> dict[str, Any]:
+    return {"ts": time.time(), "run_id": get_run_id(), "event": event, **fields}
 
 
 def flush_results(save_path, results):